@@ -0,0 +1,151 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Works out where lvm would probably put a new LV, from an extent map only.
+# This follows the broad rules of lvm's allocation policies, not every detail
+# of them, it's meant for rejecting requests which can't possibly work and
+# giving an idea of which PVs would be used.  Cling is treated like normal,
+# we don't look at tags or at where existing LVs are.
+
+POLICIES = ('contiguous', 'cling', 'normal', 'anywhere')
+
+# Number of data stripes lvm uses for raid levels when none are given
+_DEFAULT_STRIPES = dict(raid4=2, raid5=2, raid6=3, raid10=2)
+
+
+def _div_up(a, b):
+    return (a + b - 1) / b
+
+
+def layout_areas(layout, extents, num_stripes=0, num_copies=0):
+    """
+    The parallel areas an LV of the given layout needs, areas have to be on
+    different PVs unless the allocation policy is anywhere.
+    :param layout:      linear, striped, mirror, raid0, raid1, raid4, raid5,
+                        raid6 or raid10
+    :param extents:     Size of the LV in extents
+    :param num_stripes: Number of (data) stripes, 0 for the default
+    :param num_copies:  Number of additional copies for mirror, raid1 and
+                        raid10, 0 for the default
+    :return: List of (data extents, metadata extents), the metadata goes on
+             the same PV as the data
+    """
+    if layout == 'linear':
+        return [(extents, 0)]
+
+    if layout in ('striped', 'raid0'):
+        stripes = max(num_stripes, 1)
+        return [(_div_up(extents, stripes), 0)] * stripes
+
+    if layout == 'mirror':
+        # Images plus a log on a PV of its own
+        return [(extents, 0)] * (max(num_copies, 1) + 1) + [(1, 0)]
+
+    if layout == 'raid1':
+        return [(extents, 1)] * (max(num_copies, 1) + 1)
+
+    if layout in ('raid4', 'raid5', 'raid6'):
+        stripes = num_stripes or _DEFAULT_STRIPES[layout]
+        parity = 2 if layout == 'raid6' else 1
+        return [(_div_up(extents, stripes), 1)] * (stripes + parity)
+
+    if layout == 'raid10':
+        stripes = num_stripes or _DEFAULT_STRIPES[layout]
+        images = stripes * (max(num_copies, 1) + 1)
+        return [(_div_up(extents, stripes), 1)] * images
+
+    raise ValueError('Unsupported layout %s' % layout)
+
+
+def _take(free, pv_name, need, contiguous):
+    """
+    Take extents from the free ranges of a PV, lowest first
+    :return: List of (pv_name, start, count), None if there aren't enough
+    """
+    if contiguous:
+        for i, (start, size) in enumerate(free):
+            if size >= need:
+                free[i] = (start + need, size - need)
+                return [(pv_name, start, need)]
+        return None
+
+    if sum(size for start, size in free) < need:
+        return None
+
+    rc = []
+    for i, (start, size) in enumerate(free):
+        if not need:
+            break
+        count = min(size, need)
+        if count:
+            rc.append((pv_name, start, count))
+            free[i] = (start + count, size - count)
+            need -= count
+    return rc
+
+
+def plan(extent_map, pvs, areas, policy='normal'):
+    """
+    Decide where the areas of a new LV would go
+    :param extent_map:  VgExtentMap of the VG
+    :param pvs:         List of (pv_name, pe_count) of the PVs which may be
+                        used, in the order lvm considers them (VG order)
+    :param areas:       Output of layout_areas
+    :param policy:      One of POLICIES
+    :return: (fits, list of (pv_name, start, count)), the list is empty when
+             it doesn't fit
+    """
+    if policy not in POLICIES:
+        raise ValueError('Unsupported allocation policy %s' % policy)
+
+    free = dict((name, extent_map.free(name, pe_count))
+                for name, pe_count in pvs)
+    order = [name for name, pe_count in pvs]
+    contiguous = policy == 'contiguous'
+    used = set()
+    rc = []
+
+    # A single area may carry on over the following PVs, like a linear LV
+    # does, unless it has to be contiguous
+    if len(areas) == 1 and not contiguous:
+        data, meta = areas[0]
+        need = data + meta
+        for name in order:
+            if not need:
+                break
+            count = min(need, sum(size for start, size in free[name]))
+            if count:
+                rc.extend(_take(free[name], name, count, False))
+                need -= count
+        if need:
+            return False, []
+        return True, rc
+
+    for data, meta in areas:
+        # The PV with the most free space which isn't used by another area,
+        # a lone area simply goes on the first PV it fits on
+        candidates = [n for n in order if policy == 'anywhere' or
+                      n not in used]
+        if len(areas) > 1:
+            candidates.sort(key=lambda n: -sum(s for start, s in free[n]))
+
+        for name in candidates:
+            taken = _take(free[name], name, data + meta, contiguous)
+            if taken:
+                rc.extend(taken)
+                used.add(name)
+                break
+        else:
+            return False, []
+
+    return True, rc
@@ -15,9 +15,13 @@
 
 import dbus
 import cfg
-from utils import get_properties, add_properties, get_object_property_diff
+from utils import get_properties, get_object_property_diff, \
+    get_property_values, introspect_interfaces, introspect_xml
 from state import State
 
+# (class, interface) -> introspection XML of the interfaces of the objects
+_introspect_cache = {}
+
 
 # noinspection PyPep8Naming
 class AutomatedProperties(dbus.service.Object):
@@ -36,6 +40,8 @@ class AutomatedProperties(dbus.service.Object):
         self._ap_o_path = object_path
         self._ap_search_method = search_method
         self.state = None
+        # (state, {interface: property values}), see _property_values
+        self._ap_props = None
 
     def dbus_object_path(self):
         return self._ap_o_path
@@ -48,6 +54,28 @@ class AutomatedProperties(dbus.service.Object):
 
         return self._ap_o_path, props
 
+    def _property_values(self, interface=None):
+        """
+        Retrieve the dbus property values of the object.  The values of
+        objects with state only change when the state is replaced, so they
+        are kept until then.
+        :param interface: The interface we want the values for, None for all
+        :return: Hash of property names and values, not to be modified
+        """
+        if self.state is None:
+            return get_property_values(self, interface)
+
+        cached = self._ap_props
+        if cached is None or cached[0] is not self.state:
+            cached = (self.state, {})
+            self._ap_props = cached
+
+        values = cached[1].get(interface)
+        if values is None:
+            values = get_property_values(self, interface)
+            cached[1][interface] = values
+        return values
+
     def interface(self, all_interfaces=False):
         return [self._ap_interface]
 
@@ -56,7 +84,11 @@ class AutomatedProperties(dbus.service.Object):
     @dbus.service.method(dbus_interface=dbus.PROPERTIES_IFACE,
                          in_signature='ss', out_signature='v')
     def Get(self, interface_name, property_name):
-        value = getattr(self, property_name)
+        values = self._property_values()
+        if property_name in values:
+            value = values[property_name]
+        else:
+            value = getattr(self, property_name)
         # Note: If we get an exception in this handler we won't know about it,
         # only the side effect of no returned value!
         print 'Get (%s), type (%s), value(%s)' % \
@@ -68,7 +100,7 @@ class AutomatedProperties(dbus.service.Object):
     def GetAll(self, interface_name):
         if interface_name in self.interface():
             # Using introspection, lets build this dynamically
-            return get_properties(self, interface_name)[1]
+            return self._property_values(interface_name)
         raise dbus.exceptions.DBusException(
             self._ap_interface,
             'The object %s does not implement the %s interface'
@@ -78,17 +110,30 @@ class AutomatedProperties(dbus.service.Object):
                          in_signature='ssv')
     def Set(self, interface_name, property_name, new_value):
         setattr(self, property_name, new_value)
+        self._ap_props = None
         self.PropertiesChanged(interface_name,
                                {property_name: new_value}, [])
 
     # As dbus-python does not support introspection for properties we will
     # get the autogenerated xml and then add our wanted properties to it.
+    # The interfaces are the same for every object of a class, so that is
+    # only done once, the child nodes are filled in for each call.
     @dbus.service.method(dbus_interface=dbus.INTROSPECTABLE_IFACE,
                          out_signature='s')
     def Introspect(self):
-        r = dbus.service.Object.Introspect(self, self._ap_o_path, cfg.bus)
-        # Look at the properties in the class
-        return add_properties(r, self._ap_interface, get_properties(self)[0])
+        key = (self.__class__, self._ap_interface)
+        interfaces = _introspect_cache.get(key)
+
+        if interfaces is None:
+            r = dbus.service.Object.Introspect(self, self._ap_o_path, cfg.bus)
+            # Look at the properties in the class
+            interfaces = introspect_interfaces(r, self._ap_interface,
+                                               get_properties(self)[0])
+            _introspect_cache[key] = interfaces
+
+        return introspect_xml(
+            self._ap_o_path, interfaces,
+            cfg.bus.list_exported_child_objects(self._ap_o_path))
 
     @dbus.service.signal(dbus_interface=dbus.PROPERTIES_IFACE,
                          signature='sa{sv}as')
@@ -141,12 +186,18 @@ class AutomatedProperties(dbus.service.Object):
         # TODO: We need to add locking to prevent concurrent access to the
         # properties so that a client is not accessing while we are
         # replacing.
-        o_prop = get_properties(self)[1]
+        o_prop = self._property_values()
+        cached = self._ap_props
         self.state = new_state
-        n_prop = get_properties(self)[1]
+        n_prop = self._property_values()
 
         changed = get_object_property_diff(o_prop, n_prop)
 
+        # Nothing changed, the values we had for each interface are still good
+        if not changed:
+            cached[1][None] = n_prop
+            self._ap_props = (new_state, cached[1])
+
         if changed:
             self.PropertiesChanged(self._ap_interface, changed, [])
             num_changed += 1
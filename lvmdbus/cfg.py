@@ -14,7 +14,6 @@
 # Copyright 2015, Tony Asleson <tasleson@redhat.com>
 import os
 import multiprocessing
-import Queue
 import itertools
 
 LVM_CMD = os.getenv('LVM_DBUSCMD', '/usr/sbin/lvm')
@@ -34,11 +33,37 @@ DEBUG = True
 # Use lvm shell
 USE_SHELL = False
 
+# Number of lvm shells to run concurrently when using the lvm shell
+SHELL_POOL_SIZE = int(os.getenv('LVM_DBUS_SHELL_POOL_SIZE', '4'))
+
 # Lock used by pprint
 stdout_lock = multiprocessing.Lock()
 
+# Number of threads processing requests
+WORKER_THREADS = int(os.getenv('LVM_DBUS_WORKER_THREADS', '4'))
+
+# External and udev events are collected into one refresh until none have
+# arrived for the quiet period, but not for longer than the max latency (secs)
+EVENT_QUIET_PERIOD = float(os.getenv('LVM_DBUS_EVENT_QUIET_PERIOD', '0.5'))
+EVENT_MAX_LATENCY = float(os.getenv('LVM_DBUS_EVENT_MAX_LATENCY', '3'))
+
+# Where the PV, VG and LV state comes from, 'lvm' runs the lvm reports,
+# 'lvmetad' reads the lvmetad metadata cache (falling back to lvm when that
+# isn't possible), see inventory.py
+INVENTORY = os.getenv('LVM_DBUS_INVENTORY', 'lvm')
+
+# When set, every response from lvmetad is written to this file for debugging
+LVMETAD_DUMP = os.getenv('LVM_DBUS_LVMETAD_DUMP')
+
+# Reports are run again once their results are this old (secs) even when
+# nothing we know of has changed, 0 disables caching them
+REPORT_CACHE_MAX_AGE = float(os.getenv('LVM_DBUS_REPORT_CACHE_MAX_AGE',
+                                       '10'))
+
 kick_q = multiprocessing.Queue()
-worker_q = Queue.Queue()
+
+# Requests to process, a scheduler.RequestScheduler set up at start up
+worker_q = None
 
 # Main event loop
 loop = None
@@ -14,14 +14,13 @@
 # Copyright 2014-2015, Tony Asleson <tasleson@redhat.com>
 
 from subprocess import Popen, PIPE
-import traceback
-import sys
 import time
 import cfg
 import threading
+import json
 from itertools import chain
 
-from lvm_shell_proxy import LVMShellProxy
+from lvm_shell_proxy import LVMShellPool
 
 
 SEP = '{|}'
@@ -29,15 +28,30 @@ SEP = '{|}'
 
 total_time = 0.0
 total_count = 0
+_stats_lock = threading.Lock()
 
-# We need to prevent different threads from using the same lvm shell
-# at the same time.
-cmd_lock = threading.Lock()
+# Results of report commands, command line -> (time, (rc, out, err)).  The
+# results are only good for the generation they were made in, which ends
+# when anything is changed through us, a udev event or an external event
+# arrives, see invalidate_reports.
+_report_cache = {}
+_generation = 0
+_cache_stats = dict(hits=0, misses=0)
+
+# Report commands, these don't change anything so it's safe to re-run them
+READ_ONLY_CMDS = frozenset(['pvs', 'vgs', 'lvs', 'fullreport', 'version'])
+
+# Note: There is no serialization of commands here, requests which need
+# to be ordered are serialized by the scheduler (per VG) before they get
+# here, lvm itself takes care of the on disk locking.
 
 # The actual method which gets called to invoke the lvm command, can vary
 # from forking a new process to using lvm shell
 _t_call = None
 
+# The pool of lvm shells when using lvm shell
+_shell_pool = None
+
 
 def _debug_c(cmd, exit_code, out):
     print 'CMD:', ' '.join(cmd)
@@ -52,10 +66,6 @@ def call_lvm(command, debug=False):
     :param command:     Command to execute
     :param debug:       Dump debug to stdout
     """
-    #print 'STACK:'
-    #for line in traceback.format_stack():
-    #    print line.strip()
-
     # Prepend the full lvm executable so that we can run different versions
     # in different locations on the same box
     command.insert(0, cfg.LVM_CMD)
@@ -76,9 +86,10 @@ def call_lvm(command, debug=False):
 
 def _shell_cfg():
     global _t_call
-    print 'Using lvm shell!'
-    lvm_shell = LVMShellProxy()
-    _t_call = lvm_shell.call_lvm
+    global _shell_pool
+    print 'Using lvm shell! (%d shells)' % cfg.SHELL_POOL_SIZE
+    _shell_pool = LVMShellPool(cfg.SHELL_POOL_SIZE, READ_ONLY_CMDS)
+    _t_call = _shell_pool.call_lvm
 
 
 if cfg.USE_SHELL:
@@ -89,37 +100,158 @@ else:
 
 def set_execution(shell):
     global _t_call
-    with cmd_lock:
-        _t_call = None
-        if shell:
-            print 'Using lvm shell!'
-            lvm_shell = LVMShellProxy()
-            _t_call = lvm_shell.call_lvm
-        else:
-            _t_call = call_lvm
+    global _shell_pool
+
+    # Other threads may be calling lvm, so never leave _t_call unset
+    if shell:
+        _shell_cfg()
+    else:
+        _shell_pool = None
+        _t_call = call_lvm
 
 
-def time_wrapper(command, debug=False):
+def shell_pool_stats():
+    """
+    :return: Usage of the lvm shell pool, see LVMShellPool.stats, an empty
+             pool is reported when we are forking lvm for every command.
+    """
+    pool = _shell_pool
+    if pool:
+        return pool.stats()
+    return dict(queue_depth=0, workers=[])
+
+
+def invalidate_reports():
+    """
+    Start a new generation of report results, to be called whenever
+    something may have changed on disk
+    """
+    global _generation
+    with _stats_lock:
+        _generation += 1
+        _report_cache.clear()
+
+
+def report_cache_stats():
+    """
+    :return: Hash with the number of reports answered from the cache (hits)
+             and run (misses), the current generation and the number of
+             reports cached
+    """
+    with _stats_lock:
+        return dict(_cache_stats, generation=_generation,
+                    entries=len(_report_cache))
+
+
+def _timed_call(command, debug):
     global total_time
     global total_count
 
-    with cmd_lock:
-        start = time.time()
-        results = _t_call(command, debug)
+    start = time.time()
+    results = _t_call(command, debug)
+
+    with _stats_lock:
         total_time += (time.time() - start)
         total_count += 1
 
     return results
 
 
+def time_wrapper(command, debug=False, cache=True):
+    """
+    Run an lvm command.  The results of reports are kept until the next
+    generation, while nothing changes the same report is only run once.
+    :param command: Command and arguments
+    :param debug:   Dump debug to stdout
+    :param cache:   Use the report cache, reports of things which change by
+                    themselves (eg. progress of a pvmove) should not
+    :return: Tuple of exitcode, stdout, stderr
+    """
+    if command[0] not in READ_ONLY_CMDS:
+        # Reports running while the command runs may see the changes half
+        # way through, so they don't get cached either
+        invalidate_reports()
+        try:
+            return _timed_call(command, debug)
+        finally:
+            invalidate_reports()
+
+    if not cache or cfg.REPORT_CACHE_MAX_AGE <= 0:
+        return _timed_call(command, debug)
+
+    # The command line has the command, the columns and the selection
+    key = tuple(command)
+    now = time.time()
+
+    with _stats_lock:
+        cached = _report_cache.get(key)
+        if cached and now - cached[0] <= cfg.REPORT_CACHE_MAX_AGE:
+            _cache_stats['hits'] += 1
+            return cached[1]
+        _cache_stats['misses'] += 1
+        generation = _generation
+
+    results = _timed_call(command, debug)
+
+    with _stats_lock:
+        if results[0] == 0 and generation == _generation:
+            _report_cache[key] = (now, results)
+
+    return results
+
+
 call = time_wrapper
 
 
+# Report columns which hold numbers, everything else is a string.  Sizes are
+# requested in bytes without a suffix, percentages may have a fraction.
+_U64_COLUMNS = frozenset([
+    'pv_size', 'pv_free', 'pv_used', 'dev_size', 'pv_mda_size',
+    'pv_mda_free', 'pv_ba_start', 'pv_ba_size', 'pe_start', 'pv_pe_count',
+    'pv_pe_alloc_count', 'vg_size', 'vg_free', 'vg_extent_size',
+    'vg_extent_count', 'vg_free_count', 'max_lv', 'max_pv', 'pv_count',
+    'lv_count', 'snap_count', 'vg_seqno', 'vg_mda_count', 'vg_mda_free',
+    'vg_mda_size', 'vg_mda_used_count', 'lv_size'])
+
+_PERCENT_COLUMNS = frozenset(['data_percent', 'copy_percent'])
+
+# When True, lvm hands us the reports as JSON instead of separated text, see
+# report_format_select
+_json_report = False
+
+
+def _u64(v):
+    if not v:
+        return 0L
+    if v.endswith('B'):
+        return long(v[:-1])
+    return long(float(v))
+
+
+def _percent(v):
+    if not v:
+        return 0
+    return int(float(v))
+
+
+def _typed_row(column_names, values):
+    row = dict(zip(column_names, values))
+    for c in column_names:
+        if c in _U64_COLUMNS:
+            row[c] = _u64(row[c])
+        elif c in _PERCENT_COLUMNS:
+            row[c] = _percent(row[c])
+    return row
+
+
 # Default cmd
 # Place default arguments for every command here.
 def _dc(cmd, args):
-    c = [cmd, '--noheading', '--separator', '%s' % SEP, '--nosuffix',
-         '--unbuffered', '--units', 'b']
+    if _json_report:
+        c = [cmd, '--reportformat', 'json', '--nosuffix', '--units', 'b']
+    else:
+        c = [cmd, '--noheading', '--separator', '%s' % SEP, '--nosuffix',
+             '--unbuffered', '--units', 'b']
     c.extend(args)
     return c
 
@@ -144,17 +276,82 @@ def parse(out):
     return rc
 
 
-def parse_column_names(out, column_names):
-    lines = parse(out)
+def _parse_json(out, column_names):
     rc = []
 
-    for i in range(0, len(lines)):
-        d = dict(zip(column_names, lines[i]))
-        rc.append(d)
+    # eg. {"report": [{"pv": [{"pv_name":"/dev/sdb", ...}, ...]}]}, the key
+    # of the row list depends on the report type (pv, vg, lv, seg, pvseg)
+    for report in json.loads(out)['report']:
+        for rows in report.values():
+            for r in rows:
+                rc.append(_typed_row(column_names,
+                                     [r.get(c, '') for c in column_names]))
+    return rc
+
+
+def parse_column_names(out, column_names):
+    """
+    Parse the output of a report into rows, numeric columns are converted
+    into numbers.
+    :param out:             Report output from lvm
+    :param column_names:    The columns requested, in requested order
+    :return: List of hashes, column name to value
+    """
+    if _json_report:
+        return _parse_json(out, column_names)
+
+    rc = []
+    for line in parse(out):
+        # Single column reports have no separators in them
+        if not isinstance(line, list):
+            line = [line]
+        rc.append(_typed_row(column_names, line))
 
     return rc
 
 
+def _parse_retrieve(rc, out, column_names, selection):
+    """
+    Parse the result of retrieving objects.  When specific objects were asked
+    for lvm fails the command if any of them don't exist, but still reports
+    on those which do, we want those so that they don't look to be gone too.
+    :param rc:              Exit code of the command
+    :param out:             Report output from lvm
+    :param column_names:    The columns requested, in requested order
+    :param selection:       The objects asked for, None for all
+    :return: List of hashes, column name to value
+    """
+    if rc == 0:
+        return parse_column_names(out, column_names)
+
+    if selection and out:
+        try:
+            return parse_column_names(out, column_names)
+        except (ValueError, KeyError):
+            pass
+    return []
+
+
+def report_format_select():
+    """
+    Check to see if the lvm we are using can hand us JSON formatted reports
+    and use them if it can, otherwise fall back to parsing text.  This is
+    intended to be called once at start up.
+    :return: True if JSON reports are being used
+    """
+    global _json_report
+
+    _json_report = True
+    rc, out, err = call(_dc('vgs', ['-o', 'vg_name']))
+
+    try:
+        _json_report = rc == 0 and 'report' in json.loads(out)
+    except ValueError:
+        _json_report = False
+
+    return _json_report
+
+
 def options_to_cli_args(options):
     rc = []
     for k, v in dict(options).items():
@@ -163,19 +360,53 @@ def options_to_cli_args(options):
     return rc
 
 
-def pvs_in_vg(vg_name):
-    rc, out, error = call(_dc('vgs', ['-o', 'pv_name,pv_uuid', vg_name]))
-    if rc == 0:
-        return parse(out)
-    return []
+def _in_vg(columns, vg_names):
+    # Group the rows of a vgs report by the VG they belong to, VGs without
+    # any of the requested sub-objects report a row with empty columns.
+    d = {}
+    cmd = _dc('vgs', ['-o', ','.join(['vg_name'] + columns)])
+
+    if vg_names:
+        cmd.extend(vg_names)
 
+    rc, out, err = call(cmd)
+    for l in _parse_retrieve(rc, out, ['vg_name'] + columns, vg_names):
+        members = d.setdefault(l['vg_name'], [])
+        if l[columns[0]]:
+            members.append(tuple(l[c] for c in columns))
+    return d
 
-def lvs_in_vg(vg_name):
-    rc, out, error = call(_dc('vgs', ['-o', 'lv_name,lv_attr,lv_uuid',
-                                      vg_name]))
+
+def pvs_in_vg(vg_names=None):
+    """
+    Retrieve the PVs for the specified VGs (all when None) with one command
+    :param vg_names: List of VG names or None
+    :return: Hash of VG name to list of (pv_name, pv_uuid)
+    """
+    return _in_vg(['pv_name', 'pv_uuid'], vg_names)
+
+
+def pv_vg_seqnos():
+    """
+    Retrieve every PV with the VG it belongs to and the metadata sequence
+    number of the VG, a cheap way of finding out what changed since we last
+    looked as every VG has at least one PV.
+    :return: List of hashes, None if the command failed
+    """
+    columns = ['pv_name', 'pv_uuid', 'vg_name', 'vg_uuid', 'vg_seqno']
+    rc, out, err = call(_dc('pvs', ['-o', ','.join(columns)]), cache=False)
     if rc == 0:
-        return parse(out)
-    return []
+        return parse_column_names(out, columns)
+    return None
+
+
+def lvs_in_vg(vg_names=None):
+    """
+    Retrieve the LVs for the specified VGs (all when None) with one command
+    :param vg_names: List of VG names or None
+    :return: Hash of VG name to list of (lv_name, lv_attr, lv_uuid)
+    """
+    return _in_vg(['lv_name', 'lv_attr', 'lv_uuid'], vg_names)
 
 
 def pv_remove(device, remove_options):
@@ -321,7 +552,12 @@ def vg_lv_create_mirror(vg_name, create_options, name, size_bytes, num_copies):
 def lv_remove(lv_path, remove_options):
     cmd = ['lvremove']
     cmd.extend(options_to_cli_args(remove_options))
-    cmd.extend(['-f', lv_path])
+    cmd.append('-f')
+
+    if isinstance(lv_path, list):
+        cmd.extend(lv_path)
+    else:
+        cmd.append(lv_path)
     return call(cmd)
 
 
@@ -340,14 +576,6 @@ def lv_lv_create(lv_full_name, create_options, name, size_bytes):
     return call(cmd)
 
 
-def pv_segments(device):
-    r = []
-    rc, out, err = call(_dc('pvs', ['-o', 'pvseg_all', device]))
-    if rc == 0:
-        r = parse(out)
-    return r
-
-
 def pv_retrieve(device=None):
     columns = ['pv_name', 'pv_uuid', 'pv_fmt', 'pv_size', 'pv_free',
                'pv_used', 'dev_size', 'pv_mda_size', 'pv_mda_free',
@@ -361,13 +589,7 @@ def pv_retrieve(device=None):
         cmd.extend(device)
 
     rc, out, err = call(cmd)
-
-    d = []
-
-    if rc == 0:
-        d = parse_column_names(out, columns)
-
-    return d
+    return _parse_retrieve(rc, out, columns, device)
 
 
 def pv_resize(device, size_bytes, create_options):
@@ -412,59 +634,66 @@ def pv_move_lv(move_options, lv_full_name,
     return call(cmd)
 
 
-def _pv_move_find_lv(lookup, device_name, vg_name):
-    for l in lookup:
-        if device_name in l['devices'] and l['vg_name'] == vg_name:
-            return l['lv_name']
-    return None
-
-
-def pv_move_status():
-    lv_in_motion = {}
-
-    columns = ['pv_name', 'lv_uuid', 'vg_name', 'lv_name', 'devices',
-               'copy_percent']
-
-    cmd = _dc('pvs', ['-o' + ','.join(columns), '-S', 'copy_percent>=0'])
-
-    lookup_columns = ['lv_name', 'vg_name', 'devices']
-
-    lookup = _dc('lvs', ['-o' + ','.join(lookup_columns),
-                         '-S', 'devices=~"pvmove[0-9]+"'])
-
-    rc, out, err = call(cmd, False)
-    if rc == 0:
-        lines = parse_column_names(out, columns)
-        if len(lines) > 0:
-            rc, lookup_out, lookup_err = call(lookup, False)
-
-            if rc == 0:
-                lookup = parse_column_names(lookup_out, lookup_columns)
+# Pvmoves, mirrors (also without initial sync), raid LVs (likewise) and thin
+# pools, along with the LVs being moved
+_PROGRESS_SELECT = 'lv_attr=~"^[pmMrRt]" || devices=~"pvmove[0-9]+"'
 
-                for l in lines:
-                    if l['lv_name'][0] == '[':
-                        l['lv_name'] = l['lv_name'][1:-1]
 
-                    # Parse the devices
-                    src, dest = l['devices'].split(',')
-                    src = src.split('(')[0]
-                    dest = dest.split('(')[0]
-
-                    if l['pv_name'] != src:
-                        continue
-
-                    lv_being_moved = _pv_move_find_lv(lookup, l['lv_name'],
-                                                      l['vg_name'])
-
-                    lv_full_name = "%s/%s" % (l['vg_name'], lv_being_moved)
-
-                    if lv_full_name not in lv_in_motion:
-                        lv_in_motion[lv_full_name] = \
-                            dict(src_dev=src,
-                                 dest_dev=dest,
-                                 percent=int(float(l['copy_percent'])))
-
-    return lv_in_motion
+def progress_status():
+    """
+    Retrieve the progress of everything lvm does in the background with one
+    report: pvmoves, raid and mirror syncs and how full thin pools are.  The
+    report is never cached as it changes by itself.
+    :return: (moves, lvs), moves is a hash of the full name of the LV being
+             moved to a hash with src_dev, dest_dev and percent, lvs a hash
+             of the full name of raid, mirror and thin pool LVs to their
+             copy (sync) or data percent.  None if the command failed
+    """
+    columns = ['lv_name', 'vg_name', 'lv_parent', 'lv_attr', 'copy_percent',
+               'data_percent', 'devices']
+
+    cmd = _dc('lvs', ['-a', '-o', ','.join(columns), '-S', _PROGRESS_SELECT])
+
+    rc, out, err = call(cmd, False, False)
+    if rc != 0:
+        return None
+
+    pvmoves = {}
+    moved = {}
+    lvs = {}
+
+    # Segment columns (devices) make lvs report a row per segment
+    for l in parse_column_names(out, columns):
+        vg_name = l['vg_name']
+        lv_name = _strip_hidden(l['lv_name'])
+        kind = l['lv_attr'][0:1]
+
+        if kind == 'p':
+            # The pvmove is a mirror of the source and the destination
+            devices = [d.split('(')[0] for d in l['devices'].split(',')]
+            if (vg_name, lv_name) not in pvmoves and len(devices) > 1:
+                pvmoves[(vg_name, lv_name)] = dict(
+                    src_dev=devices[0], dest_dev=devices[1],
+                    percent=l['copy_percent'])
+        elif kind == 't':
+            lvs['%s/%s' % (vg_name, lv_name)] = l['data_percent']
+        elif kind and kind in 'mMrR' and not l['lv_name'].startswith('['):
+            lvs['%s/%s' % (vg_name, lv_name)] = l['copy_percent']
+
+        # The LV being moved, or the one its hidden sub LV belongs to
+        if 'pvmove' in l['devices']:
+            if l['lv_name'].startswith('[') and l['lv_parent']:
+                lv_name = _strip_hidden(l['lv_parent'])
+            for d in l['devices'].split(','):
+                d = d.split('(')[0]
+                if d.startswith('pvmove'):
+                    moved.setdefault((vg_name, d), lv_name)
+
+    moves = {}
+    for key, move in pvmoves.items():
+        if key in moved:
+            moves['%s/%s' % (key[0], moved[key])] = move
+    return moves, lvs
 
 
 def pv_allocatable(device, yes, allocation_options):
@@ -479,46 +708,37 @@ def pv_allocatable(device, yes, allocation_options):
     return call(cmd)
 
 
-def _lv_device(data, key, search, pe_device_parse, attrib, uuid):
-    device, seg = pe_device_parse.split(':')
-
-    if search != device:
-        return
+def _strip_hidden(lv_name):
+    # Hidden LVs are reported with their name in brackets
+    if lv_name.startswith('['):
+        return lv_name[1:-1]
+    return lv_name
 
-    r1, r2 = seg.split('-')
 
-    if key in data:
-        data[key]['segs'].append((r1, r2))
-        data[key]['attrib'] = attrib
-        data[key]['uuid'] = uuid
-    else:
-        data[key] = {}
-        data[key]['segs'] = [((r1, r2))]
-        data[key]['attrib'] = attrib
-        data[key]['uuid'] = uuid
+def lv_segments(vg_names=None):
+    """
+    Retrieve every LV segment, including the ones belonging to hidden
+    sub LVs (raid images, pool data etc.), for the specified VGs (all when
+    None) with one command.
+    :param vg_names: List of VG names or None
+    :return: List of hashes, one for each segment
+    """
+    columns = ['lv_uuid', 'lv_name', 'lv_attr', 'vg_name', 'vg_seqno',
+               'lv_parent', 'seg_pe_ranges', 'segtype']
 
+    cmd = _dc('lvs', ['-a', '-o', ','.join(columns)])
 
-def pv_contained_lv(device):
-    data = []
-    tmp = {}
-    cmd = _dc('lvs', ['-o', 'uuid,lv_name,lv_attr,seg_pe_ranges',
-                      '-S', 'seg_pe_ranges=~"%s.*"' % (device)])
+    if vg_names:
+        cmd.extend(vg_names)
 
     rc, out, err = call(cmd)
-    if rc == 0:
-        d = parse(out)
-        for l in d:
-            if ' ' not in l[3]:
-                _lv_device(tmp, l[1], device, l[3], l[2], l[0])
-            else:
-                pe_ranges = l[3].split(' ')
-                for pe in pe_ranges:
-                    _lv_device(tmp, l[1], device, pe, l[2], l[0])
 
-        for k, v in tmp.items():
-            data.append((k, v['segs'], v['attrib'], v['uuid']))
-
-    return data
+    d = _parse_retrieve(rc, out, columns, vg_names)
+    for l in d:
+        l['hidden'] = l['lv_name'].startswith('[')
+        l['lv_name'] = _strip_hidden(l['lv_name'])
+        l['lv_parent'] = _strip_hidden(l['lv_parent'])
+    return d
 
 
 def vg_create(create_options, pv_devices, name):
@@ -639,12 +859,8 @@ def vg_retrieve(vg_specific):
     if vg_specific:
         cmd.extend(vg_specific)
 
-    d = []
     rc, out, err = call(cmd)
-    if rc == 0:
-        d = parse_column_names(out, columns)
-
-    return d
+    return _parse_retrieve(rc, out, columns, vg_specific)
 
 
 def lv_retrieve(lv_name):
@@ -654,7 +870,7 @@ def lv_retrieve(lv_name):
 
     columns = ['lv_uuid', 'lv_name', 'lv_path', 'lv_size',
                 'vg_name', 'pool_lv_uuid', 'pool_lv', 'origin_uuid',
-                'origin', 'data_percent',
+                'origin', 'data_percent', 'copy_percent',
                'lv_attr', 'lv_tags', 'vg_uuid']
 
     cmd = _dc('lvs', ['-o', ','.join(columns)])
@@ -663,60 +879,8 @@ def lv_retrieve(lv_name):
         cmd.extend(lv_name)
 
     rc, out, err = call(cmd)
+    return _parse_retrieve(rc, out, columns, lv_name)
 
-    d = []
-
-    if rc == 0:
-        d = parse_column_names(out, columns)
-
-    return d
-
-
-def _pv_device(data, device, uuid, seg_type):
-    device, seg = device.split(':')
-    r1, r2 = seg.split('-')
-
-    if device in data:
-        data[device]['ranges'].append((r1, r2, seg_type))
-        data[device]['uuid'] = uuid
-    else:
-        data[device] = dict()
-        data[device]['ranges'] = [((r1, r2, seg_type))]
-        data[device]['uuid'] = uuid
-
-
-def lv_pv_devices(lv_name):
-    data = []
-    tmp = {}
-
-    cmd = _dc('pvs', ['-o', 'uuid,seg_pe_ranges,seg_type', '-S',
-                      'lv_full_name=~"%s.+"' % lv_name])
-
-    rc, out, err = call(cmd)
-
-    try:
-        if rc == 0:
-            d = parse(out)
-            for l in d:
-                # We have a striped result set where all lines are repeats
-                # so handle this line and break out.
-                # No idea why this is the odd one!
-                if ' ' in l[1]:
-                    devices = l[1].split(' ')
-                    for d in devices:
-                        _pv_device(tmp, d, l[0], l[2])
-                    break
-                else:
-                    _pv_device(tmp, l[1], l[0], l[2])
-
-            for k, v in tmp.items():
-                data.append((k, v['ranges'], v['uuid']))
-
-    except Exception:
-        traceback.print_exc(file=sys.stdout)
-        pass
-
-    return data
 
 if __name__ == '__main__':
     pv_data = pv_retrieve()
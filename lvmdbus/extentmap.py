@@ -0,0 +1,243 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import bisect
+import threading
+
+# eg. '/dev/sdb:0-99 /dev/sdc:0-99'
+_PE_RANGE = re.compile(r'(\S+):(\d+)-(\d+)')
+
+# The most recent map of each VG, see latest
+_latest = {}
+_latest_lock = threading.Lock()
+
+
+class VgExtentMap(object):
+    """
+    Which extents of the PVs of a VG are used by which LV.  For each PV the
+    used ranges are kept sorted by their first extent, so finding what is at
+    an extent, or how much is free from there on, is a binary search.
+    Extents used by hidden sub LVs (raid images, pool data etc.) are
+    accounted to the visible LV they belong to.
+    """
+
+    def __init__(self, vg_name):
+        self.vg_name = vg_name
+        # Sequence number of the VG metadata the map was built from, None
+        # when it's not known
+        self.seqno = None
+        # PV name -> ([first extent, ...], [(first, last, lv, segtype), ...])
+        self._pvs = {}
+        # LV name -> [(pv_name, first, last, segtype), ...]
+        self._lvs = {}
+        # LV name -> (lv_attr, lv_uuid, [segtype, ...])
+        self._lv_info = {}
+
+    def _add_lv(self, lv_name, attr, uuid):
+        if lv_name not in self._lv_info:
+            self._lv_info[lv_name] = (attr, uuid, [])
+            self._lvs[lv_name] = []
+        return self._lv_info[lv_name][2]
+
+    def _add_range(self, pv_name, first, last, lv_name, segtype):
+        self._pvs.setdefault(pv_name, ([], []))[1].append(
+            (first, last, lv_name, segtype))
+        if lv_name is not None:
+            self._lvs[lv_name].append((pv_name, first, last, segtype))
+
+    def _sort(self):
+        for pv_name, (starts, ranges) in self._pvs.items():
+            ranges.sort()
+            starts[:] = [r[0] for r in ranges]
+
+    def pv_names(self):
+        return self._pvs.keys()
+
+    def lv_names(self):
+        return self._lv_info.keys()
+
+    def lvs_on_pv(self, pv_name):
+        """
+        :param pv_name: PV device name
+        :return: List of (lv_name, [(first, last), ...], lv_attr, lv_uuid)
+        """
+        rc = {}
+        for first, last, lv_name, segtype in self._pvs.get(pv_name,
+                                                           ([], []))[1]:
+            if lv_name is not None:
+                rc.setdefault(lv_name, []).append((first, last))
+        return [(lv_name, segs) + self._lv_info[lv_name][0:2]
+                for lv_name, segs in rc.items()]
+
+    def pvs_of_lv(self, lv_name):
+        """
+        :param lv_name: LV name, without the VG
+        :return: List of (pv_name, [(first, last, segtype), ...])
+        """
+        rc = {}
+        for pv_name, first, last, segtype in self._lvs.get(lv_name, []):
+            rc.setdefault(pv_name, []).append((first, last, segtype))
+        return rc.items()
+
+    def seg_types(self, lv_name):
+        return list(self._lv_info.get(lv_name, (None, None, []))[2])
+
+    def lookup(self, pv_name, pe):
+        """
+        :param pv_name: PV device name
+        :param pe:      Physical extent
+        :return: (lv_name, segtype) using the extent, None when it's free.
+                 lv_name is None for LVs which are not exposed on the bus
+        """
+        starts, ranges = self._pvs.get(pv_name, ([], []))
+        i = bisect.bisect_right(starts, pe) - 1
+        if i >= 0 and ranges[i][1] >= pe:
+            return ranges[i][2:]
+        return None
+
+    def free_at(self, pv_name, pe, pe_count):
+        """
+        :param pv_name:  PV device name
+        :param pe:       Physical extent
+        :param pe_count: Number of extents of the PV
+        :return: Number of free extents starting at pe, 0 when it's used
+        """
+        if pe >= pe_count or self.lookup(pv_name, pe):
+            return 0
+        starts = self._pvs.get(pv_name, ([], []))[0]
+        i = bisect.bisect_right(starts, pe)
+        if i < len(starts):
+            return min(starts[i], pe_count) - pe
+        return pe_count - pe
+
+    def segments(self, pv_name, pe_count):
+        """
+        The used and free segments of a PV in order, like lvm's pvseg_start
+        and pvseg_size report them
+        :param pv_name:  PV device name
+        :param pe_count: Number of extents of the PV
+        :return: List of [start, size]
+        """
+        rc = []
+        pos = 0L
+        for first, last, lv_name, segtype in self._pvs.get(pv_name,
+                                                           ([], []))[1]:
+            if first > pos:
+                rc.append([pos, first - pos])
+            rc.append([first, last - first + 1])
+            pos = max(pos, last + 1)
+        if pos < pe_count or not rc:
+            rc.append([pos, max(pe_count - pos, 0)])
+        return rc
+
+    def free(self, pv_name, pe_count):
+        """
+        :param pv_name:  PV device name
+        :param pe_count: Number of extents of the PV
+        :return: List of (start, size) of the free ranges of the PV
+        """
+        rc = []
+        pos = 0L
+        for first, last, lv_name, segtype in self._pvs.get(pv_name,
+                                                           ([], []))[1]:
+            if first > pos:
+                rc.append((pos, first - pos))
+            pos = max(pos, last + 1)
+        if pos < pe_count:
+            rc.append((pos, pe_count - pos))
+        return rc
+
+
+def build(segments, vg_names=None):
+    """
+    Build the extent maps from the output of lv_segments, which has all the
+    segments of the VGs it was asked about.  The maps are remembered, see
+    latest, except for VGs without any LVs.
+    :param segments: Output from lv_segments
+    :param vg_names: The VGs lv_segments was asked about, None for all
+    :return: Hash of VG name to VgExtentMap
+    """
+    maps = {}
+    for n in vg_names or []:
+        maps[n] = VgExtentMap(n)
+
+    lookup = {}
+    for s in segments:
+        lookup[(s['vg_name'], s['lv_name'])] = s
+
+    def _top(s):
+        while s['lv_parent']:
+            parent = (s['vg_name'], s['lv_parent'])
+            if parent not in lookup:
+                break
+            s = lookup[parent]
+        return s
+
+    for s in segments:
+        m = maps.get(s['vg_name'])
+        if m is None:
+            m = maps[s['vg_name']] = VgExtentMap(s['vg_name'])
+
+        m.seqno = s.get('vg_seqno')
+        top = _top(s)
+
+        # Hidden LVs which don't belong to a visible LV (eg. pmspare,
+        # pvmove) are not exposed on the bus, the extents they use aren't
+        # free though
+        lv_name = None
+        if not top['hidden']:
+            lv_name = top['lv_name']
+            types = m._add_lv(lv_name, top['lv_attr'], top['lv_uuid'])
+            if top is s and s['segtype'] not in types:
+                types.append(s['segtype'])
+
+        # Ranges which point at other LVs rather than devices are covered by
+        # the segments of those LVs
+        for device, r1, r2 in _PE_RANGE.findall(s['seg_pe_ranges']):
+            if device.startswith('/'):
+                m._add_range(device, long(r1), long(r2), lv_name,
+                             s['segtype'])
+
+    for m in maps.values():
+        m._sort()
+
+    with _latest_lock:
+        if vg_names is None:
+            _latest.clear()
+        for n, m in maps.items():
+            if m.seqno is None:
+                # No segments, an old map of a VG of that name is no good
+                _latest.pop(n, None)
+            else:
+                _latest[n] = m
+    return maps
+
+
+def forget(vg_name):
+    """
+    Drop the map of a VG which was removed or renamed
+    :param vg_name: VG name
+    """
+    with _latest_lock:
+        _latest.pop(vg_name, None)
+
+
+def latest(vg_name):
+    """
+    :param vg_name: VG name
+    :return: The most recently built VgExtentMap of the VG, None if there is
+             none
+    """
+    with _latest_lock:
+        return _latest.get(vg_name)
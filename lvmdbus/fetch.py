@@ -14,19 +14,35 @@
 # Copyright 2015, Tony Asleson <tasleson@redhat.com>
 
 import cfg
-from pv import load_pvs
-from vg import load_vgs
+import inventory
+from pv import load_pvs, Pv
+from vg import load_vgs, Vg
 from lv import load_lvs
 
 
-def load(refresh=False):
+def load(refresh=False, skip_unchanged=True):
+    """
+    Load or refresh (when refresh is True) all the PVs, VGs and LVs.
+    :param refresh: Refresh the objects we already have
+    :param skip_unchanged: When refreshing leave the VGs, along with their
+                           PVs and LVs, whose metadata sequence number hasn't
+                           changed alone
+    :return: Number of changes
+    """
+    if refresh and skip_unchanged:
+        with cfg.om.locked(), inventory.snapshot():
+            changed = _changed()
+            if changed is not None:
+                return load_selected(*changed)
 
     num_total_changes = 0
 
     # When we are loading or reloading (refresh) don't let any other threads
     # make changes to the object manager, we want consistent view.
-    with cfg.om.locked():
-        # Go through and load all the PVs, VGs and LVs
+    with cfg.om.locked(), inventory.snapshot():
+        # Go through and load all the PVs, VGs and LVs, each type is
+        # retrieved in bulk with a fixed number of lvm commands regardless
+        # of how many objects are present.
 
         pvs, num_changes = load_pvs(refresh=refresh)
         num_total_changes += num_changes
@@ -47,3 +63,139 @@ def load(refresh=False):
             cfg.om.register_object(l, refresh)
 
     return num_total_changes
+
+
+def _changed():
+    """
+    Figure out what needs refreshing by comparing the VG sequence numbers
+    lvm has with the ones we have.  PVs which are not in a VG have no
+    sequence number, so they are always included.
+    :return: (pv_names, vg_names, lv_names) for load_selected, None when we
+             couldn't find out
+    """
+    rows = inventory.pv_vg_seqnos()
+    if rows is None:
+        return None
+
+    pv_names = set()
+    vg_names = set()
+    current_pvs = {}
+    current_vgs = {}
+
+    for r in rows:
+        current_pvs[r['pv_name']] = r['pv_uuid']
+        if r['vg_name']:
+            current_vgs[r['vg_name']] = (r['vg_uuid'], r['vg_seqno'])
+        else:
+            pv_names.add(r['pv_name'])
+
+    known_vgs = {}
+    for path in cfg.om.object_paths_by_type((Vg,)):
+        vg = cfg.om.get_by_path(path)
+        known_vgs[vg.Name] = (vg.Uuid, vg.Seqno)
+
+    for name in set(current_vgs.keys()) | set(known_vgs.keys()):
+        if current_vgs.get(name) != known_vgs.get(name):
+            vg_names.add(name)
+
+    known_pvs = {}
+    for path in cfg.om.object_paths_by_type((Pv,)):
+        pv = cfg.om.get_by_path(path)
+        known_pvs[pv.lvm_id] = pv.Uuid
+
+    for name in set(current_pvs.keys()) | set(known_pvs.keys()):
+        if current_pvs.get(name) != known_pvs.get(name):
+            pv_names.add(name)
+
+    return pv_names, vg_names, vg_names
+
+
+def _pv_names(paths):
+    # PV device names for a list of PV object paths
+    rc = set()
+    for p in paths:
+        pv = cfg.om.get_by_path(p)
+        if pv:
+            rc.add(pv.lvm_id)
+    return rc
+
+
+def _lv_pv_names(lv_names):
+    # PV device names the specified LVs (vg/lv, or vg for all of them) are
+    # currently known to sit on
+    rc = set()
+    for lv_name in lv_names:
+        if '/' in lv_name:
+            lvs = [cfg.om.get_by_lvm_id(lv_name)]
+        else:
+            vg = cfg.om.get_by_lvm_id(lv_name)
+            lvs = [cfg.om.get_by_path(p) for p in vg.Lvs] if vg else []
+
+        for lv in lvs:
+            if lv:
+                rc.update(_pv_names([d[0] for d in lv.Devices]))
+    return rc
+
+
+def load_selected(pv_names=None, vg_names=None, lv_names=None):
+    """
+    Refresh only the specified objects and their immediate relations instead
+    of everything.  Objects which no longer exist are removed, those which
+    are new are added.
+    :param pv_names: PV device names
+    :param vg_names: VG names, the PVs which are or were in the VG are
+                     refreshed too
+    :param lv_names: LV full names (vg/lv), or VG names to refresh all the LVs
+                     of the VG, the PVs the LVs are or were on are refreshed
+                     too
+    :return: Number of changes
+    """
+    pv_names = set(pv_names or [])
+    vg_names = set(vg_names or [])
+    lv_names = set(lv_names or [])
+
+    # A VG name covers all the LVs in it
+    lv_names = set([l for l in lv_names
+                    if '/' not in l or l.split('/')[0] not in lv_names])
+
+    num_total_changes = 0
+
+    with cfg.om.locked(), inventory.snapshot():
+        if vg_names:
+            for pvs in inventory.pvs_in_vg(list(vg_names)).values():
+                pv_names.update([p[0] for p in pvs])
+
+            for vg_name in vg_names:
+                vg = cfg.om.get_by_lvm_id(vg_name)
+                if vg:
+                    pv_names.update(_pv_names(vg.Pvs))
+
+        pv_names.update(_lv_pv_names(lv_names))
+
+        if pv_names:
+            pvs, num_changes = load_pvs(list(pv_names), refresh=True)
+            num_total_changes += num_changes
+            for p in pvs:
+                cfg.om.register_object(p, True)
+
+        if vg_names:
+            vgs, num_changes = load_vgs(list(vg_names), refresh=True)
+            num_total_changes += num_changes
+            for v in vgs:
+                cfg.om.register_object(v, True)
+
+        if lv_names:
+            lvs, num_changes = load_lvs(list(lv_names), refresh=True)
+            num_total_changes += num_changes
+            for l in lvs:
+                cfg.om.register_object(l, True)
+
+        # The LVs may have been extended onto PVs we didn't refresh
+        new_pvs = _lv_pv_names(lv_names) - pv_names
+        if new_pvs:
+            pvs, num_changes = load_pvs(list(new_pvs), refresh=True)
+            num_total_changes += num_changes
+            for p in pvs:
+                cfg.om.register_object(p, True)
+
+    return num_total_changes
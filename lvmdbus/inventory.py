@@ -0,0 +1,613 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Where the PV, VG and LV state comes from.  The functions here take the same
+# arguments and return the same rows as the cmdhandler reports of the same
+# name.  With cfg.INVENTORY set to 'lvmetad' they are answered from the
+# lvmetad metadata cache, otherwise, or when lvmetad can't answer, by running
+# the lvm reports.
+
+import os
+import socket
+import threading
+from contextlib import contextmanager
+import cfg
+import cmdhandler
+from meta import Lvmetad, LvmetadError
+
+
+def _uuid(uuid):
+    # lvmetad keys some sections by uuids without the dashes
+    if len(uuid) == 32 and '-' not in uuid:
+        return '-'.join([uuid[0:6], uuid[6:10], uuid[10:14], uuid[14:18],
+                         uuid[18:22], uuid[22:26], uuid[26:32]])
+    return uuid
+
+
+def _device_name(dev):
+    # Name of a block device from its device number, using sysfs
+    try:
+        with open('/sys/dev/block/%d:%d/uevent' %
+                  (os.major(dev), os.minor(dev))) as f:
+            for line in f:
+                if line.startswith('DEVNAME='):
+                    return '/dev/' + line.strip()[len('DEVNAME='):]
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def _dm_active(vg_name, lv_name):
+    # An active LV has a device mapper device, dashes in the names are doubled
+    return os.path.exists('/dev/mapper/%s-%s' %
+                          (vg_name.replace('-', '--'),
+                           lv_name.replace('-', '--')))
+
+
+def _sections(d, prefix):
+    # Numbered sub sections, eg. segment1, segment2 or mda0, in order
+    rc = []
+    for k, v in d.items():
+        if k.startswith(prefix) and k[len(prefix):].isdigit():
+            rc.append((int(k[len(prefix):]), v))
+    return [v for k, v in sorted(rc)]
+
+
+# Segment keys which refer to other LVs, the sub LVs are hidden and belong to
+# the LV referring to them.  The value is the lv_attr volume type of the sub
+# LV, None to work it out from the name.
+_SUB_LV_KEYS = dict(stripes='i', mirrors='i', raids=None, mirror_log='l',
+                    pool='T', metadata='e', cache_pool='C')
+
+# lv_attr target type for segment types
+_TARGET = {'mirror': 'm', 'snapshot': 's', 'thin': 't', 'thin-pool': 't',
+           'cache': 'C', 'cache-pool': 'C', 'zero': 'v', 'error': 'v'}
+
+# lv_attr volume type for segment types of visible LVs
+_VOLUME = {'mirror': 'm', 'thin': 'V', 'thin-pool': 't', 'cache': 'C',
+           'cache-pool': 'C', 'zero': 'v', 'error': 'v'}
+
+_ALLOC = dict(contiguous='c', cling='l', normal='n', anywhere='a')
+
+
+class _Model(object):
+    """
+    The reports cmdhandler would produce, built from one lvmetad dump, or
+    from the same sections put together from vg_lookup and pv_list responses
+    for just some of the VGs.
+    """
+
+    def __init__(self, dump, device_name, active, scope=None):
+        """
+        :param dump:        Parsed lvmetad dump
+        :param device_name: See LvmetadInventory
+        :param active:      See LvmetadInventory
+        :param scope:       Names of the VGs the dump is limited to, None
+                            when it has everything
+        """
+        if dump.get('response') != 'OK':
+            raise LvmetadError('lvmetad: %s' %
+                               dump.get('reason', dump.get('response')))
+        if dump.get('global_invalid'):
+            raise LvmetadError('lvmetad: cache is invalid')
+
+        self.device_name = device_name
+        self.active = active
+        self.scope = scope
+
+        self.pvs = []           # pv_retrieve rows
+        self.vgs = []           # vg_retrieve rows
+        self.vg_pvs = {}        # VG name -> list of (pv_name, pv_uuid)
+        self.lvs = []           # lv_retrieve rows
+        self.segments = []      # lv_segments rows
+
+        pvmeta = dict((_uuid(k), v) for k, v in
+                      dump.get('pvid_to_pvmeta', {}).items())
+        vg_names = dict((_uuid(k), v) for k, v in
+                        dump.get('vgid_to_vgname', {}).items())
+
+        in_vg = set()
+        for vg_id, md in dump.get('vgid_to_metadata', {}).items():
+            name = vg_names.get(_uuid(vg_id))
+            if name:
+                in_vg.update(self._vg(name, md, pvmeta))
+
+        # With only some of the VGs we can't tell orphans from PVs of the
+        # VGs we don't have
+        if scope is None:
+            for uuid, meta in sorted(pvmeta.items()):
+                if uuid not in in_vg:
+                    self._orphan(uuid, meta)
+
+    def covers(self, vg_names):
+        """
+        :param vg_names: VG names, None for everything
+        :return: True if the model has everything there is to know about them
+        """
+        return self.scope is None or \
+            (vg_names is not None and self.scope.issuperset(vg_names))
+
+    def _pv_name(self, meta, hint):
+        name = None
+        if 'dev' in meta:
+            name = self.device_name(meta['dev'])
+        return name or hint or '[unknown]'
+
+    @staticmethod
+    def _mdas(meta):
+        return _sections(meta, 'mda')
+
+    def _orphan(self, uuid, meta):
+        name = self._pv_name(meta, None)
+        dev_size = meta.get('size', 0L)
+        pe_start = meta.get('da0', {}).get('offset', 0L)
+        ba = meta.get('ba0', {})
+        mdas = self._mdas(meta)
+
+        self.pvs.append(dict(
+            pv_name=name, pv_uuid=uuid, pv_fmt=meta.get('format', ''),
+            pv_size=dev_size - pe_start, pv_free=dev_size - pe_start,
+            pv_used=0L, dev_size=dev_size,
+            pv_mda_size=min([m.get('size', 0L) for m in mdas] or [0L]),
+            pv_mda_free=min([m.get('free_sectors', 0L) * 512
+                             for m in mdas] or [0L]),
+            pv_ba_start=ba.get('offset', 0L), pv_ba_size=ba.get('size', 0L),
+            pe_start=pe_start, pv_pe_count=0L, pv_pe_alloc_count=0L,
+            pv_attr='---', pv_tags='', vg_name='', vg_uuid=''))
+
+    def _vg(self, vg_name, md, pvmeta):
+        """
+        Add the rows for a VG, its PVs and its LVs
+        :return: uuids of the PVs of the VG
+        """
+        extent_size = md.get('extent_size', 0L) * 512
+        vg_uuid = md.get('id', '')
+        vg_status = md.get('status', [])
+        pvs = md.get('physical_volumes', {})
+        lvs = md.get('logical_volumes', {})
+
+        # PV key in the metadata (eg. pv0) -> [name, uuid, used ranges]
+        pv_info = {}
+        for key, pv in pvs.items():
+            uuid = _uuid(pv.get('id', ''))
+            pv_info[key] = [self._pv_name(pvmeta.get(uuid, {}),
+                                          pv.get('device')), uuid, []]
+
+        # Sub LVs with the LV they belong to and the type they have for it
+        parents = {}
+        for lv_name, lv in lvs.items():
+            for seg in _sections(lv, 'segment'):
+                for key, vol_type in _SUB_LV_KEYS.items():
+                    refs = seg.get(key, [])
+                    if not isinstance(refs, list):
+                        refs = [refs]
+                    for r in refs:
+                        if r in lvs:
+                            parents[r] = (lv_name, vol_type or (
+                                'e' if '_rmeta_' in r else 'i'))
+                if seg.get('type') == 'cache' and seg.get('origin') in lvs:
+                    parents[seg['origin']] = (lv_name, 'o')
+
+        # Old style snapshots, the cow LV and the origin are tied together
+        # by a hidden LV with a snapshot segment
+        origins = {}
+        for lv_name, lv in lvs.items():
+            for seg in _sections(lv, 'segment'):
+                if seg.get('type') == 'snapshot':
+                    origins[seg.get('cow_store')] = seg.get('origin')
+        snap_origins = set(origins.values())
+
+        def _top_type(lv_name):
+            while lv_name in parents:
+                lv_name = parents[lv_name][0]
+            segs = _sections(lvs[lv_name], 'segment')
+            return segs[0].get('type', '') if segs else ''
+
+        lv_count = 0
+        snap_count = 0
+
+        for lv_name, lv in sorted(lvs.items()):
+            status = lv.get('status', []) + lv.get('flags', [])
+            segs = _sections(lv, 'segment')
+            seg_type = segs[0].get('type', '') if segs else ''
+            visible = 'VISIBLE' in status
+            extents = 0L
+            partial = False
+
+            for seg in segs:
+                count = seg.get('extent_count', 0L)
+                extents += count
+                ranges = []
+
+                for key in ('stripes', 'mirrors'):
+                    areas = seg.get(key, [])
+                    length = count
+                    if key == 'stripes':
+                        length = count / max(seg.get('stripe_count', 1), 1)
+                    for i in range(0, len(areas) - 1, 2):
+                        area, start = areas[i], areas[i + 1]
+                        if area in pv_info:
+                            pv_info[area][2].append((start, length))
+                            name = pv_info[area][0]
+                            partial = partial or \
+                                'MISSING' in pvs[area].get('flags', [])
+                        else:
+                            name = area
+                        ranges.append('%s:%d-%d' %
+                                      (name, start, start + length - 1))
+
+                segtype = seg.get('type', '')
+                if segtype == 'striped' and seg.get('stripe_count', 1) == 1:
+                    segtype = 'linear'
+
+                self.segments.append(dict(
+                    lv_uuid=lv.get('id', ''), lv_name=lv_name, lv_attr=None,
+                    vg_name=vg_name, vg_seqno=md.get('seqno', 0L),
+                    lv_parent=parents.get(lv_name, ('',))[0],
+                    seg_pe_ranges=' '.join(ranges), segtype=segtype,
+                    hidden=not visible))
+
+            # lv_attr, see the lvs man page
+            if 'PVMOVE' in status:
+                vol = 'p'
+            elif lv_name in parents:
+                vol = parents[lv_name][1]
+            elif lv_name in origins:
+                vol = 's'
+            elif lv_name in snap_origins:
+                vol = 'o'
+            elif seg_type.startswith('raid'):
+                vol = 'r'
+            else:
+                vol = _VOLUME.get(seg_type, '-' if visible else 'e')
+
+            top_type = _top_type(lv_name)
+            if top_type.startswith('raid'):
+                target = 'r'
+            elif lv_name in origins or lv_name in snap_origins:
+                target = 's'
+            else:
+                target = _TARGET.get(top_type, '-')
+
+            alloc = _ALLOC.get(lv.get('allocation_policy'), 'i')
+            if 'LOCKED' in status:
+                alloc = alloc.upper()
+
+            zero = '-'
+            if seg_type == 'thin-pool' and segs[0].get('zero_new_blocks'):
+                zero = 'z'
+
+            attr = ''.join([
+                vol,
+                'w' if 'WRITE' in status else 'r',
+                alloc,
+                'm' if 'FIXED_MINOR' in status else '-',
+                'a' if self.active(vg_name, lv_name) else '-',
+                '-',
+                target,
+                zero,
+                'p' if partial else '-',
+                'k' if 'ACTIVATION_SKIP' in status else '-'])
+
+            for s in self.segments[len(self.segments) - len(segs):]:
+                s['lv_attr'] = attr
+
+            if not visible:
+                continue
+
+            lv_count += 1
+            if lv_name in origins:
+                snap_count += 1
+
+            def _ref(name):
+                if name and name in lvs:
+                    return name, lvs[name].get('id', '')
+                return '', ''
+
+            pool = ''
+            origin = origins.get(lv_name, '')
+            if seg_type == 'thin':
+                pool = segs[0].get('thin_pool', '')
+                origin = segs[0].get('origin', '')
+            elif seg_type == 'cache':
+                pool = segs[0].get('cache_pool', '')
+            pool, pool_uuid = _ref(pool)
+            origin, origin_uuid = _ref(origin)
+
+            lv_path = '/dev/%s/%s' % (vg_name, lv_name)
+            if seg_type in ('thin-pool', 'cache-pool'):
+                lv_path = ''
+
+            self.lvs.append(dict(
+                lv_uuid=lv.get('id', ''), lv_name=lv_name, lv_path=lv_path,
+                lv_size=extents * extent_size, vg_name=vg_name,
+                pool_lv_uuid=pool_uuid, pool_lv=pool,
+                origin_uuid=origin_uuid, origin=origin, data_percent=0,
+                copy_percent=0,
+                lv_attr=attr, lv_tags=','.join(lv.get('tags', [])),
+                vg_uuid=vg_uuid))
+
+        vg_pvs = []
+        mdas = []
+        total = 0L
+        allocated = 0L
+        partial = False
+
+        for key, (name, uuid, used) in sorted(pv_info.items()):
+            pv = pvs[key]
+            meta = pvmeta.get(uuid, {})
+            pe_count = pv.get('pe_count', 0L)
+            alloc_count = sum(u[1] for u in used)
+            pv_mdas = self._mdas(meta)
+            status = pv.get('status', [])
+
+            vg_pvs.append((name, uuid))
+            mdas.extend(pv_mdas)
+            total += pe_count
+            allocated += alloc_count
+            missing = 'MISSING' in pv.get('flags', [])
+            partial = partial or missing
+
+            self.pvs.append(dict(
+                pv_name=name, pv_uuid=uuid,
+                pv_fmt=meta.get('format', md.get('format', '')),
+                pv_size=pe_count * extent_size,
+                pv_free=(pe_count - alloc_count) * extent_size,
+                pv_used=alloc_count * extent_size,
+                dev_size=pv.get('dev_size', 0L) * 512,
+                pv_mda_size=min([m.get('size', 0L) for m in pv_mdas] or
+                                [0L]),
+                pv_mda_free=min([m.get('free_sectors', 0L) * 512
+                                 for m in pv_mdas] or [0L]),
+                pv_ba_start=pv.get('ba_start', 0L) * 512,
+                pv_ba_size=pv.get('ba_size', 0L) * 512,
+                pe_start=pv.get('pe_start', 0L) * 512,
+                pv_pe_count=pe_count, pv_pe_alloc_count=alloc_count,
+                pv_attr=''.join([
+                    'a' if 'ALLOCATABLE' in status else '-',
+                    'x' if 'EXPORTED' in vg_status else '-',
+                    'm' if missing else '-']),
+                pv_tags=','.join(pv.get('tags', [])),
+                vg_name=vg_name, vg_uuid=vg_uuid))
+
+        self.vg_pvs[vg_name] = vg_pvs
+
+        self.vgs.append(dict(
+            vg_name=vg_name, vg_uuid=vg_uuid, vg_fmt=md.get('format', ''),
+            vg_size=total * extent_size,
+            vg_free=(total - allocated) * extent_size,
+            vg_sysid=md.get('system_id', ''), vg_extent_size=extent_size,
+            vg_extent_count=total, vg_free_count=total - allocated,
+            vg_profile=md.get('profile', ''), max_lv=md.get('max_lv', 0L),
+            max_pv=md.get('max_pv', 0L), pv_count=long(len(pvs)),
+            lv_count=long(lv_count), snap_count=long(snap_count),
+            vg_seqno=md.get('seqno', 0L), vg_mda_count=long(len(mdas)),
+            vg_mda_free=min([m.get('free_sectors', 0L) * 512
+                             for m in mdas] or [0L]),
+            vg_mda_size=min([m.get('size', 0L) for m in mdas] or [0L]),
+            vg_mda_used_count=long(len([m for m in mdas
+                                        if not m.get('ignore')])),
+            vg_attr=''.join([
+                'w' if 'WRITE' in vg_status else 'r',
+                'z' if 'RESIZEABLE' in vg_status else '-',
+                'x' if 'EXPORTED' in vg_status else '-',
+                'p' if partial else '-',
+                _ALLOC.get(md.get('allocation_policy'), 'n'),
+                'c' if 'CLUSTERED' in vg_status else '-']),
+            vg_tags=','.join(md.get('tags', []))))
+
+        return [info[1] for info in pv_info.values()]
+
+
+def _lv_selected(selection, vg_name, lv_name):
+    # Selections name LVs as vg/lv, or a VG for all of its LVs
+    return vg_name in selection or "%s/%s" % (vg_name, lv_name) in selection
+
+
+class LvmetadInventory(object):
+    """
+    Answers the cmdhandler reports from the lvmetad metadata cache, one round
+    trip over a socket instead of forking lvm for every report.  Reports on
+    specific VGs only ask lvmetad about those VGs.
+
+    lvmetad only has the metadata, the state lvm looks up in the kernel is
+    approximated: an LV is active when its device mapper device exists, it is
+    never reported as open and its data_percent and copy_percent are always
+    0.
+    """
+
+    def __init__(self, socket_path=Lvmetad.SOCKET, device_name=_device_name,
+                 active=_dm_active):
+        """
+        :param socket_path: lvmetad socket
+        :param device_name: Function returning the name of a device given its
+                            number, None if unknown
+        :param active:      Function returning True when the LV (vg_name,
+                            lv_name) is active
+        """
+        self.lvmetad = Lvmetad(socket_path)
+        self.device_name = device_name
+        self.active = active
+        self._local = threading.local()
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Answer everything asked within the block from what was retrieved
+        from lvmetad earlier in the block when possible, which is both
+        quicker and consistent.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self._local.models = []
+        self._local.depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self._local.models = None
+
+    def _fetch(self, vg_names):
+        if not vg_names:
+            return _Model(self.lvmetad.all(), self.device_name, self.active)
+
+        # Only the VGs we are interested in and the PVs, in one round trip
+        names = sorted(set(vg_names))
+        responses = [Lvmetad.parse(r) for r in self.lvmetad.pipeline(
+            [('vg_lookup', dict(name=n)) for n in names] +
+            [('pv_list', None)])]
+
+        pvs = responses.pop()
+        dump = dict(response=pvs.get('response'),
+                    reason=pvs.get('reason', pvs.get('response')),
+                    global_invalid=pvs.get('global_invalid'),
+                    pvid_to_pvmeta=pvs.get('physical_volumes', {}),
+                    vgid_to_metadata={}, vgid_to_vgname={})
+
+        for name, vg in zip(names, responses):
+            if vg.get('response') == 'unknown':
+                continue
+            if vg.get('response') != 'OK':
+                raise LvmetadError('lvmetad: %s' %
+                                   vg.get('reason', vg.get('response')))
+
+            md = vg.get('metadata', {})
+            vg_id = md.get('id', vg.get('uuid', name))
+            dump['vgid_to_metadata'][vg_id] = md
+            dump['vgid_to_vgname'][vg_id] = vg.get('name', name)
+
+        return _Model(dump, self.device_name, self.active, set(names))
+
+    def _model(self, vg_names=None):
+        """
+        :param vg_names: Names of the VGs which are of interest, None for
+                         everything
+        :return: _Model
+        """
+        models = getattr(self._local, 'models', None)
+        if models:
+            for m in models:
+                if m.covers(vg_names):
+                    return m
+
+        model = self._fetch(vg_names)
+        if models is not None:
+            models.append(model)
+        return model
+
+    def pv_retrieve(self, device=None):
+        return [p for p in self._model().pvs
+                if not device or p['pv_name'] in device]
+
+    def vg_retrieve(self, vg_specific):
+        return [v for v in self._model(vg_specific).vgs
+                if not vg_specific or v['vg_name'] in vg_specific]
+
+    def pvs_in_vg(self, vg_names=None):
+        return dict((k, v) for k, v in self._model(vg_names).vg_pvs.items()
+                    if not vg_names or k in vg_names)
+
+    def lvs_in_vg(self, vg_names=None):
+        model = self._model(vg_names)
+        rc = dict((v['vg_name'], []) for v in model.vgs
+                  if not vg_names or v['vg_name'] in vg_names)
+        for l in model.lvs:
+            if l['vg_name'] in rc:
+                rc[l['vg_name']].append(
+                    (l['lv_name'], l['lv_attr'], l['lv_uuid']))
+        return rc
+
+    def lv_retrieve(self, lv_name):
+        vg_names = None
+        if lv_name:
+            vg_names = [n.split('/')[0] for n in lv_name]
+
+        return [l for l in self._model(vg_names).lvs
+                if not lv_name or
+                _lv_selected(lv_name, l['vg_name'], l['lv_name'])]
+
+    def lv_segments(self, vg_names=None):
+        return [s for s in self._model(vg_names).segments
+                if not vg_names or s['vg_name'] in vg_names]
+
+    def pv_vg_seqnos(self):
+        model = self._model()
+        seqnos = dict((v['vg_name'], v['vg_seqno']) for v in model.vgs)
+        return [dict(pv_name=p['pv_name'], pv_uuid=p['pv_uuid'],
+                     vg_name=p['vg_name'], vg_uuid=p['vg_uuid'],
+                     vg_seqno=seqnos.get(p['vg_name'], 0L))
+                for p in model.pvs]
+
+
+_lvmetad = LvmetadInventory()
+
+
+def _call(name, *args):
+    if cfg.INVENTORY == 'lvmetad':
+        try:
+            return getattr(_lvmetad, name)(*args)
+        except (socket.error, IOError, LvmetadError) as e:
+            # Only lvmetad not being able to answer, anything else is a bug
+            print 'WARNING: lvmetad inventory unavailable, using lvm: %s' % \
+                str(e)
+    return getattr(cmdhandler, name)(*args)
+
+
+def lvmetad_statistics():
+    """
+    :return: Connection health and latencies of the lvmetad client, see
+             Lvmetad.stats
+    """
+    return _lvmetad.lvmetad.stats()
+
+
+@contextmanager
+def snapshot():
+    """
+    Everything retrieved within the block comes from the same view of the
+    system, when it's coming from lvmetad.
+    """
+    if cfg.INVENTORY == 'lvmetad':
+        with _lvmetad.snapshot():
+            yield
+    else:
+        yield
+
+
+def pv_retrieve(device=None):
+    return _call('pv_retrieve', device)
+
+
+def vg_retrieve(vg_specific):
+    return _call('vg_retrieve', vg_specific)
+
+
+def pvs_in_vg(vg_names=None):
+    return _call('pvs_in_vg', vg_names)
+
+
+def lvs_in_vg(vg_names=None):
+    return _call('lvs_in_vg', vg_names)
+
+
+def lv_retrieve(lv_name):
+    return _call('lv_retrieve', lv_name)
+
+
+def lv_segments(vg_names=None):
+    return _call('lv_segments', vg_names)
+
+
+def pv_vg_seqnos():
+    return _call('pv_vg_seqnos')
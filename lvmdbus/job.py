@@ -59,7 +59,12 @@ class Job(AutomatedProperties):
     @Percent.setter
     def Percent(self, value):
         with self.rlock:
+            if self._percent == value:
+                return
             self._percent = value
+        # Clients waiting on the job get told about progress, not polls
+        self.PropertiesChanged(JOB_INTERFACE, {'Percent': dbus.Byte(value)},
+                               [])
 
     @property
     def Complete(self):
@@ -119,7 +124,11 @@ class Job(AutomatedProperties):
     def Result(self):
         with self.rlock:
             if self._request:
-                return self._request.result()
+                # Batch requests have more than one result, those are only
+                # returned to callers which got no job
+                result = self._request.result()
+                if isinstance(result, basestring):
+                    return result
             return '/'
 
     @property
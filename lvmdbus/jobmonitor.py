@@ -20,13 +20,25 @@ import utils
 import cmdhandler
 import time
 import datetime
+from loader import refresh_objects
 
 POLL_INTERVAL_SECONDS = 5
 
+# Bounds of the time between polls of the progress (secs), the upper bound
+# is lower while clients are waiting on jobs.  When there is nothing in
+# progress we look every IDLE_POLL_SECONDS, or when we are kicked.
+MIN_POLL_SECONDS = 1
+JOB_MAX_POLL_SECONDS = 5
+MAX_POLL_SECONDS = 30
+IDLE_POLL_SECONDS = POLL_INTERVAL_SECONDS
+
 
 def refresh_move_objs(lvm_id, src_pv=None, dest_pv=None):
     lv = cfg.om.get_by_lvm_id(lvm_id)
     if lv:
+        # The move changed the layout without running another command
+        cmdhandler.invalidate_reports()
+
         # Best guess is that the lv and the source & dest.
         # PV state needs to be updated, need to verify.
         utils.pprint('gen_signals: move LV %s' % (str(lvm_id)),
@@ -38,17 +50,10 @@ def refresh_move_objs(lvm_id, src_pv=None, dest_pv=None):
             vg.refresh()
 
             if not src_pv and not dest_pv:
-                for pv_object_path in vg.Pvs:
-                    pv = cfg.om.get_by_path(pv_object_path)
-                    if pv:
-                        pv.refresh()
+                vg.refresh_pvs()
             else:
-                pv = cfg.om.get_by_lvm_id(src_pv)
-                if pv:
-                    pv.refresh()
-                pv = cfg.om.get_by_lvm_id(dest_pv)
-                if pv:
-                    pv.refresh()
+                refresh_objects([cfg.om.get_by_lvm_id(src_pv),
+                                 cfg.om.get_by_lvm_id(dest_pv)])
 
 
 class Monitor(object):
@@ -82,85 +87,184 @@ class Monitor(object):
             for k in self._jobs.keys():
                 v, ts = self._jobs[k]
 
-                if (last_change - ts).seconds >= (2 * POLL_INTERVAL_SECONDS):
+                # Jobs registered after last_change are not overdue
+                age = max((last_change - ts).total_seconds(), 0)
+                if age >= (2 * POLL_INTERVAL_SECONDS):
                     refresh_move_objs(k)
                     v.Percent = 100
                     v.Complete = True
                     del self._jobs[k]
 
 
-def monitor_moves():
-    prev_jobs = {}
-
-    def gen_signals(p, c):
-        if p:
-            #print 'PREV=', str(p)
-            #print 'CURR=', str(c)
-
-            for prev_k, prev_v in p.items():
-                if prev_k in c:
-                    if prev_v['src_dev'] == c[prev_k]['src_dev']:
-                        prev_v['percent'] = c[prev_k]['percent']
-
-                        j = cfg.jobs.get(prev_k)
-                        j.Percent = int(c[prev_k]['percent'])
-                    else:
-                        p[prev_k] = c[prev_k]
-                    del c[prev_k]
-                else:
-                    state = p[prev_k]
-                    del p[prev_k]
+def poll_interval(rates, num_jobs):
+    """
+    How long to wait before asking lvm about the progress again, about when
+    the fastest moving thing is expected to move on by a percent.
+    :param rates:       For each thing being watched its progress so far in
+                        percent per second, None when it was just seen for
+                        the first time
+    :param num_jobs:    Number of jobs clients are waiting on
+    :return: Seconds
+    """
+    if not rates:
+        return IDLE_POLL_SECONDS
+
+    # Clients waiting on jobs shouldn't wait long for news of them, but with
+    # many jobs at once each of them is going to be slow anyway
+    floor = MIN_POLL_SECONDS * (1 + num_jobs / 10)
+    ceiling = MAX_POLL_SECONDS
+    if num_jobs:
+        ceiling = max(JOB_MAX_POLL_SECONDS, floor)
+
+    interval = ceiling
+    for r in rates:
+        if r is None:
+            interval = floor
+        elif r > 0:
+            interval = min(interval, 1.0 / r)
+    return max(floor, min(interval, ceiling))
+
+
+class _Rates(object):
+    """
+    Rate of progress of each thing being watched since it was first seen
+    """
 
-                    # This move is over, update the job object and generate
-                    # signals
-                    with cfg.om.locked():
-                        refresh_move_objs(prev_k, state['src_dev'],
-                                          state['dest_dev'])
+    def __init__(self):
+        self._first = {}
+
+    def update(self, now, percents):
+        """
+        :param now:         Current time
+        :param percents:    Hash of key to current percent
+        :return: List of rates, see poll_interval
+        """
+        for k in self._first.keys():
+            if k not in percents:
+                del self._first[k]
+
+        rc = []
+        for k, percent in percents.items():
+            if k not in self._first:
+                self._first[k] = (now, percent)
+                rc.append(None)
+            else:
+                t, p = self._first[k]
+                if now > t:
+                    rc.append(abs(percent - p) / (now - t))
+                else:
+                    rc.append(None)
+        return rc
+
+
+def _moves_update(prev, cur):
+    """
+    Update the jobs of the pvmoves and finish the jobs of the moves which
+    are over
+    :param prev: Moves from the previous poll, updated to the current ones
+    :param cur:  Moves from this poll, see cmdhandler.progress_status
+    """
+    for k, move in cur.items():
+        j = cfg.jobs.get(k)
+        if j and j.Percent != move['percent']:
+            j.Percent = move['percent']
+
+    for k, move in prev.items():
+        if k not in cur:
+            # This move is over, update the job object and generate signals
+            with cfg.om.locked():
+                refresh_move_objs(k, move['src_dev'], move['dest_dev'])
+
+                j = cfg.jobs.get(k)
+                if j:
+                    j.Percent = 100
+                    j.Complete = True
+                    cfg.jobs.delete(k)
+
+    prev.clear()
+    prev.update(cur)
+
+
+def _lvs_update(prev, cur):
+    """
+    Refresh the raid, mirror and thin pool LVs whose sync or data percent
+    changed since the previous poll
+    :param prev: Percents from the previous poll, updated to the current ones
+    :param cur:  Hash of LV full name to percent, see
+                 cmdhandler.progress_status
+    """
+    changed = []
+    for k, percent in cur.items():
+        if k in prev:
+            if prev[k] == percent:
+                continue
+        elif cfg.INVENTORY == 'lvmetad':
+            # The inventory has no percents to compare with, it reports them
+            # as 0 and refreshing wouldn't change that
+            continue
+
+        lv = cfg.om.get_by_lvm_id(k)
+        if lv:
+            have = lv.state.DataPercent
+            if not lv.IsThinPool:
+                have = lv.state.CopyPercent
+            if have != percent:
+                changed.append(lv)
+
+    prev.clear()
+    prev.update(cur)
+
+    if changed:
+        # The reports we have seen of these are out of date
+        cmdhandler.invalidate_reports()
+        with cfg.om.locked():
+            refresh_objects(changed)
 
-                        job_obj = cfg.jobs.get(prev_k)
-                        job_obj.Percent = 100
-                        job_obj.Complete = True
-                        cfg.jobs.delete(prev_k)
 
-            # Update previous to current
-            p.update(c)
+def monitor_moves():
+    """
+    Thread which polls lvm for the progress of pvmoves, raid and mirror syncs
+    and thin pools filling up.  Everything is retrieved with one report, how
+    often depends on how many jobs there are and how fast things progress.
+    """
+    prev_moves = {}
+    prev_lvs = {}
+    rates = _Rates()
+    interval = IDLE_POLL_SECONDS
 
     while cfg.run.value != 0:
 
         try:
-            cfg.kick_q.get(True, POLL_INTERVAL_SECONDS)
+            cfg.kick_q.get(True, interval)
         except IOError:
             pass
         except Queue.Empty:
             pass
 
-        last_seen = datetime.datetime.now()
-
-        while True:
-            if cfg.run.value == 0:
-                break
-
-            cur_jobs = cmdhandler.pv_move_status()
-
-            if cur_jobs:
-                last_seen = datetime.datetime.now()
-                if not prev_jobs:
-                    prev_jobs = cur_jobs
-                else:
-                    gen_signals(prev_jobs, cur_jobs)
-            else:
-                #Signal any that remain in running!
-                gen_signals(prev_jobs, cur_jobs)
-                prev_jobs = None
+        if cfg.run.value == 0:
+            break
 
-                # Check to see if we have any jobs that are not making
-                # progress
-                with cfg.om.locked():
-                    if cfg.jobs.num_jobs() > 0:
-                        cfg.jobs.finish_all(last_seen)
-
-                break
+        last_seen = datetime.datetime.now()
 
-            time.sleep(1)
+        status = cmdhandler.progress_status()
+        if status is None:
+            interval = IDLE_POLL_SECONDS
+            continue
+
+        moves, lvs = status
+        _moves_update(prev_moves, moves)
+        _lvs_update(prev_lvs, lvs)
+
+        if not moves:
+            # Check to see if we have any jobs that are not making
+            # progress
+            with cfg.om.locked():
+                if cfg.jobs.num_jobs() > 0:
+                    cfg.jobs.finish_all(last_seen)
+
+        percents = dict(lvs)
+        percents.update(('move:' + k, m['percent']) for k, m in moves.items())
+        interval = poll_interval(rates.update(time.time(), percents),
+                                 cfg.jobs.num_jobs())
 
     return None
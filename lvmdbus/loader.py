@@ -28,9 +28,10 @@ def common(retrieve, o_type, search_keys,
     objects = retrieve(search_keys)
 
     # If we are doing a refresh we need to know what we have in memory, what's
-    # in lvm and add those that are new and remove those that are gone!
+    # in lvm and add those that are new and remove those that are gone!  When
+    # only some objects were asked for, only those can have gone away.
     if refresh:
-        existing_paths = cfg.om.object_paths_by_type(o_type)
+        existing_paths = cfg.om.object_paths_by_type(o_type, search_keys)
 
     for o in objects:
         # Assume we need to add this one to dbus, unless we are refreshing
@@ -43,7 +44,7 @@ def common(retrieve, o_type, search_keys,
             dbus_object = cfg.om.get_by_uuid_lvm_id(*o.identifiers())
 
             if dbus_object:
-                del existing_paths[dbus_object.dbus_object_path()]
+                existing_paths.pop(dbus_object.dbus_object_path(), None)
                 num_changes += dbus_object.refresh(object_state=o)
                 return_object = False
 
@@ -60,3 +61,34 @@ def common(retrieve, o_type, search_keys,
     num_changes += len(rc)
 
     return rc, num_changes
+
+
+def refresh_objects(objects, search_keys=None):
+    """
+    Refresh a number of objects of the same type, their state is retrieved
+    with one call of the search method instead of one call per object.
+    Objects are matched up with their new state by uuid, so objects which
+    have been renamed are found too.  Objects lvm no longer has are left
+    alone.
+    :param objects:     The dbus objects to refresh
+    :param search_keys: What to retrieve, eg. a VG name for all its LVs, the
+                        lvm ids of the objects when None
+    :return: Number of objects which changed
+    """
+    num_changes = 0
+    objects = [o for o in objects if o]
+
+    if not objects:
+        return 0
+
+    if search_keys is None:
+        search_keys = [o.lvm_id for o in objects]
+
+    retrieve = objects[0]._ap_search_method
+    by_uuid = dict((s.identifiers()[0], s) for s in retrieve(search_keys))
+
+    for o in objects:
+        new_state = by_uuid.get(o.state.identifiers()[0])
+        if new_state:
+            num_changes += o.refresh(object_state=new_state)
+    return num_changes
@@ -18,27 +18,49 @@ import utils
 from utils import vg_obj_path_generate, thin_pool_obj_path_generate
 import dbus
 import cmdhandler
+import inventory
+import extentmap
 import cfg
 from cfg import LV_INTERFACE, MANAGER_INTERFACE, THIN_POOL_INTERFACE
 from request import RequestEntry
 from job import Job
-from utils import lv_obj_path_generate, n, n32
+from utils import lv_obj_path_generate
 from loader import common
 from state import State
 
 
 def lvs_state_retrieve(selection):
     rc = []
-    _lvs = cmdhandler.lv_retrieve(selection)
+    _lvs = inventory.lv_retrieve(selection)
     lvs = sorted(_lvs, key=lambda lk: lk['lv_name'])
+
+    # Gather the PV layout for all the LVs at once
+    maps = {}
+
+    if lvs:
+        vg_names = None
+        if selection:
+            vg_names = list(set([l['vg_name'] for l in lvs]))
+
+        maps = extentmap.build(inventory.lv_segments(vg_names), vg_names)
+
     for l in lvs:
+        devices = []
+        seg_types = []
+        m = maps.get(l['vg_name'])
+        if m:
+            devices = m.pvs_of_lv(l['lv_name'])
+            seg_types = m.seg_types(l['lv_name'])
+
         rc.append(LvState(l['lv_uuid'], l['lv_name'],
-                               l['lv_path'], n(l['lv_size']),
+                               l['lv_path'], l['lv_size'],
                                l['vg_name'],
                                l['vg_uuid'], l['pool_lv_uuid'],
                                 l['pool_lv'], l['origin_uuid'], l['origin'],
-                               n32(l['data_percent']), l['lv_attr'],
-                               l['lv_tags']))
+                               l['data_percent'], l['copy_percent'],
+                               l['lv_attr'],
+                               l['lv_tags'], LvState._pv_devices(devices),
+                               dbus.Array(seg_types, signature='s')))
     return rc
 
 
@@ -51,19 +73,20 @@ def load_lvs(lv_name=None, object_path=None, refresh=False):
 
 # noinspection PyPep8Naming,PyUnresolvedReferences,PyUnusedLocal
 class LvState(State):
+    __slots__ = ('Uuid', 'Name', 'Path', 'SizeBytes', 'vg_name', 'vg_uuid',
+                 'pool_lv_uuid', 'PoolLv', 'origin_uuid', 'OriginLv',
+                 'DataPercent', 'CopyPercent', 'Attr', 'Tags', 'Devices',
+                 'SegType', 'Vg')
 
-    def _pv_devices(self, lvm_id):
+    @staticmethod
+    def _pv_devices(devices):
         rc = []
-        for pv in sorted(cmdhandler.lv_pv_devices(lvm_id)):
-            (pv_name, pv_segs, pv_uuid) = pv
+        for pv in sorted(devices):
+            (pv_name, pv_segs) = pv
             pv_obj = cfg.om.get_object_path_by_lvm_id(
-                pv_uuid, pv_name, gen_new=False)
+                pv_name, pv_name, gen_new=False)
             rc.append((pv_obj, pv_segs))
 
-            for s in pv_segs:
-                if s[2] not in self._segs:
-                    self._segs.append(s[2])
-
         return dbus.Array(rc, signature="(oa(tts))")
 
     def vg_name_lookup(self):
@@ -78,13 +101,25 @@ class LvState(State):
 
     def __init__(self, Uuid, Name, Path, SizeBytes,
                      vg_name, vg_uuid, pool_lv_uuid, PoolLv,
-                     origin_uuid, OriginLv, DataPercent, Attr, Tags):
-        utils.init_class_from_arguments(self, None)
-        self._segs = dbus.Array([], signature='s')
+                     origin_uuid, OriginLv, DataPercent, CopyPercent, Attr,
+                     Tags, Devices, SegType):
+        self.Uuid = Uuid
+        self.Name = Name
+        self.Path = Path
+        self.SizeBytes = SizeBytes
+        self.vg_name = vg_name
+        self.vg_uuid = vg_uuid
+        self.pool_lv_uuid = pool_lv_uuid
+        self.origin_uuid = origin_uuid
+        self.DataPercent = DataPercent
+        self.CopyPercent = CopyPercent
+        self.Attr = Attr
+        self.Tags = Tags
+        self.Devices = Devices
+        self.SegType = SegType
 
         self.Vg = cfg.om.get_object_path_by_lvm_id(
             Uuid, vg_name, vg_obj_path_generate)
-        self.Devices = self._pv_devices(self.lvm_id)
 
         if PoolLv:
             self.PoolLv = cfg.om.get_object_path_by_lvm_id(
@@ -101,10 +136,6 @@ class LvState(State):
         else:
             self.OriginLv = '/'
 
-    @property
-    def SegType(self):
-        return self._segs
-
     def create_dbus_object(self, path):
         if not path:
             path = cfg.om.get_object_path_by_lvm_id(
@@ -135,6 +166,7 @@ def lv_object_factory(interface_name, *args):
     @utils.dbus_property('Path', 's')
     @utils.dbus_property('SizeBytes', 't')
     @utils.dbus_property('DataPercent', 'u')
+    @utils.dbus_property('CopyPercent', 'u')
     @utils.dbus_property('SegType', 'as')
     @utils.dbus_property('Vg', 'o')
     @utils.dbus_property('OriginLv', 'o')
@@ -156,7 +188,7 @@ def lv_object_factory(interface_name, *args):
             self.state = object_state
 
         def signal_vg_pv_changes(self):
-            # Signal property changes...
+            # Signal property changes, the PVs are refreshed together
             vg_obj = cfg.om.get_by_path(self.Vg)
             vg_obj.refresh()
             vg_obj.refresh_pvs()
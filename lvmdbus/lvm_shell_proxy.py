@@ -17,12 +17,19 @@
 
 import subprocess
 import shlex
+import os
+import select
+import threading
+import time
 from fcntl import fcntl, F_GETFL, F_SETFL
 from os import O_NONBLOCK
 import cfg
 
 SHELL_PROMPT = "lvm> "
 
+# Amount we try to read from the shell pipes at a time
+READ_SIZE = 65536
+
 
 def _quote_arg(arg):
     if len(shlex.split(arg)) > 1:
@@ -37,19 +44,65 @@ class LVMShellProxy(object):
         self.lvm_shell = subprocess.Popen(
             [cfg.LVM_CMD], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
             stderr=subprocess.PIPE, close_fds=True)
-        flags = fcntl(self.lvm_shell.stdout, F_GETFL)
-        fcntl(self.lvm_shell.stdout, F_SETFL, flags | O_NONBLOCK)
-        flags = fcntl(self.lvm_shell.stderr, F_GETFL)
-        fcntl(self.lvm_shell.stderr, F_SETFL, flags | O_NONBLOCK)
+        self.out_fd = self.lvm_shell.stdout.fileno()
+        self.err_fd = self.lvm_shell.stderr.fileno()
+
+        for fd in (self.out_fd, self.err_fd):
+            flags = fcntl(fd, F_GETFL)
+            fcntl(fd, F_SETFL, flags | O_NONBLOCK)
+
+        # We sleep in poll until the shell has something for us instead of
+        # spinning on non-blocking reads
+        self.poller = select.poll()
+        self.poller.register(self.out_fd, select.POLLIN | select.POLLPRI)
+        self.poller.register(self.err_fd, select.POLLIN | select.POLLPRI)
 
         # wait for the first prompt
-        stdout = ""
+        self._read_response()
+
+    def _read(self, fd, buf):
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError:
+            # nothing written yet
+            return True
+
+        if not data:
+            return False
+
+        buf.extend(data)
+        return True
+
+    def _read_response(self):
+        """
+        Block until the shell prints its prompt again, collecting everything
+        it writes to STDOUT & STDERR along the way.
+        :return: Tuple of STDOUT (prompt stripped), STDERR
+        """
+        stdout = bytearray()
+        stderr = bytearray()
+
         while not stdout.endswith(SHELL_PROMPT):
-            try:
-                stdout += self.lvm_shell.stdout.read()
-            except IOError:
-                # nothing written yet
-                pass
+            for fd, event in self.poller.poll():
+                if fd == self.out_fd:
+                    alive = self._read(fd, stdout)
+                else:
+                    alive = self._read(fd, stderr)
+
+                if not alive:
+                    raise Exception('lvm shell exited, rc = %s, stderr = %s'
+                                    % (str(self.lvm_shell.poll()),
+                                       str(stderr)))
+
+        # read everything remaining on STDERR if there's something (we
+        # waited for the prompt on STDOUT so there should be all or nothing
+        # at this point on STDERR)
+        while select.select([self.err_fd], [], [], 0)[0]:
+            if not self._read(self.err_fd, stderr):
+                break
+
+        # strip the prompt from the STDOUT
+        return str(stdout[:-len(SHELL_PROMPT)]), str(stderr)
 
     def call_lvm(self, argv, debug=False):
         # create the command string
@@ -58,39 +111,13 @@ class LVMShellProxy(object):
 
         # run the command by writing it to the shell's STDIN
         self.lvm_shell.stdin.write(cmd)
+        self.lvm_shell.stdin.flush()
 
-        # read and discard the first line (the shell echoes the command string,
-        # no idea why)
-        line = None
-        while line is None:
-            try:
-                line = self.lvm_shell.stdout.readline()
-            except IOError:
-                # nothing written yet
-                pass
+        stdout, stderr = self._read_response()
 
-        # read everything from the STDOUT to the next prompt
-        stdout = ""
-        while not stdout.endswith(SHELL_PROMPT):
-            try:
-                stdout += self.lvm_shell.stdout.read()
-            except IOError:
-                # nothing written yet
-                pass
-
-        # strip the prompt from the STDOUT
-        strip_idx = -1 * len(SHELL_PROMPT)
-        stdout = stdout[:strip_idx]
-
-        # read everything from STDERR if there's something (we waited for the
-        # prompt on STDOUT so there should be all or nothing at this point on
-        # STDERR)
-        stderr = None
-        try:
-            stderr = self.lvm_shell.stderr.read()
-        except IOError:
-            # nothing on STDERR
-            pass
+        # discard the first line (the shell echoes the command string, no
+        # idea why)
+        stdout = stdout[stdout.find('\n') + 1:]
 
         # if there was something on STDERR, there was some error
         if stderr:
@@ -109,6 +136,87 @@ class LVMShellProxy(object):
     def __del__(self):
         self.lvm_shell.terminate()
 
+
+class _PoolWorker(object):
+    """
+    One lvm shell in the pool along with its usage accounting
+    """
+
+    def __init__(self):
+        self.shell = None
+        self.started = time.time()
+        self.busy = 0.0
+        self.calls = 0
+        self.restarts = 0
+
+    def call_lvm(self, argv, debug, retry):
+        start = time.time()
+        try:
+            if not self.shell:
+                self.shell = LVMShellProxy()
+
+            try:
+                return self.shell.call_lvm(argv, debug)
+            except Exception as e:
+                # The shell died on us, start a new one.  We only re-run the
+                # command if it's safe to do so.
+                self.shell = None
+                self.restarts += 1
+
+                if retry:
+                    self.shell = LVMShellProxy()
+                    return self.shell.call_lvm(argv, debug)
+                return 1, '', str(e)
+        finally:
+            self.busy += time.time() - start
+            self.calls += 1
+
+    def stats(self):
+        return dict(calls=self.calls, busy=self.busy,
+                    utilisation=self.busy / max(time.time() - self.started,
+                                                1e-6),
+                    restarts=self.restarts)
+
+
+class LVMShellPool(object):
+    """
+    A number of persistent lvm shells, each command is handed to an idle
+    shell so that independent commands can run concurrently.  Callers are
+    responsible for serializing commands which need ordering.
+    """
+
+    def __init__(self, size, read_only_cmds=()):
+        assert size > 0
+        self._cond = threading.Condition()
+        self._workers = [_PoolWorker() for _ in range(size)]
+        self._idle = list(self._workers)
+        self._waiting = 0
+        self._read_only = frozenset(read_only_cmds)
+
+    def call_lvm(self, argv, debug=False):
+        with self._cond:
+            self._waiting += 1
+            while not self._idle:
+                self._cond.wait()
+            self._waiting -= 1
+            worker = self._idle.pop()
+
+        try:
+            return worker.call_lvm(argv, debug, argv[0] in self._read_only)
+        finally:
+            with self._cond:
+                self._idle.append(worker)
+                self._cond.notify()
+
+    def stats(self):
+        """
+        :return: Hash with the number of callers waiting for a shell and a
+                 list with the usage of each of the shells
+        """
+        with self._cond:
+            return dict(queue_depth=self._waiting,
+                        workers=[w.stats() for w in self._workers])
+
 if __name__ == "__main__":
     shell = LVMShellProxy()
     in_line = "start"
@@ -32,6 +32,8 @@ import traceback
 import Queue
 import sys
 import udevwatch
+import refresh
+from scheduler import RequestScheduler
 
 
 class Lvm(objectmanager.ObjectManager):
@@ -43,7 +45,10 @@ def process_request():
     while cfg.run.value != 0:
         try:
             req = cfg.worker_q.get(True, 5)
-            req.run_cmd()
+            try:
+                req.run_cmd()
+            finally:
+                cfg.worker_q.task_done(req)
         except Queue.Empty:
             pass
         except Exception:
@@ -81,8 +86,19 @@ def main():
     process_list.append(
         threading.Thread(target=monitor_moves))
 
-    # Using a thread to process requests.
-    process_list.append(threading.Thread(target=process_request))
+    # Collects external and udev events into refresh requests
+    process_list.append(
+        threading.Thread(target=refresh.event_aggregator))
+
+    # Using a number of threads to process requests, requests which don't
+    # conflict with each other get processed in parallel.
+    cfg.worker_q = RequestScheduler()
+    for i in range(cfg.WORKER_THREADS):
+        process_list.append(threading.Thread(target=process_request))
+
+    # Pick how we are going to talk to lvm for reports once, up front
+    if cmdhandler.report_format_select():
+        print 'Using JSON reports!'
 
     load()
     cfg.loop = gobject.MainLoop()
@@ -20,9 +20,14 @@ from cfg import MANAGER_INTERFACE
 import dbus
 import cfg
 import cmdhandler
-from fetch import load_pvs, load_vgs, load
+from fetch import load_pvs, load_vgs, load, load_selected
+from lv import lv_object_factory
+from loader import refresh_objects
 from request import RequestEntry
-from refresh import event_add
+from refresh import event_add, event_statistics
+from scheduler import lvm_id_lock_key
+from inventory import lvmetad_statistics
+from meta import LATENCY_BUCKETS
 
 
 # noinspection PyPep8Naming
@@ -68,7 +73,8 @@ class Manager(AutomatedProperties):
                          async_callbacks=('cb', 'cbe'))
     def PvCreate(self, device, tmo, create_options, cb, cbe):
         r = RequestEntry(tmo, Manager._pv_create,
-                         (device, create_options), cb, cbe)
+                         (device, create_options), cb, cbe,
+                         lock_keys=[lvm_id_lock_key(device)])
         cfg.worker_q.put(r)
 
     @staticmethod
@@ -95,9 +101,7 @@ class Manager(AutomatedProperties):
             # For each PV that was involved in this VG create we need to
             # signal the property changes, make sure to do this *after* the
             # vg is available on the bus
-            for p in pv_object_paths:
-                pv = cfg.om.get_by_path(p)
-                pv.refresh()
+            refresh_objects([cfg.om.get_by_path(p) for p in pv_object_paths])
         else:
             raise dbus.exceptions.DBusException(
                 MANAGER_INTERFACE,
@@ -109,9 +113,115 @@ class Manager(AutomatedProperties):
                          out_signature='(oo)',
                          async_callbacks=('cb', 'cbe'))
     def VgCreate(self, name, pv_object_paths, tmo, create_options, cb, cbe):
+        keys = [lvm_id_lock_key(name)]
+        for p in pv_object_paths:
+            pv = cfg.om.get_by_path(p)
+            if pv:
+                keys.append(lvm_id_lock_key(pv.lvm_id))
+
         r = RequestEntry(tmo, Manager._create_vg,
                          (name, pv_object_paths, create_options,),
-                         cb, cbe)
+                         cb, cbe, lock_keys=keys)
+        cfg.worker_q.put(r)
+
+    @staticmethod
+    def _lv_names(lv_object_paths):
+        # The full names (vg/lv) of the LVs at the object paths
+        rc = []
+        for p in lv_object_paths:
+            lv = cfg.om.get_by_path(p)
+            if not isinstance(lv, (lv_object_factory.lv_t,
+                                   lv_object_factory.lv_pool_t)):
+                raise dbus.exceptions.DBusException(
+                    MANAGER_INTERFACE, 'LV object path = %s not found' % p)
+            rc.append(lv.lvm_id)
+        return rc
+
+    @staticmethod
+    def _lv_lock_keys(lv_object_paths):
+        # All the VGs the LVs are in
+        keys = set()
+        for p in lv_object_paths:
+            lv = cfg.om.get_by_path(p)
+            if lv:
+                keys.add(lvm_id_lock_key(lv.lvm_id))
+        return list(keys)
+
+    @staticmethod
+    def _lv_remove(lv_object_paths, remove_options):
+        lv_names = Manager._lv_names(lv_object_paths)
+        if not lv_names:
+            return '/'
+
+        rc, out, err = cmdhandler.lv_remove(lv_names, remove_options)
+
+        # Even when lvremove fails it may have removed some of the LVs, all
+        # the LVs of the VGs are refreshed as removing thin pools and origins
+        # affects other LVs too
+        vg_names = set(n.split('/')[0] for n in lv_names)
+        load_selected(vg_names=vg_names, lv_names=vg_names)
+
+        if rc != 0:
+            raise dbus.exceptions.DBusException(
+                MANAGER_INTERFACE,
+                'Exit code %s, stderr = %s' % (str(rc), err))
+        return '/'
+
+    @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
+                         in_signature='aoia{sv}',
+                         out_signature='o',
+                         async_callbacks=('cb', 'cbe'))
+    def LvRemove(self, lv_object_paths, tmo, remove_options, cb, cbe):
+        """
+        Remove a number of LVs, from any VGs, with one lvm command
+        :param lv_object_paths: LVs to remove
+        :param tmo:             Timeout
+        :param remove_options:  Options for lvremove
+        :return: '/' or a job
+        """
+        r = RequestEntry(tmo, Manager._lv_remove,
+                         (lv_object_paths, remove_options), cb, cbe, False,
+                         lock_keys=Manager._lv_lock_keys(lv_object_paths))
+        cfg.worker_q.put(r)
+
+    @staticmethod
+    def _lv_add_rm_tags(lv_object_paths, tags_add, tags_del, tag_options):
+        lv_names = Manager._lv_names(lv_object_paths)
+        if not lv_names:
+            return '/'
+
+        rc, out, err = cmdhandler.lv_tag(lv_names, tags_add, tags_del,
+                                         tag_options)
+
+        vg_names = set(n.split('/')[0] for n in lv_names)
+        load_selected(vg_names=vg_names, lv_names=lv_names)
+
+        if rc != 0:
+            raise dbus.exceptions.DBusException(
+                MANAGER_INTERFACE,
+                'Exit code %s, stderr = %s' % (str(rc), err))
+        return '/'
+
+    @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
+                         in_signature='aoasia{sv}',
+                         out_signature='o',
+                         async_callbacks=('cb', 'cbe'))
+    def LvTagsAdd(self, lv_object_paths, tags, tmo, tag_options, cb, cbe):
+        r = RequestEntry(tmo, Manager._lv_add_rm_tags,
+                         (lv_object_paths, tags, None, tag_options),
+                         cb, cbe, False,
+                         lock_keys=Manager._lv_lock_keys(lv_object_paths))
+        cfg.worker_q.put(r)
+
+    @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
+                         in_signature='aoasia{sv}',
+                         out_signature='o',
+                         async_callbacks=('cb', 'cbe'))
+    def LvTagsDel(self, lv_object_paths, tags, tmo, tag_options, cb, cbe):
+        r = RequestEntry(tmo, Manager._lv_add_rm_tags,
+                         (lv_object_paths, None, tags, tag_options),
+                         cb, cbe, False,
+                         lock_keys=Manager._lv_lock_keys(lv_object_paths))
         cfg.worker_q.put(r)
 
     @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
@@ -127,7 +237,8 @@ class Manager(AutomatedProperties):
         #cfg.om.refresh_all()
         utils.pprint('Manager.Refresh - entry',
                      'bg_black', 'fg_light_red')
-        rc = load(refresh=True)
+        cmdhandler.invalidate_reports()
+        rc = load(refresh=True, skip_unchanged=False)
         utils.pprint('Manager.Refresh - exit %d' % (rc),
                      'bg_black', 'fg_light_red')
         return rc
@@ -165,6 +276,86 @@ class Manager(AutomatedProperties):
         """
         cmdhandler.set_execution(yes_no)
 
+    @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
+                         out_signature='a{sv}')
+    def ShellStatistics(self):
+        """
+        Report how busy the lvm shells are, used for tuning
+        :return: Dictionary with the number of lvm commands waiting for a
+                 shell (queue_depth) and for each shell (workers) the number
+                 of calls, seconds busy, utilisation and number of restarts
+        """
+        stats = cmdhandler.shell_pool_stats()
+        workers = dbus.Array([], signature='a{sv}')
+
+        for w in stats['workers']:
+            workers.append(dbus.Dictionary(
+                {'calls': dbus.UInt64(w['calls']),
+                 'busy': dbus.Double(w['busy']),
+                 'utilisation': dbus.Double(w['utilisation']),
+                 'restarts': dbus.UInt64(w['restarts'])}, signature='sv'))
+
+        return dbus.Dictionary(
+            {'queue_depth': dbus.UInt32(stats['queue_depth']),
+             'workers': workers}, signature='sv')
+
+    @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
+                         out_signature='a{sv}')
+    def EventStatistics(self):
+        """
+        Report how external and udev events are being coalesced
+        :return: Dictionary with the number of events received, the number
+                 merged into an already pending refresh and the number of
+                 refreshes executed
+        """
+        stats = event_statistics()
+        return dbus.Dictionary(
+            dict((k, dbus.UInt64(v)) for k, v in stats.items()),
+            signature='sv')
+
+    @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
+                         out_signature='a{sv}')
+    def ReportCacheStatistics(self):
+        """
+        Report how well the cache of lvm report results works
+        :return: Dictionary with the number of reports answered from the
+                 cache (hits) and run (misses), the current generation and
+                 the number of reports cached
+        """
+        stats = cmdhandler.report_cache_stats()
+        return dbus.Dictionary(
+            dict((k, dbus.UInt64(v)) for k, v in stats.items()),
+            signature='sv')
+
+    @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
+                         out_signature='a{sv}')
+    def LvmetadStatistics(self):
+        """
+        Report on the connection to lvmetad, used when the inventory comes
+        from lvmetad
+        :return: Dictionary with whether we are connected, the number of
+                 connections made, failed round trips, requests and round
+                 trips, the last error, the upper bounds in seconds of the
+                 latency buckets and for each request name the number of
+                 responses in each bucket (the last one is unbounded)
+        """
+        stats = lvmetad_statistics()
+        latency = dbus.Dictionary({}, signature='sv')
+
+        for name, counts in stats['latency'].items():
+            latency[name] = dbus.Array([dbus.UInt64(c) for c in counts],
+                                       signature='t')
+
+        return dbus.Dictionary(
+            {'connected': dbus.Boolean(stats['connected']),
+             'connects': dbus.UInt64(stats['connects']),
+             'failures': dbus.UInt64(stats['failures']),
+             'requests': dbus.UInt64(stats['requests']),
+             'round_trips': dbus.UInt64(stats['round_trips']),
+             'last_error': dbus.String(stats['last_error']),
+             'latency_buckets': dbus.Array(LATENCY_BUCKETS, signature='d'),
+             'latency': latency}, signature='sv')
+
     @dbus.service.method(dbus_interface=MANAGER_INTERFACE,
                          in_signature='sssu', out_signature='i')
     def ExternalEvent(self, event, lvm_id, lvm_uuid, seqno):
@@ -14,200 +14,211 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 # Copyright 2015, Tony Asleson <tasleson@redhat.com>
-import string
+import re
+import time
+import bisect
 import socket
-
-
-_IDENT_CH = string.ascii_letters + string.digits + '_.-'
-_WHITESPACE_CH = ' \t\n\r'
-_NUMBER_CH = string.digits + '.'
-
-
-def _ws(data, i):
-    while data[i] in _WHITESPACE_CH:
-        i += 1
-    return i
-
-
-def _comment(data, i):
-    if data[i] != '#':
-        raise Exception(
-            """Comment expecting'#' not %s, pos= %d, data= %s""" %
-            (data[i], i, data[i:i + 100]))
-
-    while data[i] != "\n":
-        i += 1
-    return i + 1        # Chomp new '\n'
-
-
-def _get_identifier(data, i):
-    st = i
-    while data[i] in _IDENT_CH:
-        i += 1
-    return data[st:i], i
-
-
-def _get_number(data, i):
-    st = i
-
-    while data[i] in _NUMBER_CH:
-        i += 1
-
-    raw = data[st:i]
-
-    if '.' in raw:
-        rc = float(raw)
-    else:
-        rc = long(raw)
-
-    return rc, i
-
-
-def _get_string(data, i):
-
-    if data[i] != '"':
-        raise Exception(
-            """String expecting '"' not %s, pos= %d, data= %s""" %
-            (data[i], i, data[i:i + 100]))
-    i += 1
-    st = i
-
-    while data[i] != '"':
-        i += 1
-    return data[st:i], i + 1            # Chomp the ending '"'
-
-
-def _get_array(data, i):
+import threading
+import cfg
+
+
+# A statement of the lvm configuration format, any whitespace and comments in
+# front of it are skipped.  Identifiers and numbers share a pattern as
+# section names (eg. VG names or device numbers) can start with a digit.
+#   identifier = "string"           (with \" and \\ escapes)
+#   identifier = number
+#   identifier = [ "string", number, ... ]
+#   identifier {
+#   }
+# Anything else matches as a single bad character.  The statement itself is
+# optional so that trailing whitespace and comments match too.
+_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_WORD = r'[A-Za-z0-9_.+\-]+'
+_WS = r'[ \t\r\n]*'
+
+_STATEMENT = re.compile(r"""
+    (?:[ \t\r\n]+|\#[^\n]*)*
+    (?:
+        (%(word)s)%(ws)s
+        (?:
+            =%(ws)s(?:
+                (%(string)s)
+              | (%(word)s)
+              | (\[[^\]"]*(?:%(string)s[^\]"]*)*\])
+            )
+          | (\{)
+        )
+      | (\})
+      | ([^ \t\r\n\#])
+    )?
+    """ % dict(string=_STRING, word=_WORD, ws=_WS), re.VERBOSE | re.DOTALL)
+
+# The values in an array, along with any comments
+_ARRAY_ITEM = re.compile(r'(%s)|([^ \t\r\n,"\#]+)|\#[^\n]*' % _STRING,
+                         re.DOTALL)
+
+_ESCAPE = re.compile(r'\\(.)', re.DOTALL)
+
+
+def _string(v):
+    # String token, including the quotes, to the string it represents
+    v = v[1:-1]
+    if '\\' in v:
+        v = _ESCAPE.sub(r'\1', v)
+    return v
+
+
+def _number(v):
+    if '.' in v:
+        return float(v)
+    return long(v)
+
+
+def _array(v):
     rc = []
-
-    if data[i] != '[':
-        raise Exception("Array expecting '[' not %s, pos= %d, data= %s" %
-                        (data[i], i, data[i:i + 100]))
-
-    i += 1
-
-    while True:
-        ch = data[i]
-
-        if ch in _WHITESPACE_CH:
-            i = _ws(data, i)
-        elif ch == '#':
-            i = _comment(data, i)
-        else:
-            # We should only be processing, numbers or strings
-            if ch == '"':
-                value, i = _get_string(data, i)
-                rc.append(value)
-            elif ch in _NUMBER_CH:
-                value, i = _get_number(data, i)
-                rc.append(value)
-            elif ch == ',':
-                i += 1
-            elif ch == ']':
-                i += 1
-                break
-            else:
-                raise Exception("Array, unexpected character %s, pos= %d, "
-                                "data= %s" % (ch, i, data[i:i + 100]))
-    return rc, i
-
-
-def _get_object(data, i, nested=False):
-
+    for string, word in _ARRAY_ITEM.findall(v[1:-1]):
+        if string:
+            rc.append(_string(string))
+        elif word:
+            rc.append(_number(word))
+    return rc
+
+
+class LvmetadError(Exception):
+    """
+    lvmetad answered with something we can't use
+    """
+    pass
+
+
+def _error(msg, data, n):
+    # Report a problem with the n'th statement
+    for i, m in enumerate(_STATEMENT.finditer(data)):
+        if i == n:
+            pos = m.start(m.lastindex or 0)
+            raise LvmetadError("%s, pos= %d, data= %s" %
+                               (msg, pos, data[pos:pos + 100]))
+    raise LvmetadError(msg)
+
+
+def _get_object(data):
+    """
+    Parse data in the lvm configuration format, as used for the metadata and
+    by lvmetad, into nested dictionaries.  Sections become dictionaries,
+    arrays lists and numbers long or float.
+
+    The input is split into whole statements with a single regular
+    expression, which is a lot quicker than looking at each character in
+    turn.
+    :param data:    String to parse
+    :return: Dictionary
+    """
     rc = {}
 
-    identifier = ''
-    state = "U"
-
-    if data is None or len(data) == 0:
-        return {}, 0
-
-    try:
-        while True:
-            ch = data[i:i + 1]
-
-            if ch in _WHITESPACE_CH:
-                i = _ws(data, i)
-            elif ch == '#':
-                i = _comment(data, i)
-            else:
-                if state == "U":
-                    if ch in _IDENT_CH:
-                        (identifier, i) = _get_identifier(data, i)
-                        state = "A"
-                    elif nested and ch == '}':
-                        i += 1
-                        break
-                    else:
-                        raise Exception(
-                            "Unexpected character %s, pos= %d, "
-                            "state= %s, data= %s" %
-                            (ch, i, state, data[i:i + 100]))
-                elif state == "A":
-                    # Look for assignment operator or {
-                    if ch == '=':
-                        # Simple data type
-                        state = 'S'
-                        i += 1
-                    elif ch == '{':
-                        # Section
-                        i += 1
-                        rc[identifier], i = \
-                            _get_object(data, i, True)
-                        state = 'U'
-                    else:
-                        raise Exception(
-                            "Unexpected character %s, pos= %d, "
-                            "state= %s, data= %s" %
-                            (ch, i, state, data[i:i + 100]))
-
-                elif state == "S":
-                    # We are dealing with a number, array or string
-                    if ch == '[':
-                        rc[identifier], i = _get_array(data, i)
-                        state = 'U'
-                    elif ch == '"':
-                        rc[identifier], i = _get_string(data, i)
-                        state = 'U'
-                    elif ch in string.digits:
-                        # Does the format support negative numbers, doesn't
-                        # appear too based on `man 5 lvm.conf`
-                        rc[identifier], i = _get_number(data, i)
-                        state = 'U'
-                    else:
-                        raise Exception(
-                            "Unexpected character %s, pos= %d, "
-                            "state= %s, data= %s" %
-                            (ch, i, state, data[i:i + 100]))
+    if not data:
+        return rc
+
+    # The sections we are in, the current one last
+    stack = [rc]
+    current = rc
+
+    for n, (identifier, string, word, array, section, end, bad) in \
+            enumerate(_STATEMENT.findall(data)):
+        try:
+            # Strings and numbers are handled inline, they are by far the
+            # most common and calls are expensive
+            if string:
+                v = string[1:-1]
+                if '\\' in v:
+                    v = _ESCAPE.sub(r'\1', v)
+                current[identifier] = v
+            elif word:
+                if '.' in word:
+                    current[identifier] = float(word)
                 else:
-                    raise Exception("Unexpected state %s, pos= %d, "
-                                        "state= %s, data= %s" %
-                                        (ch, i, state, data[i:i + 100]))
-
-    except IndexError:
-        if state != "U":
-            raise Exception("Malformed input, expecting more...")
-    return rc, i
+                    current[identifier] = long(word)
+            elif array:
+                if len(array) == 2:
+                    current[identifier] = []
+                else:
+                    current[identifier] = _array(array)
+            elif section:
+                current[identifier] = {}
+                current = current[identifier]
+                stack.append(current)
+            elif end:
+                if len(stack) == 1:
+                    _error("Unexpected }", data, n)
+                stack.pop()
+                current = stack[-1]
+            elif bad:
+                _error("Unexpected character %s" % bad, data, n)
+        except ValueError as e:
+            _error(str(e), data, n)
+
+    return rc
+
+
+# Upper bounds, in seconds, of the buckets of the round trip latency
+# histograms, the last bucket counts anything slower
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0,
+                   2.0, 5.0)
 
 
 class Lvmetad(object):
+    """
+    Client for lvmetad.  The connection is made when first needed and kept,
+    when it breaks it's made again and the requests are retried once, they
+    only read so that's safe.  Several requests can be sent in one go with
+    pipeline, lvmetad answers the requests on a connection in order which is
+    how the responses are matched up with them.  Threads take turns using
+    the connection.
+    """
 
     SOCKET = '/run/lvm/lvmetad.socket'
     END = '''\n##\n'''
 
-    def __init__(self):
-        self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.s.connect(Lvmetad.SOCKET)
+    # Size of the reads from the socket
+    READ_SIZE = 65536
 
-    def close(self):
-        self.s.close()
+    # Seconds to wait for lvmetad before giving up on the connection
+    TIMEOUT = 30
+
+    def __init__(self, socket_path=SOCKET):
+        self.socket_path = socket_path
         self.s = None
+        self._buf = bytearray()
+        self._lock = threading.RLock()
+        self._connects = 0
+        self._failures = 0
+        self._requests = 0
+        self._round_trips = 0
+        self._last_error = ''
+        # Request name -> number of responses in each latency bucket
+        self._latency = {}
+
+    def _connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(self.TIMEOUT)
+        try:
+            s.connect(self.socket_path)
+        except socket.error:
+            s.close()
+            raise
+        self.s = s
+        self._buf = bytearray()
+        self._connects += 1
+
+    def _close(self):
+        if self.s:
+            self.s.close()
+            self.s = None
+
+    def close(self):
+        with self._lock:
+            self._close()
 
     def __enter__(self):
-        if not self.s:
-            # Get a socket to use
-            self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            self.s.connect(Lvmetad.SOCKET)
         return self
 
     # noinspection PyUnusedLocal
@@ -216,30 +227,117 @@ class Lvmetad(object):
 
     @staticmethod
     def parse(data):
-        return _get_object(data, 0)[0]
+        return _get_object(data)
 
-    def _request(self, cmd, args=None):
+    @staticmethod
+    def _format(cmd, args):
         req = '''request = "%s"\n''' % cmd
 
         if args:
             for k, v in args.items():
-                req += '''%s =\"%s"\n''' % (k, v)
+                req += '''%s = "%s"\n''' % (k, v)
 
         req += '''token = "filter:0"\n'''
-        self.s.sendall(req)
-        self.s.sendall(self.END)
+        return req + Lvmetad.END
 
-        data = ''
-        while self.END not in data:
-            data += self.s.recv(1024)
+    def _response(self):
+        # The next response on the connection, anything after it is kept for
+        # the one after.  Only look for the end in what we just received,
+        # along with the bit before it the terminator could straddle.
+        start = 0
+        while True:
+            end = self._buf.find(self.END, start)
+            if end != -1:
+                break
 
-        with open('/tmp/lvmetad', 'w') as debug:
-            debug.write(data)
+            start = max(0, len(self._buf) - len(self.END) + 1)
+            chunk = self.s.recv(self.READ_SIZE)
+            if not chunk:
+                raise socket.error('lvmetad closed the connection')
+            self._buf.extend(chunk)
+
+        end += len(self.END)
+        data = str(self._buf[:end])
+        del self._buf[:end]
         return data
 
+    def _record(self, cmd, seconds):
+        counts = self._latency.setdefault(
+            cmd, [0] * (len(LATENCY_BUCKETS) + 1))
+        counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def pipeline(self, requests):
+        """
+        Send requests in one go and wait for all of their responses
+        :param requests: List of (request name, dictionary of arguments or
+                         None)
+        :return: List of the responses, unparsed, in the order of requests
+        """
+        data = ''.join(self._format(cmd, args) for cmd, args in requests)
+
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if not self.s:
+                        self._connect()
+
+                    start = time.time()
+                    self.s.sendall(data)
+
+                    rc = []
+                    for cmd, args in requests:
+                        rc.append(self._response())
+                        self._record(cmd, time.time() - start)
+                    break
+                except socket.error as e:
+                    self._close()
+                    self._failures += 1
+                    self._last_error = str(e)
+                    if attempt:
+                        raise
+                except:
+                    self._close()
+                    raise
+
+            self._requests += len(requests)
+            self._round_trips += 1
+
+        if cfg.LVMETAD_DUMP:
+            with open(cfg.LVMETAD_DUMP, 'w') as debug:
+                debug.write(''.join(rc))
+        return rc
+
+    def _request(self, cmd, args=None):
+        return self.pipeline([(cmd, args)])[0]
+
     def all(self):
         return self.parse(self._request('dump'))
 
+    def vg_lookup(self, name=None, uuid=None):
+        if uuid:
+            return self.parse(self._request('vg_lookup', dict(uuid=uuid)))
+        return self.parse(self._request('vg_lookup', dict(name=name)))
+
+    def pv_list(self):
+        return self.parse(self._request('pv_list'))
+
+    def stats(self):
+        """
+        Health of the connection and how long requests take
+        :return: Dictionary with whether we are connected, the number of
+                 connections made, failed attempts at a round trip, requests
+                 and round trips made, the last error and for each request
+                 name the number of responses in each LATENCY_BUCKETS bucket
+        """
+        with self._lock:
+            return dict(connected=self.s is not None,
+                        connects=self._connects, failures=self._failures,
+                        requests=self._requests,
+                        round_trips=self._round_trips,
+                        last_error=self._last_error,
+                        latency=dict((k, list(v)) for k, v in
+                                     self._latency.items()))
+
 
 if __name__ == '__main__':
     with Lvmetad() as meta:
@@ -34,20 +34,32 @@ class ObjectManager(AutomatedProperties):
         self._objects = {}
         self._id_to_object_path = {}
         self.rlock = threading.RLock()
+        # Copy of _objects shared by readers until _objects changes
+        self._snapshot = None
 
     @dbus.service.method(dbus_interface="org.freedesktop.DBus.ObjectManager",
                          out_signature='a{oa{sa{sv}}}')
     def GetManagedObjects(self):
+        # Only hold the lock long enough to grab a copy of the object table,
+        # the objects keep their property values around so building the reply
+        # without it is cheap and doesn't hold up everyone else.
         with self.rlock:
-            rc = {}
-            try:
-                for k, v in self._objects.items():
-                    path, props = v[0].emit_data()
-                    rc[path] = props
-            except Exception:
-                traceback.print_exc(file=sys.stdout)
-                sys.exit(1)
-            return rc
+            if self._snapshot is None:
+                self._snapshot = self._objects.copy()
+            objects = self._snapshot
+
+        rc = {}
+        try:
+            for k, v in objects.items():
+                # Paths handed out ahead of the object being created
+                if v[0] is None:
+                    continue
+                path, props = v[0].emit_data()
+                rc[path] = props
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            sys.exit(1)
+        return rc
 
     def locked(self):
         """
@@ -85,6 +97,7 @@ class ObjectManager(AutomatedProperties):
         self._lookup_remove(path)
 
         self._objects[path] = (obj, lvm_id, uuid)
+        self._snapshot = None
         self._id_to_object_path[lvm_id] = path
 
         if uuid:
@@ -97,6 +110,7 @@ class ObjectManager(AutomatedProperties):
             del self._id_to_object_path[lvm_id]
             del self._id_to_object_path[uuid]
             del self._objects[obj_path]
+            self._snapshot = None
 
     def lookup_update(self, dbus_obj):
         with self.rlock:
@@ -105,12 +119,26 @@ class ObjectManager(AutomatedProperties):
             self._lookup_add(dbus_obj, obj_path,
                              dbus_obj.lvm_id, dbus_obj.Uuid)
 
-    def object_paths_by_type(self, o_type):
+    def object_paths_by_type(self, o_type, lvm_ids=None):
+        """
+        Return the paths of the objects of the specified type(s)
+        :param o_type: Type or tuple of types to match
+        :param lvm_ids: Optional list to limit the result to, an object
+                        matches when its lvm id is in the list or it's an LV
+                        of a VG which is in the list
+        :return: Dictionary with the object paths as keys
+        """
         with self.rlock:
             rc = {}
 
+            if lvm_ids is not None:
+                lvm_ids = set(lvm_ids)
+
             for k, v in self._objects.items():
                 if isinstance(v[0], o_type):
+                    if lvm_ids is not None and v[1] not in lvm_ids and \
+                            v[1].split('/')[0] not in lvm_ids:
+                        continue
                     rc[k] = True
             return rc
 
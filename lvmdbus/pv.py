@@ -19,8 +19,10 @@ import cfg
 import dbus
 from cfg import PV_INTERFACE
 import cmdhandler
+import inventory
+import extentmap
 from utils import thin_pool_obj_path_generate, lv_obj_path_generate, \
-    vg_obj_path_generate, n, pv_obj_path_generate
+    vg_obj_path_generate, pv_obj_path_generate
 from loader import common
 from request import RequestEntry
 from state import State
@@ -28,17 +30,37 @@ from state import State
 
 def pvs_state_retrieve(selection):
     rc = []
-    _pvs = cmdhandler.pv_retrieve(selection)
+    _pvs = inventory.pv_retrieve(selection)
     pvs = sorted(_pvs, key=lambda pk: pk['pv_name'])
+
+    # The extent maps of all the VGs involved are built from one segment
+    # report, instead of running a couple of lvm commands for each PV
+    maps = {}
+
+    if pvs:
+        vg_names = None
+        if selection:
+            vg_names = list(set([p['vg_name'] for p in pvs if p['vg_name']]))
+
+        if vg_names is None or len(vg_names):
+            maps = extentmap.build(inventory.lv_segments(vg_names), vg_names)
+
     for p in pvs:
+        m = maps.get(p['vg_name'])
+        if m is None:
+            m = extentmap.VgExtentMap(p['vg_name'])
+
         rc.append(
             PvState(p["pv_name"], p["pv_uuid"], p["pv_name"],
-                    p["pv_fmt"], n(p["pv_size"]), n(p["pv_free"]),
-                    n(p["pv_used"]), n(p["dev_size"]), n(p["pv_mda_size"]),
-                    n(p["pv_mda_free"]), long(p["pv_ba_start"]),
-                    n(p["pv_ba_size"]), n(p["pe_start"]),
-                    long(p["pv_pe_count"]), long(p["pv_pe_alloc_count"]),
-                    p["pv_attr"], p["pv_tags"], p["vg_name"], p["vg_uuid"]))
+                    p["pv_fmt"], p["pv_size"], p["pv_free"],
+                    p["pv_used"], p["dev_size"], p["pv_mda_size"],
+                    p["pv_mda_free"], p["pv_ba_start"],
+                    p["pv_ba_size"], p["pe_start"],
+                    p["pv_pe_count"], p["pv_pe_alloc_count"],
+                    p["pv_attr"], p["pv_tags"], p["vg_name"], p["vg_uuid"],
+                    m.segments(p["pv_name"], p["pv_pe_count"]),
+                    PvState._lv_object_list(
+                        p["vg_name"], m.lvs_on_pv(p["pv_name"]))))
     return rc
 
 
@@ -48,15 +70,21 @@ def load_pvs(device=None, object_path=None, refresh=False):
 
 # noinspection PyUnresolvedReferences
 class PvState(State):
+    __slots__ = ('lvm_path', 'Uuid', 'Name', 'Fmt', 'SizeBytes', 'FreeBytes',
+                 'UsedBytes', 'DevSizeBytes', 'MdaSizeBytes', 'MdaFreeBytes',
+                 'BaStart', 'BaSizeBytes', 'PeStart', 'PeCount',
+                 'PeAllocCount', 'attr', 'Tags', 'vg_name', 'vg_uuid',
+                 'pe_segments', 'lv', 'vg_path')
 
     @property
     def lvm_id(self):
         return self.lvm_path
 
-    def _lv_object_list(self, vg_name):
+    @staticmethod
+    def _lv_object_list(vg_name, lvs):
         rc = []
         if vg_name:
-            for lv in sorted(cmdhandler.pv_contained_lv(self.lvm_id)):
+            for lv in sorted(lvs):
                 full_name = "%s/%s" % (vg_name, lv[0])
                 segs = lv[1]
                 attrib = lv[2]
@@ -76,10 +104,28 @@ class PvState(State):
                  Fmt, SizeBytes, FreeBytes, UsedBytes, DevSizeBytes,
                  MdaSizeBytes, MdaFreeBytes, BaStart, BaSizeBytes,
                  PeStart, PeCount, PeAllocCount, attr, Tags, vg_name,
-                 vg_uuid):
-        utils.init_class_from_arguments(self, None)
-        self.pe_segments = cmdhandler.pv_segments(lvm_path)
-        self.lv = self._lv_object_list(vg_name)
+                 vg_uuid, pe_segments, lv):
+        self.lvm_path = lvm_path
+        self.Uuid = Uuid
+        self.Name = Name
+        self.Fmt = Fmt
+        self.SizeBytes = SizeBytes
+        self.FreeBytes = FreeBytes
+        self.UsedBytes = UsedBytes
+        self.DevSizeBytes = DevSizeBytes
+        self.MdaSizeBytes = MdaSizeBytes
+        self.MdaFreeBytes = MdaFreeBytes
+        self.BaStart = BaStart
+        self.BaSizeBytes = BaSizeBytes
+        self.PeStart = PeStart
+        self.PeCount = PeCount
+        self.PeAllocCount = PeAllocCount
+        self.attr = attr
+        self.Tags = Tags
+        self.vg_name = vg_name
+        self.vg_uuid = vg_uuid
+        self.pe_segments = pe_segments
+        self.lv = lv
 
         if vg_name:
             self.vg_path = cfg.om.get_object_path_by_lvm_id(
@@ -216,7 +262,7 @@ class Pv(AutomatedProperties):
                          async_callbacks=('cb', 'cbe'))
     def AllocationEnabled(self, yes, tmo, allocation_options, cb, cbe):
         r = RequestEntry(tmo, Pv._allocation_enabled,
-                         (self.state.uuid, self.state.lvm_id,
+                         (self.state.Uuid, self.state.lvm_id,
                           yes, allocation_options),
                          cb, cbe, False)
         cfg.worker_q.put(r)
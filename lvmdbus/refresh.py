@@ -16,49 +16,188 @@
 # Try and minimize the refreshes we do.
 
 import threading
+import time
 from request import RequestEntry
 import cfg
 import utils
-from fetch import load
+import cmdhandler
+from fetch import load, load_selected
+from scheduler import EXCLUSIVE
 
 
-_rlock = threading.RLock()
-_count = 0
+_cond = threading.Condition()
 
+# What the next refresh needs to cover, events are merged into it until the
+# refresh runs.  When full is set everything is reloaded.
+_scope = dict(full=False, pvs=set(), vgs=set(), lvs=set())
+
+# When the first and the latest event of the batch being collected arrived,
+# None when we are not collecting
+_batch_start = None
+_batch_last = None
+
+# A refresh request is sitting in the worker queue
+_queued = False
+
+_stats = dict(received=0, merged=0, executed=0)
+
+
+def _scope_take():
+    global _scope
+    global _queued
+    with _cond:
+        rc = _scope
+        _scope = dict(full=False, pvs=set(), vgs=set(), lvs=set())
+        _queued = False
+        _stats['executed'] += 1
+        return rc
+
+
+def _scope_add(pvs, vgs, lvs):
+    # Note: lock implied
+    if not (pvs or vgs or lvs):
+        _scope['full'] = True
+    else:
+        _scope['pvs'].update(pvs or [])
+        _scope['vgs'].update(vgs or [])
+        _scope['lvs'].update(lvs or [])
+
+
+def event_scope(event, lvm_id, lvm_uuid, seq_no):
+    """
+    Figure out which objects an external event affects.
+    :param event:       Event name, eg. vg_update
+    :param lvm_id:      The lvm identifier the event is about
+    :param lvm_uuid:    The uuid of the object the event is about
+    :param seq_no:      VG sequence number
+    :return: (pvs, vgs, lvs) lists or None when nothing needs refreshing,
+             all empty when everything needs to be
+    """
+    if not lvm_id:
+        return [], [], []
+
+    if lvm_id.startswith('/'):
+        pv = cfg.om.get_by_lvm_id(lvm_id)
+        if pv and pv.Vg != '/':
+            vg = cfg.om.get_by_path(pv.Vg)
+            if vg:
+                return [lvm_id], [vg.Name], []
+        return [lvm_id], [], []
+
+    if '/' in lvm_id:
+        vg_name = lvm_id.split('/')[0]
+        return [], [vg_name], [lvm_id]
 
-def handle_external_event(event, lvm_id, lvm_uuid, seq_no):
-    utils.pprint("External event: '%s', '%s', '%s', '%s'" %
-                 (event, lvm_id, lvm_uuid, str(seq_no)))
-    event_complete()
     # Let's see if we have the VG and if the sequence numbers match, if
     # they do we have nothing to process (in theory)
-    # We can try to be selective about what we re-fresh, but in reality
-    # it takes just as long to selectively re-fresh as it does to grab
-    # everything and let stuff sort itself out.
-    if lvm_uuid and lvm_id:
-        # If we are supplied with these, lets see if we need to update
+    if lvm_uuid:
         vg = cfg.om.get_by_uuid_lvm_id(lvm_uuid, lvm_id)
-        if not (event == 'vg_update' and vg and vg.Seqno == seq_no):
-            load(refresh=True)
-    else:
+        if event == 'vg_update' and vg and vg.Seqno == seq_no:
+            return None
+
+    # Anything could have changed in the VG
+    return [], [lvm_id], [lvm_id]
+
+
+def handle_external_event():
+    scope = _scope_take()
+    utils.pprint("External event refresh: full= %s, pvs= %s, vgs= %s, "
+                 "lvs= %s" % (str(scope['full']), str(list(scope['pvs'])),
+                              str(list(scope['vgs'])),
+                              str(list(scope['lvs']))))
+
+    # Refresh only what the events said changed, we fall back to reloading
+    # everything when we were not told
+    if scope['full']:
         load(refresh=True)
+    elif scope['pvs'] or scope['vgs'] or scope['lvs']:
+        load_selected(scope['pvs'], scope['vgs'], scope['lvs'])
+
+
+def event_add(params, pvs=None, vgs=None, lvs=None):
+    """
+    Add an event to the batch of events waiting to be refreshed for.  The
+    batch is handed to the workers once no events have arrived for
+    cfg.EVENT_QUIET_PERIOD seconds, or cfg.EVENT_MAX_LATENCY seconds after
+    its first event at the latest, see event_aggregator.
+    :param params:  (event, lvm_id, lvm_uuid, seq_no)
+    :param pvs:     PV device names the event affects
+    :param vgs:     VG names the event affects
+    :param lvs:     LV names (vg/lv or vg for all LVs in it) the event affects
+    When none of pvs, vgs and lvs is given they are worked out from params,
+    if that isn't possible everything is refreshed.
+    """
+    global _batch_start
+    global _batch_last
+
+    utils.pprint("External event: '%s', '%s', '%s', '%s'" %
+                 (params[0], params[1], params[2], str(params[3])))
+
+    # Whatever we have seen of lvm may be out of date now
+    cmdhandler.invalidate_reports()
+
+    if not (pvs or vgs or lvs):
+        scope = event_scope(*params)
+    else:
+        scope = (pvs, vgs, lvs)
+
+    with _cond:
+        _stats['received'] += 1
+        if scope is None:
+            return
+
+        _scope_add(*scope)
+
+        now = time.time()
+        if _queued or _batch_start is not None:
+            _stats['merged'] += 1
+        else:
+            _batch_start = now
+        _batch_last = now
+        _cond.notify_all()
+
+
+def _batch_due(now):
+    # Note: lock implied
+    if _batch_start is None:
+        return None
+    return min(_batch_last + cfg.EVENT_QUIET_PERIOD,
+               _batch_start + cfg.EVENT_MAX_LATENCY) - now
+
+
+def event_aggregator():
+    """
+    Thread which waits for batches of events to settle and then queues a
+    single refresh for each of them.
+    """
+    global _batch_start
+    global _batch_last
+    global _queued
+
+    while cfg.run.value != 0:
+        with _cond:
+            due = _batch_due(time.time())
+            if due is None or due > 0:
+                # Wake up every now and then to check if we should exit
+                _cond.wait(min(due, 5) if due is not None else 5)
+                continue
+
+            _batch_start = None
+            _batch_last = None
+
+            if not _queued:
+                _queued = True
+                r = RequestEntry(-1, handle_external_event,
+                                 (), None, None, False, [EXCLUSIVE])
+                cfg.worker_q.put(r)
 
 
-def event_add(params):
-    global _rlock
-    global _count
-    with _rlock:
-        if _count == 0:
-            _count += 1
-            r = RequestEntry(-1, handle_external_event,
-                             params, None, None, False)
-            cfg.worker_q.put(r)
-
-
-def event_complete():
-    global _rlock
-    global _count
-    with _rlock:
-        if _count > 0:
-            _count -= 1
-        return _count
+def event_statistics():
+    """
+    Return the event counters
+    :return: Dictionary with the number of events received, the number of
+             those merged into an earlier pending refresh and the number of
+             refreshes executed
+    """
+    with _cond:
+        return dict(_stats)
@@ -22,13 +22,17 @@ import dbus
 
 class RequestEntry(object):
     def __init__(self, tmo, method, arguments, cb, cb_error,
-                 return_tuple=True):
+                 return_tuple=True, lock_keys=None, no_result='/'):
         self.tmo = tmo
         self.method = method
         self.arguments = arguments
         self.cb = cb
         self.cb_error = cb_error
 
+        # Locks needed to run this request, None when they can be derived
+        # from the arguments, see scheduler.lock_keys
+        self.lock_keys = lock_keys
+
         self.timer_id = -1
         self.lock = threading.RLock()
         self.done = False
@@ -38,6 +42,10 @@ class RequestEntry(object):
         self._rc_error = None
         self._return_tuple = return_tuple
 
+        # What goes in place of the result when a job is returned, it has to
+        # match the signature of the result
+        self._no_result = no_result
+
         if self.tmo == -1:
             # Client is willing to block forever
             pass
@@ -60,7 +68,7 @@ class RequestEntry(object):
         self._job = Job(None, self)
         cfg.om.register_object(self._job, True)
         if self._return_tuple:
-            self.cb(('/', self._job.dbus_object_path()))
+            self.cb((self._no_result, self._job.dbus_object_path()))
         else:
             self.cb(self._job.dbus_object_path())
 
@@ -0,0 +1,133 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import Queue
+import cfg
+
+# Lock key taken by requests which need everything to themselves, eg. a full
+# refresh of the model
+EXCLUSIVE = '*'
+
+
+def lvm_id_lock_key(lvm_id):
+    """
+    Given an lvm identifier return the key of the lock which protects it.
+    LVs are protected by the lock of their VG, as are PVs which are part of a
+    VG, orphan PVs have a lock of their own.
+    :param lvm_id: PV device, VG name or vg/lv
+    :return: Lock key
+    """
+    if lvm_id.startswith('/'):
+        pv = cfg.om.get_by_lvm_id(lvm_id)
+        if pv and pv.Vg != '/':
+            vg = cfg.om.get_by_path(pv.Vg)
+            if vg:
+                return 'vg:' + vg.Name
+        return 'pv:' + lvm_id
+    return 'vg:' + lvm_id.split('/')[0]
+
+
+def lock_keys(request):
+    """
+    Figure out which locks a request needs.  Unless the request states them
+    explicitly they are derived from the target of the request, by convention
+    the methods of the Pv, Vg and Lv objects take (uuid, lvm_id, ...) as
+    arguments.
+    :param request: RequestEntry
+    :return: List of lock keys
+    """
+    if request.lock_keys is not None:
+        return list(request.lock_keys)
+    return [lvm_id_lock_key(request.arguments[1])]
+
+
+class RequestScheduler(object):
+    """
+    Hands out queued requests to a number of worker threads.  Requests which
+    need the same lock (eg. operate on the same VG) are executed one at a
+    time in the order they were queued, unrelated requests run in parallel.
+
+    Follows the Queue.Queue interface, workers need to call task_done with
+    the request when they are finished with it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = {}
+        self._held = {}
+
+    def put(self, request):
+        keys = lock_keys(request)
+        with self._cond:
+            self._pending.append((request, keys))
+            self._cond.notify_all()
+
+    def _runnable(self):
+        # Keys already taken, either by running requests or by requests which
+        # were queued earlier, the latter keeps requests in order per key
+        claimed = set(self._held.keys())
+
+        for i, (request, keys) in enumerate(self._pending):
+            if EXCLUSIVE in keys:
+                conflict = len(claimed) > 0
+            else:
+                conflict = EXCLUSIVE in claimed or \
+                    any(k in claimed for k in keys)
+
+            if not conflict:
+                del self._pending[i]
+                return request, keys
+
+            claimed.update(keys)
+        return None
+
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            end = None
+            if timeout is not None:
+                end = time.time() + timeout
+
+            while True:
+                item = self._runnable()
+                if item:
+                    request, keys = item
+                    self._running[id(request)] = keys
+                    for k in keys:
+                        self._held[k] = self._held.get(k, 0) + 1
+                    return request
+
+                if not block:
+                    raise Queue.Empty
+
+                if end is None:
+                    self._cond.wait()
+                else:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        raise Queue.Empty
+                    self._cond.wait(remaining)
+
+    def task_done(self, request):
+        with self._cond:
+            for k in self._running.pop(id(request)):
+                self._held[k] -= 1
+                if self._held[k] == 0:
+                    del self._held[k]
+            self._cond.notify_all()
+
+    def qsize(self):
+        with self._cond:
+            return len(self._pending)
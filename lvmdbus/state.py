@@ -19,6 +19,10 @@ from abc import ABCMeta, abstractmethod
 class State(object):
     __metaclass__ = ABCMeta
 
+    # The states of the PVs, VGs and LVs list their attributes in __slots__,
+    # there can be tens of thousands of them
+    __slots__ = ()
+
     @abstractmethod
     def lvm_id(self):
         pass
@@ -32,5 +36,7 @@ class State(object):
         pass
 
     def __str__(self):
-        return '*****\n' + str(self.__dict__) + '\n******\n'
+        return '*****\n' + \
+            str(dict((k, getattr(self, k, None)) for k in self.__slots__)) + \
+            '\n******\n'
 
@@ -20,29 +20,59 @@ import cfg
 observer = None
 
 
+def _pv_scope(device_name):
+    # A PV and the VG it was part of
+    vgs = []
+    pv = cfg.om.get_by_lvm_id(device_name)
+    if pv and pv.Vg != '/':
+        vg = cfg.om.get_by_path(pv.Vg)
+        if vg:
+            vgs.append(vg.Name)
+    return [device_name], vgs, []
+
+
+def _lv_scope(vg_name, lv_name):
+    # An LV and the VG it is in, when we don't know the LV (it's new or
+    # renamed, or it's a hidden sub LV of something) refresh all LVs of the VG
+    full_name = '%s/%s' % (vg_name, lv_name)
+    if cfg.om.get_by_lvm_id(full_name):
+        return [], [vg_name], [full_name]
+    return [], [vg_name], [vg_name]
+
+
 # noinspection PyUnusedLocal
 def filter_event(action, device):
     # Filter for events of interest and add a request object to be processed
-    # when appropriate.
+    # when appropriate, limiting the refresh to the objects the event is
+    # about when we can tell which they are.
     refresh = False
+    scope = ([], [], [])
 
     if '.ID_FS_TYPE_NEW' in device:
         fs_type_new = device['.ID_FS_TYPE_NEW']
 
         if 'LVM' in fs_type_new:
             refresh = True
+            if 'DEVNAME' in device:
+                scope = _pv_scope(device['DEVNAME'])
         elif fs_type_new == '':
             # Check to see if the device was one we knew about
             if 'DEVNAME' in device:
                 found = cfg.om.get_by_lvm_id(device['DEVNAME'])
                 if found:
                     refresh = True
+                    scope = _pv_scope(device['DEVNAME'])
 
     if 'DM_LV_NAME' in device:
+        if not refresh and device.get('DM_VG_NAME'):
+            scope = _lv_scope(device['DM_VG_NAME'], device['DM_LV_NAME'])
+        elif refresh:
+            # A PV on top of an LV, we don't bother being selective
+            scope = ([], [], [])
         refresh = True
 
     if refresh:
-        event_add(('udev', None, None, 0))
+        event_add(('udev', None, None, 0), *scope)
 
 
 def add():
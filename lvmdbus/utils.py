@@ -58,25 +58,6 @@ def rtype(dbus_type):
     return decorator
 
 
-# Field is expected to be a number, handle the corner cases when parsing
-@rtype(dbus.UInt64)
-def n(v):
-    if not v:
-        return 0L
-    if v.endswith('B'):
-        return long(v[:-1])
-    return long(float(v))
-
-
-@rtype(dbus.UInt32)
-def n32(v):
-    if not v:
-        return 0
-    if v.endswith('B'):
-        return int(v[:-1])
-    return int(float(v))
-
-
 # noinspection PyProtectedMember
 def init_class_from_arguments(obj_instance, prefix='_'):
     for k, v in sys._getframe(1).f_locals.items():
@@ -97,22 +78,26 @@ def init_class_from_arguments(obj_instance, prefix='_'):
                 setattr(obj_instance, nt, v)
 
 
-def get_properties(f, interface=None):
+# (class, interface) -> property schema, see property_schema
+_property_schemas = {}
+
+
+def property_schema(cls, interface=None):
     """
-    Walks through an object instance or it's parent class(es) and determines
-    which attributes are properties and if they were created to be used for
-    dbus.
-    :param f:   Object to inspect
-    :param interface: The interface we are seeking properties for
-    :return:    A tuple:
-                0 = An array of dicts with the keys being: p_t, p_name,
-                p_access(type, name, access)
-                1 = Hash of property names and current value
+    Walks through a class and its parent class(es) and determines which
+    attributes are properties and if they were created to be used for dbus.
+    The result only depends on the class, so it is worked out once and kept.
+    :param cls:         Class to inspect
+    :param interface:   The interface we are seeking properties for
+    :return:    A tuple of (name, dbus type, access, getter) for each property
     """
-    result = []
-    h_rc = {}
+    key = (cls, interface)
+    rc = _property_schemas.get(key)
+    if rc is not None:
+        return rc
 
-    for c in inspect.getmro(f.__class__):
+    rc = []
+    for c in inspect.getmro(cls):
         try:
             if interface is not None and c.DBUS_INTERFACE != interface:
                 continue
@@ -123,18 +108,48 @@ def get_properties(f, interface=None):
         for p, value in h.iteritems():
             if isinstance(value, property):
                 # We found a property, see if it has a metadata type
-                key = attribute_type_name(p)
-                if key in h:
+                type_key = attribute_type_name(p)
+                if type_key in h:
+                    prop = getattr(cls, p)
                     access = ''
-                    if getattr(f.__class__, p).fget:
+                    if prop.fget:
                         access += 'read'
-                    if getattr(f.__class__, p).fset:
+                    if prop.fset:
                         access += 'write'
 
-                    result.append(dict(p_t=getattr(f, key), p_name=p,
-                                       p_access=access))
-                    h_rc[p] = getattr(f, p)
-    return result, h_rc
+                    rc.append((p, getattr(cls, type_key), access, prop.fget))
+
+    rc = tuple(rc)
+    _property_schemas[key] = rc
+    return rc
+
+
+def get_property_values(f, interface=None):
+    """
+    Retrieve the current values of the dbus properties of an object
+    :param f:   Object to retrieve the values from
+    :param interface: The interface we are seeking properties for
+    :return:    Hash of property names and current value
+    """
+    return dict((p[0], p[3](f))
+                for p in property_schema(f.__class__, interface))
+
+
+def get_properties(f, interface=None):
+    """
+    Walks through an object instance or it's parent class(es) and determines
+    which attributes are properties and if they were created to be used for
+    dbus.
+    :param f:   Object to inspect
+    :param interface: The interface we are seeking properties for
+    :return:    A tuple:
+                0 = An array of dicts with the keys being: p_t, p_name,
+                p_access(type, name, access)
+                1 = Hash of property names and current value
+    """
+    schema = property_schema(f.__class__, interface)
+    result = [dict(p_t=p[1], p_name=p[0], p_access=p[2]) for p in schema]
+    return result, get_property_values(f, interface)
 
 
 def get_object_property_diff(o_prop, n_prop):
@@ -182,6 +197,40 @@ def add_properties(xml, interface, props):
     return xml
 
 
+INTROSPECT_HEADER = \
+    '<!DOCTYPE node PUBLIC ' \
+    '"-//freedesktop//DTD D-BUS Object Introspection 1.0//EN"\n' \
+    '"http://www.freedesktop.org/standards/dbus/1.0/introspect.dtd">\n'
+
+
+def introspect_interfaces(xml, interface, props):
+    """
+    Given the introspection xml of an object, add the properties to the
+    specified interface and return the interface definitions without the
+    surrounding node or any child nodes, those depend on the object path.
+    :param xml:         Introspection XML of an object
+    :param interface:   Interface to add the properties too
+    :param props:       Output from get_properties
+    :return: XML string of the interface elements
+    """
+    root = Et.fromstring(add_properties(xml, interface, props))
+    return ''.join(Et.tostring(c, encoding='utf8').split('?>', 1)[-1].strip()
+                   + '\n' for c in root if c.tag == 'interface')
+
+
+def introspect_xml(object_path, interfaces, children):
+    """
+    Put the introspection xml of an object together
+    :param object_path: Object path of the object
+    :param interfaces:  Output from introspect_interfaces
+    :param children:    Names of the child nodes of the object
+    :return: Introspection XML string
+    """
+    return INTROSPECT_HEADER + '<node name="%s">\n' % object_path + \
+        interfaces + ''.join('  <node name="%s"/>\n' % c for c in children) + \
+        '</node>\n'
+
+
 def attribute_type_name(name):
     """
     Given the property name, return string of the attribute type
@@ -17,31 +17,48 @@ from automatedproperties import AutomatedProperties
 
 import utils
 from utils import lv_obj_path_generate, thin_pool_obj_path_generate, \
-    pv_obj_path_generate, vg_obj_path_generate, n
+    pv_obj_path_generate, vg_obj_path_generate
 import dbus
 import cfg
 from cfg import VG_INTERFACE, MANAGER_INTERFACE
 import cmdhandler
+import inventory
+import extentmap
+import allocation
 from request import RequestEntry
-from loader import common
+from scheduler import lvm_id_lock_key
+from loader import common, refresh_objects
 from lv import load_lvs
 from state import State
 
 
 def vgs_state_retrieve(selection):
     rc = []
-    _vgs = cmdhandler.vg_retrieve(selection)
+    _vgs = inventory.vg_retrieve(selection)
     vgs = sorted(_vgs, key=lambda vk: vk['vg_name'])
+
+    # Gather the PV & LV membership for all the VGs at once
+    pvs_in_vg = {}
+    lvs_in_vg = {}
+
+    if vgs:
+        pvs_in_vg = inventory.pvs_in_vg(selection)
+        lvs_in_vg = inventory.lvs_in_vg(selection)
+
     for v in vgs:
         rc.append(
-            VgState(v['vg_uuid'], v['vg_name'], v['vg_fmt'], n(v['vg_size']),
-                    n(v['vg_free']), v['vg_sysid'], n(v['vg_extent_size']),
-                    n(v['vg_extent_count']), n(v['vg_free_count']),
-                    v['vg_profile'], n(v['max_lv']), n(v['max_pv']),
-                    n(v['pv_count']), n(v['lv_count']), n(v['snap_count']),
-                    n(v['vg_seqno']), n(v['vg_mda_count']),
-                    n(v['vg_mda_free']), n(v['vg_mda_size']),
-                    n(v['vg_mda_used_count']), v['vg_attr'], v['vg_tags']))
+            VgState(v['vg_uuid'], v['vg_name'], v['vg_fmt'], v['vg_size'],
+                    v['vg_free'], v['vg_sysid'], v['vg_extent_size'],
+                    v['vg_extent_count'], v['vg_free_count'],
+                    v['vg_profile'], v['max_lv'], v['max_pv'],
+                    v['pv_count'], v['lv_count'], v['snap_count'],
+                    v['vg_seqno'], v['vg_mda_count'],
+                    v['vg_mda_free'], v['vg_mda_size'],
+                    v['vg_mda_used_count'], v['vg_attr'], v['vg_tags'],
+                    VgState._pv_paths_build(
+                        pvs_in_vg.get(v['vg_name'], [])),
+                    VgState._lv_paths_build(
+                        v['vg_name'], lvs_in_vg.get(v['vg_name'], []))))
     return rc
 
 
@@ -51,6 +68,11 @@ def load_vgs(vg_specific=None, object_path=None, refresh=False):
 
 # noinspection PyPep8Naming,PyUnresolvedReferences,PyUnusedLocal
 class VgState(State):
+    __slots__ = ('Uuid', 'Name', 'Fmt', 'SizeBytes', 'FreeBytes', 'SysId',
+                 'ExtentSizeBytes', 'ExtentCount', 'FreeCount', 'Profile',
+                 'MaxLv', 'MaxPv', 'PvCount', 'LvCount', 'SnapCount', 'Seqno',
+                 'MdaCount', 'MdaFree', 'MdaSizeBytes', 'MdaUsedCount', 'attr',
+                 'tags', 'Pvs', 'Lvs')
 
     @property
     def lvm_id(self):
@@ -59,11 +81,12 @@ class VgState(State):
     def identifiers(self):
         return (self.Uuid, self.Name)
 
-    def _lv_paths_build(self, name):
+    @staticmethod
+    def _lv_paths_build(name, lvs):
         rc = []
-        for lv in cmdhandler.lvs_in_vg(name):
+        for lv in lvs:
             (lv_name, lv_attr, lv_uuid) = lv
-            full_name = "%s/%s" % (self.Name, lv_name)
+            full_name = "%s/%s" % (name, lv_name)
 
             gen = lv_obj_path_generate
             if lv_attr[0] == 't':
@@ -75,9 +98,9 @@ class VgState(State):
         return dbus.Array(rc, signature='o')
 
     @staticmethod
-    def _pv_paths_build(name):
+    def _pv_paths_build(pvs):
         rc = []
-        for p in cmdhandler.pvs_in_vg(name):
+        for p in pvs:
             (pv_name, pv_uuid) = p
             rc.append(cfg.om.get_object_path_by_lvm_id(
                 pv_uuid, pv_name, pv_obj_path_generate))
@@ -87,10 +110,31 @@ class VgState(State):
                  SizeBytes, FreeBytes, SysId, ExtentSizeBytes,
                  ExtentCount, FreeCount, Profile, MaxLv, MaxPv, PvCount,
                  LvCount, SnapCount, Seqno, MdaCount, MdaFree,
-                 MdaSizeBytes, MdaUsedCount, attr, tags):
-        utils.init_class_from_arguments(self, None)
-        self.Pvs = self._pv_paths_build(Name)
-        self.Lvs = self._lv_paths_build(Name)
+                 MdaSizeBytes, MdaUsedCount, attr, tags, Pvs, Lvs):
+        self.Uuid = Uuid
+        self.Name = Name
+        self.Fmt = Fmt
+        self.SizeBytes = SizeBytes
+        self.FreeBytes = FreeBytes
+        self.SysId = SysId
+        self.ExtentSizeBytes = ExtentSizeBytes
+        self.ExtentCount = ExtentCount
+        self.FreeCount = FreeCount
+        self.Profile = Profile
+        self.MaxLv = MaxLv
+        self.MaxPv = MaxPv
+        self.PvCount = PvCount
+        self.LvCount = LvCount
+        self.SnapCount = SnapCount
+        self.Seqno = Seqno
+        self.MdaCount = MdaCount
+        self.MdaFree = MdaFree
+        self.MdaSizeBytes = MdaSizeBytes
+        self.MdaUsedCount = MdaUsedCount
+        self.attr = attr
+        self.tags = tags
+        self.Pvs = Pvs
+        self.Lvs = Lvs
 
     def create_dbus_object(self, path):
         if not path:
@@ -143,32 +187,32 @@ class Vg(AutomatedProperties):
 
     def refresh_pvs(self, pv_list=None):
         """
-        Refresh the state of the PVs for this vg given a PV object path
+        Refresh the state of the PVs for this vg given a PV object path, the
+        PVs are retrieved together with a fixed number of lvm commands
         :param pv_list:  List of PVs to refresh (optional), do all when None
         """
         if not pv_list:
             pv_list = self.state.Pvs
 
-        for p in pv_list:
-            pv = cfg.om.get_by_path(p)
-            pv.refresh()
+        refresh_objects([cfg.om.get_by_path(p) for p in pv_list])
 
     def refresh_lvs(self, lv_list=None, vg_name=None):
         """
-        Refresh the state of the PVs for this vg given a PV object path
+        Refresh the state of the LVs of this vg, all of them are retrieved
+        with one lvs command
         :param lv_list: List of specific LVs to refresh
-        :param vg_name: VG the LV resides on
+        :param vg_name: VG the LVs reside on, when it isn't the one we have
         """
         if not lv_list:
             lv_list = self.state.Lvs
 
-        for i in lv_list:
-            obj = cfg.om.get_by_path(i)
+        lvs = [cfg.om.get_by_path(i) for i in lv_list]
 
-            if vg_name:
-                obj.refresh(search_key="%s/%s" % (vg_name, obj.name))
-            else:
-                obj.refresh()
+        search_keys = None
+        if vg_name:
+            search_keys = [vg_name]
+
+        refresh_objects(lvs, search_keys)
 
     @staticmethod
     def _rename(uuid, vg_name, new_name, rename_options):
@@ -180,19 +224,16 @@ class Vg(AutomatedProperties):
                                                 rename_options)
             if rc == 0:
 
+                extentmap.forget(vg_name)
+
                 # The refresh will fix up all the lookups for this object,
                 # however the LVs will still have the wrong lookup entries.
                 dbo.refresh(new_name)
 
-                for lv in dbo.Lvs:
-                    # This will fix the lookups, and the object state actually
-                    # has an update as the path property is changing, but it's
-                    # unfortunate that we need to go out and fetch all of these
-                    # TODO: Change to some kind of batch operation where we do
-                    # all with one lvs command instead of
-                    # fetching one at a time
-                    lv_obj = cfg.om.get_by_path(lv)
-                    lv_obj.refresh()
+                # This will fix the lookups, and the object state actually
+                # has an update as the path property is changing, all the LVs
+                # are fetched with one lvs command for the VG
+                dbo.refresh_lvs(vg_name=new_name)
             else:
                 # Need to work on error handling, need consistent
                 raise dbus.exceptions.DBusException(
@@ -208,10 +249,13 @@ class Vg(AutomatedProperties):
                          in_signature='sia{sv}', out_signature='o',
                          async_callbacks=('cb', 'cbe'))
     def Rename(self, name, tmo, rename_options, cb, cbe):
+        # The new name is taken too, so nothing else can claim it meanwhile
         r = RequestEntry(tmo, Vg._rename,
                          (self.state.Uuid, self.state.lvm_id, name,
                           rename_options),
-                         cb, cbe, False)
+                         cb, cbe, False,
+                         lock_keys=[lvm_id_lock_key(self.state.lvm_id),
+                                    lvm_id_lock_key(name)])
         cfg.worker_q.put(r)
 
     @staticmethod
@@ -224,6 +268,8 @@ class Vg(AutomatedProperties):
             rc, out, err = cmdhandler.vg_remove(vg_name, remove_options)
 
             if rc == 0:
+                extentmap.forget(vg_name)
+
                 # Remove data for associated LVs as it's gone
                 for lv_path in dbo.Lvs:
                     lv = cfg.om.get_by_path(lv_path)
@@ -269,9 +315,7 @@ class Vg(AutomatedProperties):
                 dbo.refresh()
 
                 if 'activate' in change_options:
-                    for lv in dbo.lvs:
-                        lv_obj = cfg.om.get_by_path(lv)
-                        lv_obj.refresh()
+                    dbo.refresh_lvs()
             else:
                 raise dbus.exceptions.DBusException(
                     VG_INTERFACE,
@@ -330,6 +374,18 @@ class Vg(AutomatedProperties):
                 (uuid, vg_name))
         return '/'
 
+    def _pv_lock_keys(self, pv_object_paths):
+        # The VG and the PVs joining or leaving it, which are orphans before
+        # or after
+        keys = [lvm_id_lock_key(self.state.lvm_id)]
+        for p in pv_object_paths:
+            pv = cfg.om.get_by_path(p)
+            if pv:
+                key = lvm_id_lock_key(pv.lvm_id)
+                if key not in keys:
+                    keys.append(key)
+        return keys
+
     @dbus.service.method(dbus_interface=VG_INTERFACE,
                          in_signature='baoia{sv}',
                          out_signature='o',
@@ -337,7 +393,8 @@ class Vg(AutomatedProperties):
     def Reduce(self, missing, pv_object_paths, tmo, reduce_options, cb, cbe):
         r = RequestEntry(tmo, Vg._reduce,
                          (self.state.Uuid, self.state.lvm_id, missing,
-                          pv_object_paths, reduce_options), cb, cbe, False)
+                          pv_object_paths, reduce_options), cb, cbe, False,
+                         lock_keys=self._pv_lock_keys(pv_object_paths))
         cfg.worker_q.put(r)
 
     @staticmethod
@@ -390,7 +447,8 @@ class Vg(AutomatedProperties):
         r = RequestEntry(tmo, Vg._extend,
                          (self.state.Uuid, self.state.lvm_id, pv_object_paths,
                           extend_options),
-                         cb, cbe, False)
+                         cb, cbe, False,
+                         lock_keys=self._pv_lock_keys(pv_object_paths))
         cfg.worker_q.put(r)
 
     @staticmethod
@@ -576,6 +634,208 @@ class Vg(AutomatedProperties):
                           create_options), cb, cbe)
         cfg.worker_q.put(r)
 
+    @staticmethod
+    def _lv_create_one(vg_name, spec, create_options):
+        """
+        Run the lvcreate for one entry of a batch
+        :param vg_name:         VG to create the LV in
+        :param spec:            Description of the LV, see LvCreateBatch
+        :param create_options:  Options for all the LVs of the batch
+        :return: (name, error), error is empty on success
+        """
+        name = str(spec.get('name', ''))
+        size_bytes = long(spec.get('size_bytes', 0))
+        layout = str(spec.get('type', 'linear'))
+        num_stripes = int(spec.get('num_stripes', 0))
+        stripe_size_kb = int(spec.get('stripe_size_kb', 0))
+        num_copies = int(spec.get('num_copies', 0))
+
+        options = dict(create_options)
+        options.update(spec.get('options', {}))
+
+        if not name:
+            return name, 'No name given'
+
+        if layout == 'linear':
+            rc, out, err = cmdhandler.vg_lv_create_linear(
+                vg_name, options, name, size_bytes, False)
+        elif layout == 'striped':
+            rc, out, err = cmdhandler.vg_lv_create_striped(
+                vg_name, options, name, size_bytes, num_stripes,
+                stripe_size_kb, False)
+        elif layout == 'mirror':
+            rc, out, err = cmdhandler.vg_lv_create_mirror(
+                vg_name, options, name, size_bytes, num_copies)
+        elif layout.startswith('raid'):
+            rc, out, err = cmdhandler.vg_lv_create_raid(
+                vg_name, options, name, layout, size_bytes, num_stripes,
+                stripe_size_kb)
+        elif layout == 'thin':
+            pool = cfg.om.get_by_path(str(spec.get('thin_pool', '/')))
+            if not pool or not hasattr(pool, 'IsThinPool') or \
+                    not pool.IsThinPool or pool.vg_name_lookup() != vg_name:
+                return name, 'Thin pool %s not in VG %s' % \
+                    (str(spec.get('thin_pool', '')), vg_name)
+            rc, out, err = cmdhandler.lv_lv_create(
+                pool.lvm_id, options, name, size_bytes)
+        else:
+            return name, 'Unsupported LV type %s' % layout
+
+        if rc != 0:
+            return name, 'Exit code %s, stderr = %s' % (str(rc), err)
+        return name, ''
+
+    @staticmethod
+    def _lv_create_batch(uuid, vg_name, lv_specs, create_options):
+        # Make sure we have a dbus object representing it
+        dbo = cfg.om.get_by_uuid_lvm_id(uuid, vg_name)
+
+        if not dbo:
+            raise dbus.exceptions.DBusException(
+                VG_INTERFACE, 'VG with uuid %s and name %s not present!' %
+                (uuid, vg_name))
+
+        # Results are matched to the LVs by name, so it has to be unique
+        names = [str(spec.get('name', '')) for spec in lv_specs]
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if duplicates:
+            raise dbus.exceptions.DBusException(
+                VG_INTERFACE, 'LV names used more than once: %s' %
+                ', '.join(duplicates))
+
+        results = [Vg._lv_create_one(vg_name, spec, create_options)
+                   for spec in lv_specs]
+
+        # Everything we created is loaded at once and the VG, the PVs and the
+        # thin pools used are refreshed once for the whole batch, so each of
+        # them signals its changes only once
+        created = ["%s/%s" % (vg_name, name)
+                   for name, error in results if not error]
+        paths = {}
+        if created:
+            for l in load_lvs(created)[0]:
+                cfg.om.register_object(l, True)
+                paths[l.lvm_id] = l.dbus_object_path()
+
+            pools = set(str(spec['thin_pool']) for spec in lv_specs
+                        if spec.get('type') == 'thin' and
+                        'thin_pool' in spec)
+            for p in pools:
+                pool = cfg.om.get_by_path(p)
+                if pool:
+                    pool.refresh()
+
+            dbo.refresh()
+            dbo.refresh_pvs()
+
+        rc = dbus.Array([], signature='(os)')
+        for name, error in results:
+            path = '/'
+            if not error:
+                path = paths.get("%s/%s" % (vg_name, name), '/')
+                if path == '/':
+                    error = 'LV %s/%s not found after creating it' % \
+                        (vg_name, name)
+            rc.append(dbus.Struct((dbus.ObjectPath(path), error),
+                                  signature='os'))
+        return rc
+
+    @dbus.service.method(dbus_interface=VG_INTERFACE,
+                         in_signature='aa{sv}ia{sv}',
+                         out_signature='(a(os)o)',
+                         async_callbacks=('cb', 'cbe'))
+    def LvCreateBatch(self, lv_specs, tmo, create_options, cb, cbe):
+        """
+        Create a number of LVs with a single request, the LVs are created one
+        after the other and the state is updated once at the end.
+        :param lv_specs:        For each LV a dictionary with 'name',
+                                'size_bytes' and optionally 'type' (linear,
+                                striped, mirror, raid0, raid1, raid4, raid5,
+                                raid6, raid10 or thin), 'num_stripes',
+                                'stripe_size_kb', 'num_copies', 'thin_pool'
+                                (object path, for thin LVs) and 'options'
+                                (create options for this LV only).  The
+                                names have to be unique within the batch
+        :param tmo:             Timeout
+        :param create_options:  Create options for all the LVs
+        :return: For each LV its object path and an error message, '/' and
+                 the reason when it couldn't be created.  When a job is
+                 returned the results are not available from it.
+        """
+        r = RequestEntry(tmo, Vg._lv_create_batch,
+                         (self.state.Uuid, self.state.lvm_id, lv_specs,
+                          create_options), cb, cbe,
+                         no_result=dbus.Array([], signature='(os)'))
+        cfg.worker_q.put(r)
+
+    @dbus.service.method(dbus_interface=VG_INTERFACE,
+                         in_signature='stuuaoa{sv}',
+                         out_signature='(ba(ott))')
+    def AllocationPlan(self, layout, size_bytes, num_stripes, num_copies,
+                       pv_object_paths, plan_options):
+        """
+        Work out whether an LV would fit in the VG and where lvm would
+        probably put it, from what we know already.  lvm is only asked for
+        the layout of the VG when what we know is out of date.
+        :param layout:          linear, striped, mirror, raid0, raid1, raid4,
+                                raid5, raid6 or raid10
+        :param size_bytes:      Size of the LV
+        :param num_stripes:     Number of stripes, 0 for the default
+        :param num_copies:      Number of additional copies for mirror, raid1
+                                and raid10, 0 for the default
+        :param pv_object_paths: PVs to allocate from, all when empty
+        :param plan_options:    'alloc' to use an allocation policy other
+                                than the one of the VG
+        :return: Whether it fits and the extents, (PV, start, count), which
+                 would be used, none when it doesn't fit
+        """
+        vg_name = self.state.Name
+        extent_map = extentmap.latest(vg_name)
+        if not self.state.LvCount:
+            extent_map = extentmap.VgExtentMap(vg_name)
+        elif extent_map is None or extent_map.seqno != self.state.Seqno:
+            # What we have is not of the VG as it is now
+            extent_map = extentmap.build(inventory.lv_segments([vg_name]),
+                                         [vg_name]).get(vg_name)
+            if extent_map is None:
+                raise dbus.exceptions.DBusException(
+                    VG_INTERFACE, 'Layout of VG %s is not known' % vg_name)
+
+        for p in pv_object_paths:
+            if p not in self.state.Pvs:
+                raise dbus.exceptions.DBusException(
+                    VG_INTERFACE, 'PV object path = %s not in VG' % p)
+
+        pvs = []
+        paths = {}
+        for p in pv_object_paths or self.state.Pvs:
+            pv = cfg.om.get_by_path(p)
+            if pv and pv.Allocatable and not pv.Missing:
+                pvs.append((pv.lvm_id, pv.state.PeCount))
+                paths[pv.lvm_id] = p
+
+        policy = plan_options.get('alloc')
+        if not policy:
+            policy = dict(c='contiguous', l='cling',
+                          a='anywhere').get(self.state.attr[4], 'normal')
+
+        extent_size = self.state.ExtentSizeBytes
+        try:
+            fits, extents = allocation.plan(
+                extent_map, pvs,
+                allocation.layout_areas(
+                    layout, (size_bytes + extent_size - 1) / extent_size,
+                    num_stripes, num_copies),
+                policy)
+        except ValueError as e:
+            raise dbus.exceptions.DBusException(VG_INTERFACE, str(e))
+
+        return (dbus.Boolean(fits),
+                dbus.Array([(paths[n], dbus.UInt64(start),
+                             dbus.UInt64(count))
+                            for n, start, count in extents],
+                           signature='(ott)'))
+
     @staticmethod
     def _pv_add_rm_tags(uuid, vg_name, pv_object_paths, tags_add,
                         tags_del, tag_options):
@@ -597,9 +857,9 @@ class Vg(AutomatedProperties):
             rc, out, err = cmdhandler.pv_tag(pv_devices, tags_add, tags_del,
                                              tag_options)
             if rc == 0:
-                # For each PV that had a name change refresh it
-                for p in pv_object_paths:
-                    cfg.om.get_by_path(p).refresh()
+                # Refresh the PVs that had a tag change
+                refresh_objects([cfg.om.get_by_path(p)
+                                 for p in pv_object_paths])
 
                 return '/'
             else:
@@ -0,0 +1,108 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Tests for the allocation planner, these don't need lvm or dbus
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lvmdbus'))
+
+import extentmap
+import allocation
+
+
+def _seg(lv_name, ranges):
+    return dict(lv_uuid=lv_name + '-uuid', lv_name=lv_name,
+                lv_attr='-wi-a-----', vg_name='vg', vg_seqno=1,
+                lv_parent='', seg_pe_ranges=ranges, segtype='linear',
+                hidden=False)
+
+
+class TestAllocation(unittest.TestCase):
+
+    def setUp(self):
+        # sda: 0-9 used, 10-19 free, 20-29 used, 30-99 free
+        # sdb: 0-79 used, 80-99 free
+        # sdc: all free
+        self.m = extentmap.build([
+            _seg('a', '/dev/sda:0-9'),
+            _seg('b', '/dev/sda:20-29'),
+            _seg('c', '/dev/sdb:0-79')], ['vg'])['vg']
+        self.pvs = [('/dev/sda', 100), ('/dev/sdb', 100), ('/dev/sdc', 100)]
+
+    def test_layout_areas(self):
+        self.assertEqual(allocation.layout_areas('linear', 10), [(10, 0)])
+        self.assertEqual(allocation.layout_areas('striped', 10, 3),
+                         [(4, 0)] * 3)
+        self.assertEqual(allocation.layout_areas('mirror', 10),
+                         [(10, 0), (10, 0), (1, 0)])
+        self.assertEqual(allocation.layout_areas('raid1', 10, 0, 2),
+                         [(10, 1)] * 3)
+        self.assertEqual(allocation.layout_areas('raid5', 10),
+                         [(5, 1)] * 3)
+        self.assertEqual(allocation.layout_areas('raid6', 9),
+                         [(3, 1)] * 5)
+        self.assertEqual(allocation.layout_areas('raid10', 10),
+                         [(5, 1)] * 4)
+        self.assertRaises(ValueError, allocation.layout_areas, 'thin', 10)
+
+    def test_linear(self):
+        fits, extents = allocation.plan(
+            self.m, self.pvs, allocation.layout_areas('linear', 100))
+        self.assertTrue(fits)
+        self.assertEqual(extents, [('/dev/sda', 10, 10), ('/dev/sda', 30, 70),
+                                   ('/dev/sdb', 80, 20)])
+
+        fits, extents = allocation.plan(
+            self.m, self.pvs, allocation.layout_areas('linear', 281))
+        self.assertFalse(fits)
+        self.assertEqual(extents, [])
+
+    def test_contiguous(self):
+        fits, extents = allocation.plan(
+            self.m, self.pvs, allocation.layout_areas('linear', 70),
+            'contiguous')
+        self.assertEqual(extents, [('/dev/sda', 30, 70)])
+
+        fits, extents = allocation.plan(
+            self.m, self.pvs[0:2], allocation.layout_areas('linear', 71),
+            'contiguous')
+        self.assertFalse(fits)
+
+    def test_parallel(self):
+        # Each image on its own PV, the emptiest ones first
+        fits, extents = allocation.plan(
+            self.m, self.pvs, allocation.layout_areas('raid1', 19))
+        self.assertTrue(fits)
+        self.assertEqual(extents, [('/dev/sdc', 0, 20), ('/dev/sda', 10, 10),
+                                   ('/dev/sda', 30, 10)])
+
+        # Three images need three PVs unless the policy is anywhere
+        areas = allocation.layout_areas('raid1', 10, 0, 2)
+        self.assertFalse(allocation.plan(self.m, self.pvs[0:2], areas)[0])
+        fits, extents = allocation.plan(self.m, self.pvs[0:2], areas,
+                                        'anywhere')
+        self.assertTrue(fits)
+        self.assertEqual(set(e[0] for e in extents), set(['/dev/sda']))
+
+        self.assertRaises(ValueError, allocation.plan, self.m, self.pvs,
+                          areas, 'inherit')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Tests for the report cache and the progress report, these don't need
+# lvm or dbus
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lvmdbus'))
+
+import cfg
+import cmdhandler
+
+
+class TestReportCache(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = []
+        self.rc = 0
+        self.saved = (cmdhandler._t_call, cfg.REPORT_CACHE_MAX_AGE)
+
+        def _call(command, debug=False):
+            self.commands.append(list(command))
+            return self.rc, 'output %d' % len(self.commands), ''
+
+        cmdhandler._t_call = _call
+        cfg.REPORT_CACHE_MAX_AGE = 60
+        cmdhandler.invalidate_reports()
+
+    def tearDown(self):
+        cmdhandler._t_call, cfg.REPORT_CACHE_MAX_AGE = self.saved
+        cmdhandler.invalidate_reports()
+
+    def _stats(self):
+        s = cmdhandler.report_cache_stats()
+        return s['hits'], s['misses']
+
+    def test_hit(self):
+        hits, misses = self._stats()
+        out = cmdhandler.call(['pvs', '-o', 'pv_name'])
+        self.assertEqual(cmdhandler.call(['pvs', '-o', 'pv_name']), out)
+        self.assertEqual(len(self.commands), 1)
+
+        # Other columns or selection are other reports
+        cmdhandler.call(['pvs', '-o', 'pv_uuid'])
+        cmdhandler.call(['pvs', '-o', 'pv_name', '/dev/sda'])
+        self.assertEqual(len(self.commands), 3)
+        self.assertEqual(self._stats(), (hits + 1, misses + 3))
+        self.assertEqual(cmdhandler.report_cache_stats()['entries'], 3)
+
+    def test_invalidate(self):
+        cmdhandler.call(['lvs', '-o', 'lv_name'])
+
+        # Anything which isn't a report starts a new generation
+        generation = cmdhandler.report_cache_stats()['generation']
+        cmdhandler.call(['lvcreate', '--name', 'lv', 'vg'])
+        self.assertTrue(
+            cmdhandler.report_cache_stats()['generation'] > generation)
+
+        cmdhandler.call(['lvs', '-o', 'lv_name'])
+        self.assertEqual(len(self.commands), 3)
+
+        cmdhandler.invalidate_reports()
+        cmdhandler.call(['lvs', '-o', 'lv_name'])
+        self.assertEqual(len(self.commands), 4)
+
+    def test_not_cached(self):
+        cmdhandler.call(['lvs', '-o', 'copy_percent'], cache=False)
+        cmdhandler.call(['lvs', '-o', 'copy_percent'], cache=False)
+
+        # Failures are not remembered
+        self.rc = 5
+        cmdhandler.call(['vgs', '-o', 'vg_name'])
+        cmdhandler.call(['vgs', '-o', 'vg_name'])
+        self.assertEqual(len(self.commands), 4)
+
+        self.rc = 0
+        cfg.REPORT_CACHE_MAX_AGE = 0
+        cmdhandler.call(['vgs', '-o', 'vg_name'])
+        cmdhandler.call(['vgs', '-o', 'vg_name'])
+        self.assertEqual(len(self.commands), 6)
+
+
+class TestProgressStatus(unittest.TestCase):
+
+    # lv_name, vg_name, lv_parent, lv_attr, copy_percent, data_percent,
+    # devices
+    _REPORT = [
+        ['[pvmove0]', 'vg', '', 'p-C-aom---', '42.10', '',
+         '/dev/sdb(0),/dev/sdc(0)'],
+        ['lv1', 'vg', '', '-wI-ao----', '', '', 'pvmove0(0)'],
+        ['[raid_rimage_0]', 'vg', 'raid', 'iwi-aor---', '', '',
+         '/dev/sde(0)'],
+        ['raid', 'vg', '', 'rwi-a-r---', '75.00', '',
+         'raid_rimage_0(0),raid_rimage_1(0)'],
+        ['[raid_rimage_1]', 'vg', 'raid', 'Iwi-aor---', '', '',
+         '/dev/sdd(0)'],
+        ['pool', 'vg', '', 'twi-aotz--', '', '12.50', 'pool_tdata(0)'],
+    ]
+
+    def setUp(self):
+        self.commands = []
+        self.rc = 0
+        self.saved = cmdhandler._t_call
+
+        def _call(command, debug=False):
+            self.commands.append(list(command))
+            out = '\n'.join(cmdhandler.SEP.join(r) for r in self._REPORT)
+            return self.rc, out, ''
+
+        cmdhandler._t_call = _call
+
+    def tearDown(self):
+        cmdhandler._t_call = self.saved
+        cmdhandler.invalidate_reports()
+
+    def test_progress(self):
+        moves, lvs = cmdhandler.progress_status()
+
+        self.assertEqual(moves, {'vg/lv1': dict(
+            src_dev='/dev/sdb', dest_dev='/dev/sdc', percent=42)})
+        self.assertEqual(lvs, {'vg/raid': 75, 'vg/pool': 12})
+
+        # Progress is never taken from the cache
+        cmdhandler.progress_status()
+        self.assertEqual(len(self.commands), 2)
+
+    def test_failed(self):
+        self.rc = 5
+        self.assertEqual(cmdhandler.progress_status(), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Tests for the extent maps, these don't need lvm or dbus
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lvmdbus'))
+
+import extentmap
+
+
+def _seg(lv_name, ranges, segtype='linear', parent='', hidden=False,
+         vg_name='vg', vg_seqno=1):
+    # A row as lv_segments returns them
+    return dict(lv_uuid=lv_name + '-uuid', lv_name=lv_name,
+                lv_attr='-wi-a-----', vg_name=vg_name, vg_seqno=vg_seqno,
+                lv_parent=parent, seg_pe_ranges=ranges, segtype=segtype,
+                hidden=hidden)
+
+
+class TestExtentMap(unittest.TestCase):
+
+    def setUp(self):
+        self.maps = extentmap.build([
+            _seg('a', '/dev/sda:0-9'),
+            _seg('a', '/dev/sdb:50-59'),
+            _seg('b', '/dev/sda:20-29'),
+            _seg('m', 'm_rimage_0:0-9 m_rimage_1:0-9', 'raid1'),
+            _seg('m_rimage_0', '/dev/sda:30-39', parent='m', hidden=True),
+            _seg('m_rimage_1', '/dev/sdb:0-9', parent='m', hidden=True),
+            _seg('pvmove0', '/dev/sdb:90-99', 'mirror', hidden=True),
+            _seg('c', '/dev/sdc:0-4', vg_name='other')], ['vg', 'empty'])
+        self.m = self.maps['vg']
+
+    def test_build(self):
+        self.assertEqual(sorted(self.maps.keys()), ['empty', 'other', 'vg'])
+        self.assertTrue(extentmap.latest('vg') is self.m)
+        self.assertEqual(sorted(self.m.lv_names()), ['a', 'b', 'm'])
+        self.assertEqual(self.maps['empty'].segments('/dev/sdd', 10),
+                         [[0, 10]])
+
+        # VGs without LVs have no map to remember, nor does a VG which
+        # lost all of them
+        self.assertEqual(extentmap.latest('empty'), None)
+        extentmap.build([], ['vg'])
+        self.assertEqual(extentmap.latest('vg'), None)
+        self.assertTrue(extentmap.latest('other'))
+        extentmap.build([])
+        self.assertEqual(extentmap.latest('other'), None)
+
+    def test_forget(self):
+        extentmap.build([_seg('a', '/dev/sda:0-9', vg_seqno=7)], ['vg'])
+        self.assertEqual(extentmap.latest('vg').seqno, 7)
+        extentmap.forget('vg')
+        self.assertEqual(extentmap.latest('vg'), None)
+        self.assertTrue(extentmap.latest('other'))
+
+    def test_layout(self):
+        self.assertEqual(sorted(self.m.lvs_on_pv('/dev/sda')), [
+            ('a', [(0, 9)], '-wi-a-----', 'a-uuid'),
+            ('b', [(20, 29)], '-wi-a-----', 'b-uuid'),
+            ('m', [(30, 39)], '-wi-a-----', 'm-uuid')])
+        self.assertEqual(sorted(self.m.pvs_of_lv('m')),
+                         [('/dev/sda', [(30, 39, 'linear')]),
+                          ('/dev/sdb', [(0, 9, 'linear')])])
+        self.assertEqual(self.m.seg_types('m'), ['raid1'])
+        self.assertEqual(self.m.seg_types('m_rimage_0'), [])
+
+        # The extents pvmove uses aren't free, but nothing on the bus has them
+        self.assertEqual(sorted(l[0] for l in self.m.lvs_on_pv('/dev/sdb')),
+                         ['a', 'm'])
+        self.assertEqual(self.m.lookup('/dev/sdb', 95), (None, 'mirror'))
+
+    def test_lookup(self):
+        self.assertEqual(self.m.lookup('/dev/sda', 0), ('a', 'linear'))
+        self.assertEqual(self.m.lookup('/dev/sda', 9), ('a', 'linear'))
+        self.assertEqual(self.m.lookup('/dev/sda', 10), None)
+        self.assertEqual(self.m.lookup('/dev/sda', 35), ('m', 'linear'))
+        self.assertEqual(self.m.lookup('/dev/sda', 1000), None)
+        self.assertEqual(self.m.lookup('/dev/sdx', 0), None)
+
+    def test_free(self):
+        self.assertEqual(self.m.free_at('/dev/sda', 10, 100), 10)
+        self.assertEqual(self.m.free_at('/dev/sda', 15, 100), 5)
+        self.assertEqual(self.m.free_at('/dev/sda', 20, 100), 0)
+        self.assertEqual(self.m.free_at('/dev/sda', 40, 100), 60)
+        self.assertEqual(self.m.free_at('/dev/sda', 100, 100), 0)
+        self.assertEqual(self.m.free_at('/dev/sdd', 3, 100), 97)
+
+        self.assertEqual(self.m.free('/dev/sda', 100), [(10, 10), (40, 60)])
+        self.assertEqual(self.m.free('/dev/sdb', 100),
+                         [(10, 40), (60, 30)])
+
+    def test_segments(self):
+        self.assertEqual(self.m.segments('/dev/sda', 100),
+                         [[0, 10], [10, 10], [20, 10], [30, 10], [40, 60]])
+        self.assertEqual(self.m.segments('/dev/sdb', 100),
+                         [[0, 10], [10, 40], [50, 10], [60, 30], [90, 10]])
+        self.assertEqual(self.m.segments('/dev/sdd', 0), [[0, 0]])
+
+if __name__ == '__main__':
+    unittest.main()
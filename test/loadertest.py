@@ -0,0 +1,95 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Tests for refreshing objects in batches, these don't need lvm or dbus
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lvmdbus'))
+
+import loader
+
+
+class _State(object):
+
+    def __init__(self, uuid, lvm_id, value=0):
+        self.uuid = uuid
+        self.lvm_id = lvm_id
+        self.value = value
+
+    def identifiers(self):
+        return (self.uuid, self.lvm_id)
+
+
+class _Object(object):
+    # Enough of an AutomatedProperties object for loader
+
+    def __init__(self, state, search_method):
+        self.state = state
+        self._ap_search_method = search_method
+
+    @property
+    def lvm_id(self):
+        return self.state.lvm_id
+
+    def refresh(self, search_key=None, object_state=None):
+        assert object_state is not None
+        changed = object_state.value != self.state.value
+        self.state = object_state
+        return int(changed)
+
+
+class TestRefreshObjects(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.lvm = dict((n, _State(n + '-uuid', 'vg/' + n))
+                        for n in ('a', 'b', 'c'))
+
+        def _retrieve(keys):
+            self.calls.append(keys)
+            return [s for s in self.lvm.values()
+                    if s.lvm_id in keys or s.lvm_id.split('/')[0] in keys]
+
+        self.objects = [_Object(_State(s.uuid, s.lvm_id), _retrieve)
+                        for s in sorted(self.lvm.values(),
+                                        key=lambda s: s.uuid)]
+
+    def test_one_retrieve(self):
+        self.lvm['b'].value = 1
+        self.assertEqual(loader.refresh_objects(self.objects), 1)
+        self.assertEqual(self.calls, [['vg/a', 'vg/b', 'vg/c']])
+        self.assertEqual([o.state.value for o in self.objects], [0, 1, 0])
+
+        self.assertEqual(loader.refresh_objects([]), 0)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_renamed(self):
+        # Renamed objects are found by their uuid
+        for n, s in self.lvm.items():
+            self.lvm[n] = _State(s.uuid, 'new/' + n)
+        del self.lvm['c']
+
+        self.assertEqual(loader.refresh_objects(self.objects, ['new']), 0)
+        self.assertEqual(self.calls, [['new']])
+        self.assertEqual([o.lvm_id for o in self.objects],
+                         ['new/a', 'new/b', 'vg/c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -317,6 +317,53 @@ class TestDbusService(unittest.TestCase):
     def test_lv_create_thin_pool(self):
         self._create_lv(True)
 
+    def test_lv_create_batch(self):
+        thin_pool = self._create_lv(True)
+        vg = RemoteObject(self.bus, thin_pool.Vg, VG_INT)
+
+        specs = [dict(name=rs(8, '_lv'),
+                      size_bytes=dbus.UInt64(1024 * 1024 * 4))
+                 for _ in range(3)]
+        specs.append(dict(name=rs(8, '_thin_lv'), type='thin',
+                          size_bytes=dbus.UInt64(1024 * 1024 * 10),
+                          thin_pool=dbus.ObjectPath(thin_pool.object_path)))
+        specs.append(dict(name=thin_pool.Name,
+                          size_bytes=dbus.UInt64(1024 * 1024 * 4)))
+
+        results = vg.LvCreateBatch(specs, -1, {})[0]
+        self.assertEqual(len(results), len(specs))
+
+        for path, error in results[:-1]:
+            self.assertEqual(error, '')
+            RemoteObject(self.bus, path, LV_INT)
+
+        # The name is already taken
+        self.assertEqual(results[-1][0], '/')
+        self.assertTrue(len(results[-1][1]) > 0)
+
+        # Names used twice in a batch are refused before creating anything
+        twice = [dict(name=rs(8, '_lv'),
+                      size_bytes=dbus.UInt64(1024 * 1024 * 4))] * 2
+        self.assertRaises(dbus.exceptions.DBusException,
+                          vg.LvCreateBatch, twice, -1, {})
+
+        self.assertEqual(self._refresh(), 0)
+
+    def test_lv_create_batch_job(self):
+        vg = self._vg_create()
+
+        specs = [dict(name=rs(8, '_lv'),
+                      size_bytes=dbus.UInt64(1024 * 1024 * 4))
+                 for _ in range(3)]
+
+        # Getting a job right away, there are no results until it's done
+        results, job = vg.LvCreateBatch(specs, 0, {})
+        self.assertEqual(len(results), 0)
+        self.assertTrue(job and job != '/')
+        self._wait_for_job(job)
+
+        self.assertEqual(self._refresh(), 0)
+
     def test_lv_rename(self):
         # Rename a regular LV
         lv = self._create_lv()
@@ -511,6 +558,32 @@ class TestDbusService(unittest.TestCase):
         lv.update()
         self.assertTrue([] == lv.Tags)
 
+    def test_lv_bulk(self):
+        vg = self._vg_create()
+        mgr = self.objs[MANAGER_INT][0]
+        lvs = [self._test_lv_create(
+            vg.LvCreateLinear,
+            (rs(8, '_lv'), 1024 * 1024 * 4, False, -1, {}), vg)
+            for _ in range(4)]
+        paths = [lv.object_path for lv in lvs]
+
+        t = ['Testing', 'tags']
+
+        self.assertEqual(mgr.LvTagsAdd(paths, t, -1, {}), '/')
+        for lv in lvs:
+            lv.update()
+            self.assertTrue(t == lv.Tags)
+
+        self.assertEqual(mgr.LvTagsDel(paths, t, -1, {}), '/')
+        for lv in lvs:
+            lv.update()
+            self.assertTrue([] == lv.Tags)
+
+        self.assertEqual(mgr.LvRemove(paths, -1, {}), '/')
+        vg.update()
+        self.assertEqual(len(vg.Lvs), 0)
+        self.assertEqual(self._refresh(), 0)
+
     def test_vg_allocation_policy_set(self):
         vg = self._vg_create()
 
@@ -0,0 +1,456 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Tests for the lvmetad client and the inventory built from it, these don't
+# need lvm or dbus, lvmetad is played by FakeLvmetad
+
+import os
+import sys
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+_TOP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(_TOP, 'lvmdbus'))
+sys.path.insert(0, os.path.join(_TOP, 'tools'))
+
+import cfg
+import cmdhandler
+import inventory
+from meta import Lvmetad, LvmetadError
+from inventory import LvmetadInventory
+import extentmap
+import meta_corpus
+
+
+class FakeLvmetad(object):
+    """
+    Serves canned responses over a UNIX socket, like lvmetad does.  Responses
+    are looked up by the request name, anything unknown gets an error back.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+        self.connections = []
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'lvmetad.socket')
+        self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.s.bind(self.path)
+        self.s.listen(5)
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.s.close()
+        self.drop()
+        shutil.rmtree(self.dir, True)
+
+    def drop(self):
+        # Break every connection, like lvmetad restarting
+        for c in self.connections:
+            try:
+                c.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _serve(self):
+        while True:
+            try:
+                conn = self.s.accept()[0]
+            except socket.error:
+                return
+            self.connections.append(conn)
+            t = threading.Thread(target=self._client, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _client(self, conn):
+        data = ''
+        while True:
+            try:
+                chunk = conn.recv(4096)
+            except socket.error:
+                break
+            if not chunk:
+                break
+            data += chunk
+            while Lvmetad.END in data:
+                req, data = data.split(Lvmetad.END, 1)
+                request = Lvmetad.parse(req)
+                self.requests.append(request)
+                rc = self.responses.get(
+                    request.get('request'),
+                    'response = "failed"\nreason = "unknown request"\n')
+                if callable(rc):
+                    rc = rc(request)
+                if not rc.endswith(Lvmetad.END):
+                    rc += Lvmetad.END
+                try:
+                    conn.sendall(rc)
+                except socket.error:
+                    break
+        conn.close()
+
+
+def _config(d):
+    # Lines of the lvm configuration format for nested dictionaries
+    def _value(v):
+        if isinstance(v, basestring):
+            return meta_corpus._q(v)
+        return str(v)
+
+    out = []
+    for k, v in sorted(d.items()):
+        if isinstance(v, dict):
+            out.append('%s {' % k)
+            out.extend(_config(v))
+            out.append('}')
+        elif isinstance(v, list):
+            out.append('%s = [%s]' % (k, ', '.join(_value(i) for i in v)))
+        else:
+            out.append('%s = %s' % (k, _value(v)))
+    return out
+
+
+def lookup_responses(dump):
+    """
+    vg_lookup and pv_list responses for FakeLvmetad, from a dump
+    """
+    parsed = Lvmetad.parse(dump)
+
+    def vg_lookup(request):
+        vg_id = parsed['vgname_to_vgid'].get(request['name'])
+        if vg_id is None:
+            return 'response = "unknown"\n'
+        return '\n'.join(_config(dict(
+            response='OK', name=request['name'],
+            metadata=parsed['vgid_to_metadata'][vg_id])))
+
+    def pv_list(request):
+        pvs = {}
+        for pv_id, meta in parsed['pvid_to_pvmeta'].items():
+            pvs[pv_id] = dict(meta)
+            if pv_id in parsed['pvid_to_vgid']:
+                pvs[pv_id]['vgid'] = parsed['pvid_to_vgid'][pv_id]
+        return '\n'.join(_config(dict(response='OK',
+                                        physical_volumes=pvs)))
+
+    return dict(dump=dump, vg_lookup=vg_lookup, pv_list=pv_list)
+
+
+class TestParse(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(Lvmetad.parse(''), {})
+        self.assertEqual(Lvmetad.parse(None), {})
+        self.assertEqual(Lvmetad.parse('# Just a comment\n'), {})
+
+    def test_values(self):
+        rc = Lvmetad.parse('s = "string"\nn = 42\nf = 1.5\nneg = -3\n'
+                           'a = ["one", 2, -3]\nempty = []\n')
+        self.assertEqual(rc, dict(s='string', n=42, f=1.5, neg=-3,
+                                  a=['one', 2, -3], empty=[]))
+        self.assertTrue(isinstance(rc['n'], long))
+
+    def test_sections(self):
+        rc = Lvmetad.parse('vg0 {\n  id = "x"\n  pvs {\n    pv0 {\n'
+                           '      dev = 2048\n    }\n  }\n}\n'
+                           '2048 = "device number"\n')
+        self.assertEqual(rc, {'vg0': {'id': 'x',
+                                      'pvs': {'pv0': {'dev': 2048}}},
+                              '2048': 'device number'})
+
+    def test_escapes(self):
+        rc = Lvmetad.parse(r's = "a \"quoted\" \\ string"' + '\n' +
+                           r'a = ["\"", "\\"]')
+        self.assertEqual(rc['s'], r'a "quoted" \ string')
+        self.assertEqual(rc['a'], ['"', '\\'])
+
+    def test_comments(self):
+        rc = Lvmetad.parse('# Comment\na = 1 # trailing\n'
+                           'b = "# not a comment"\n'
+                           'c = [\n"x", # in array\n"y"\n]\n##\n')
+        self.assertEqual(rc, dict(a=1, b='# not a comment', c=['x', 'y']))
+
+    def test_malformed(self):
+        for bad in ['a = ', 'a = "unterminated', 'a = word', '}',
+                    'a = [1, 2', 'a ! 1', 'x { a = 1 } }']:
+            self.assertRaises(LvmetadError, Lvmetad.parse, bad)
+
+    def test_corpus(self):
+        rc = Lvmetad.parse(meta_corpus.dump(100, 3, orphans=1,
+                                            tags=['a"b', 'c\\d']))
+        self.assertEqual(rc['response'], 'OK')
+        self.assertEqual(len(rc['vgid_to_metadata']), 3)
+        self.assertEqual(len(rc['pvid_to_pvmeta']), 13)
+
+        lvs = 0
+        for vg in rc['vgid_to_metadata'].values():
+            lvs += len(vg['logical_volumes'])
+            for lv in vg['logical_volumes'].values():
+                self.assertEqual(lv['tags'], ['a"b', 'c\\d'])
+        self.assertEqual(lvs, 100)
+
+
+class TestClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeLvmetad(dict(
+            echo=lambda r: 'response = "OK"\nvalue = "%s"\n' % r['value'],
+            dump=meta_corpus.dump(10, 1)))
+        self.client = Lvmetad(self.server.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_pipeline(self):
+        rc = self.client.pipeline([('echo', dict(value=str(i)))
+                                   for i in range(50)] + [('dump', None)])
+        self.assertEqual([Lvmetad.parse(r).get('value') for r in rc[:-1]],
+                         [str(i) for i in range(50)])
+        self.assertEqual(len(Lvmetad.parse(rc[-1])['vgid_to_metadata']), 1)
+
+        self.assertEqual(Lvmetad.parse(self.client._request(
+            'echo', dict(value='again')))['value'], 'again')
+        self.assertEqual(len(self.server.connections), 1)
+
+        stats = self.client.stats()
+        self.assertEqual((stats['connected'], stats['connects'],
+                          stats['requests'], stats['round_trips'],
+                          stats['failures']), (True, 1, 52, 2, 0))
+        self.assertEqual(sum(stats['latency']['echo']), 51)
+        self.assertEqual(sum(stats['latency']['dump']), 1)
+
+    def test_reconnect(self):
+        self.client.pv_list()
+        self.server.drop()
+
+        rc = self.client._request('echo', dict(value='x'))
+        self.assertEqual(Lvmetad.parse(rc)['value'], 'x')
+
+        stats = self.client.stats()
+        self.assertEqual((stats['connects'], stats['failures']), (2, 1))
+        self.assertTrue(stats['last_error'])
+
+    def test_unavailable(self):
+        self.server.close()
+        self.assertRaises(socket.error, self.client.all)
+        self.assertFalse(self.client.stats()['connected'])
+
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.dump = meta_corpus.dump(20, 2, pvs_per_vg=2, orphans=1,
+                                     tags=['t1', 't2'])
+        responses = lookup_responses(self.dump)
+        responses['dump'] = lambda r: self.dump
+        self.server = FakeLvmetad(responses)
+        self.inv = LvmetadInventory(
+            self.server.path,
+            device_name=lambda dev: {2052: '/dev/orphan'}.get(dev),
+            active=lambda vg, lv: lv == 'lv00000')
+
+    def tearDown(self):
+        self.inv.lvmetad.close()
+        self.server.close()
+
+    def test_pvs(self):
+        pvs = dict((p['pv_name'], p) for p in self.inv.pv_retrieve())
+        self.assertEqual(sorted(pvs.keys()),
+                         ['/dev/orphan', '/dev/sda', '/dev/sdb', '/dev/sdc',
+                          '/dev/sdd'])
+
+        extent = meta_corpus.EXTENT_SIZE * 512
+        sda = pvs['/dev/sda']
+        self.assertEqual(sda['vg_name'], 'vg00')
+        self.assertEqual(sda['pv_pe_count'], meta_corpus.PV_EXTENTS)
+        self.assertEqual(sda['pv_pe_alloc_count'], 5 * meta_corpus.LV_EXTENTS)
+        self.assertEqual(sda['pv_size'], meta_corpus.PV_EXTENTS * extent)
+        self.assertEqual(sda['pv_used'], 20 * extent)
+        self.assertEqual(sda['pv_attr'], 'a--')
+
+        orphan = pvs['/dev/orphan']
+        self.assertEqual((orphan['vg_name'], orphan['pv_attr']), ('', '---'))
+        self.assertEqual(orphan['pe_start'], 1048576)
+
+        self.assertEqual([p['pv_name'] for p in
+                          self.inv.pv_retrieve(['/dev/sdc'])], ['/dev/sdc'])
+
+        m = extentmap.build(self.inv.lv_segments(['vg00']), ['vg00'])['vg00']
+        self.assertEqual(m.segments('/dev/sda', meta_corpus.PV_EXTENTS), [
+            [0, 4], [4, 4], [8, 4], [12, 4], [16, 4],
+            [20, meta_corpus.PV_EXTENTS - 20]])
+
+    def test_vgs(self):
+        vgs = self.inv.vg_retrieve(None)
+        self.assertEqual(sorted(v['vg_name'] for v in vgs), ['vg00', 'vg01'])
+        vg = self.inv.vg_retrieve(['vg01'])[0]
+        self.assertEqual((vg['pv_count'], vg['lv_count'], vg['vg_seqno']),
+                         (2, 10, 1))
+        self.assertEqual(vg['vg_free_count'],
+                         2 * meta_corpus.PV_EXTENTS - 10 * 4)
+        self.assertEqual(vg['vg_attr'], 'wz--n-')
+
+        self.assertEqual(sorted(self.inv.pvs_in_vg(['vg01'])['vg01']),
+                         sorted((p['pv_name'], p['pv_uuid']) for p in
+                                self.inv.pv_retrieve(['/dev/sdc',
+                                                      '/dev/sdd'])))
+        self.assertEqual(len(self.inv.lvs_in_vg()['vg00']), 10)
+
+        seqnos = self.inv.pv_vg_seqnos()
+        self.assertEqual(len(seqnos), 5)
+        self.assertEqual(sorted(r['vg_seqno'] for r in seqnos),
+                         [0, 1, 1, 1, 1])
+
+    def test_lvs(self):
+        self.assertEqual(len(self.inv.lv_retrieve(None)), 20)
+        self.assertEqual(len(self.inv.lv_retrieve(['vg01'])), 10)
+
+        lvs = sorted(self.inv.lv_retrieve(['vg00/lv00000', 'vg01/lv00003']),
+                     key=lambda l: l['vg_name'])
+        self.assertEqual([(l['vg_name'], l['lv_name']) for l in lvs],
+                         [('vg00', 'lv00000'), ('vg01', 'lv00003')])
+        self.assertEqual(lvs[0]['lv_attr'], '-wi-a-----')
+        self.assertEqual(lvs[1]['lv_attr'], '-wi-------')
+        self.assertEqual(lvs[0]['lv_tags'], 't1,t2')
+        self.assertEqual(lvs[0]['lv_path'], '/dev/vg00/lv00000')
+        self.assertEqual(lvs[0]['lv_size'],
+                         meta_corpus.LV_EXTENTS * meta_corpus.EXTENT_SIZE *
+                         512)
+
+        segs = self.inv.lv_segments(['vg00'])
+        self.assertEqual(len(segs), 10)
+        seg = [s for s in segs if s['lv_name'] == 'lv00003'][0]
+        self.assertEqual((seg['segtype'], seg['seg_pe_ranges'],
+                          seg['hidden'], seg['lv_parent']),
+                         ('linear', '/dev/sdb:4-7', False, ''))
+
+    def test_sub_lvs(self):
+        md = '\n'.join([
+            'response = "OK"', 'vgid_to_metadata {', 'vg-id {',
+            'id = "vg-id"', 'seqno = 3', 'status = ["READ", "WRITE"]',
+            'extent_size = 8192',
+            'physical_volumes {',
+            'pv0 { id = "pv0-id" device = "/dev/a" status = ["ALLOCATABLE"]'
+            ' pe_start = 2048 pe_count = 100 }',
+            'pv1 { id = "pv1-id" device = "/dev/b" status = ["ALLOCATABLE"]'
+            ' pe_start = 2048 pe_count = 100 }', '}',
+            'logical_volumes {',
+            'r { id = "r-id" status = ["READ", "WRITE", "VISIBLE"]',
+            'segment1 { start_extent = 0 extent_count = 10 type = "raid1"',
+            'raids = ["r_rmeta_0", "r_rimage_0", "r_rmeta_1", "r_rimage_1"]'
+            ' } }']
+            + ['%s { id = "%s-id" status = ["READ", "WRITE"] segment1 {'
+               ' start_extent = 0 extent_count = %d type = "striped"'
+               ' stripe_count = 1 stripes = ["pv%d", %d] } }' %
+               (n, n, c, pv, start)
+               for n, c, pv, start in [('r_rmeta_0', 1, 0, 0),
+                                       ('r_rimage_0', 10, 0, 1),
+                                       ('r_rmeta_1', 1, 1, 0),
+                                       ('r_rimage_1', 10, 1, 1)]]
+            + ['}', '}', '}', 'vgid_to_vgname { vg-id = "vg" }'])
+        self.dump = md
+
+        lvs = self.inv.lv_retrieve(None)
+        self.assertEqual([(l['lv_name'], l['lv_attr']) for l in lvs],
+                         [('r', 'rwi---r---')])
+
+        segs = dict((s['lv_name'], s) for s in self.inv.lv_segments())
+        self.assertEqual(segs['r_rimage_1']['lv_parent'], 'r')
+        self.assertEqual(segs['r_rimage_1']['lv_attr'][0], 'i')
+        self.assertEqual(segs['r_rmeta_0']['lv_attr'][0], 'e')
+        self.assertTrue(segs['r_rmeta_0']['hidden'])
+
+        m = extentmap.build(self.inv.lv_segments())['vg']
+        self.assertEqual(m.segments('/dev/b', 100),
+                         [[0, 1], [1, 10], [11, 89]])
+        self.assertEqual(sorted((pv, sorted(r)) for pv, r in
+                                m.pvs_of_lv('r')),
+                         [('/dev/a', [(0, 0, 'linear'), (1, 10, 'linear')]),
+                          ('/dev/b', [(0, 0, 'linear'), (1, 10, 'linear')])])
+        self.assertEqual(m.seg_types('r'), ['raid1'])
+        self.assertEqual(self.inv.vg_retrieve(None)[0]['vg_free_count'],
+                         200 - 22)
+
+    def test_snapshot(self):
+        with self.inv.snapshot():
+            self.inv.pv_retrieve()
+            self.inv.vg_retrieve(None)
+            self.inv.lv_retrieve(['vg00/lv00001'])
+        self.assertEqual(len(self.server.requests), 1)
+
+        self.inv.pv_retrieve()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.inv.lvmetad.stats()['connects'], 1)
+
+    def test_vg_lookup(self):
+        everything = self.inv.lv_retrieve(['vg01'])
+
+        # A VG selection only asks for those VGs and the PVs, in one go,
+        # 'missing' isn't covered by what we have so it's another round trip
+        del self.server.requests[:]
+        with self.inv.snapshot():
+            lvs = self.inv.lv_retrieve(['vg01'])
+            segs = self.inv.lv_segments(['vg01'])
+            vgs = self.inv.vg_retrieve(['vg01', 'missing'])
+            pvs = self.inv.pvs_in_vg(['vg01'])
+
+        self.assertEqual(sorted(r['request'] for r in self.server.requests),
+                         ['pv_list', 'pv_list', 'vg_lookup', 'vg_lookup',
+                          'vg_lookup'])
+        self.assertEqual(self.inv.lvmetad.stats()['round_trips'], 3)
+
+        key = lambda l: l['lv_name']
+        self.assertEqual(sorted(lvs, key=key), sorted(everything, key=key))
+        self.assertEqual(len(segs), 10)
+        self.assertEqual([v['vg_name'] for v in vgs], ['vg01'])
+        self.assertEqual(sorted(p[0] for p in pvs['vg01']),
+                         ['/dev/sdc', '/dev/sdd'])
+
+    def test_unavailable(self):
+        self.dump = 'response = "OK"\nglobal_invalid = 1\n'
+        self.assertRaises(LvmetadError, self.inv.pv_retrieve)
+
+        self.dump = 'response = "failed"\nreason = "not ready"\n'
+        self.assertRaises(LvmetadError, self.inv.pv_retrieve)
+
+        self.assertRaises(socket.error, LvmetadInventory(
+            os.path.join(self.server.dir, 'missing')).pv_retrieve)
+
+    def test_fallback(self):
+        saved = (cfg.INVENTORY, inventory._lvmetad, cmdhandler.pv_retrieve)
+        cfg.INVENTORY = 'lvmetad'
+        inventory._lvmetad = self.inv
+        cmdhandler.pv_retrieve = lambda device=None: ['from lvm']
+        try:
+            # lvm answers when lvmetad can't
+            self.dump = 'response = "failed"\nreason = "not ready"\n'
+            self.assertEqual(inventory.pv_retrieve(), ['from lvm'])
+
+            # Our own bugs are not hidden
+            self.inv.pv_retrieve = lambda device=None: {}['missing']
+            self.assertRaises(KeyError, inventory.pv_retrieve)
+        finally:
+            (cfg.INVENTORY, inventory._lvmetad,
+             cmdhandler.pv_retrieve) = saved
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Generates synthetic lvmetad 'dump' responses, in the same format and with
+# the same sections lvmetad uses, for benchmarking and testing.  The output
+# only depends on the arguments so the same corpus can be recreated anywhere.
+#
+#   $ ./tools/meta_corpus.py --lvs 10000 --vgs 10 > /tmp/dump-10k
+
+import sys
+import random
+import optparse
+
+_UUID_CH = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+
+EXTENT_SIZE = 8192          # Sectors, ie. 4 MiB
+PV_EXTENTS = 25599          # ~100 GiB
+LV_EXTENTS = 4
+
+
+def _id(rand):
+    # lvm formatted uuid, eg. 3ZDqJk-9fEd-kU6c-1x2B-cVhu-HGn0-p2lk5Z
+    c = ''.join(rand.choice(_UUID_CH) for _ in range(32))
+    return '-'.join([c[0:6], c[6:10], c[10:14], c[14:18], c[18:22],
+                     c[22:26], c[26:32]])
+
+
+def _list(items):
+    return '[' + ', '.join(items) + ']'
+
+
+def _q(s):
+    return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def vg_metadata(rand, vg_id, pvs, num_lvs, seqno=1, tags=None):
+    """
+    Metadata of a VG with linear LVs spread over its PVs
+    :param rand:        random.Random to generate the ids with
+    :param vg_id:       uuid of the VG
+    :param pvs:         List of (pv id, device, device number)
+    :param num_lvs:     Number of LVs to create
+    :param seqno:       Sequence number of the metadata
+    :param tags:        Tags to put on every LV
+    :return: List of lines
+    """
+    out = ['id = "%s"' % vg_id,
+           'seqno = %d' % seqno,
+           'format = "lvm2"',
+           'status = ["RESIZEABLE", "READ", "WRITE"]',
+           'flags = []',
+           'extent_size = %d' % EXTENT_SIZE,
+           'max_lv = 0',
+           'max_pv = 0',
+           'metadata_copies = 0',
+           'physical_volumes {']
+
+    for i, (pv_id, device, dev_no) in enumerate(pvs):
+        out.extend(['pv%d {' % i,
+                    'id = "%s"' % pv_id,
+                    'device = "%s"' % device,
+                    'status = ["ALLOCATABLE"]',
+                    'flags = []',
+                    'dev_size = %d' % ((PV_EXTENTS + 1) * EXTENT_SIZE),
+                    'pe_start = 2048',
+                    'pe_count = %d' % PV_EXTENTS,
+                    '}'])
+    out.append('}')
+
+    if num_lvs:
+        out.append('logical_volumes {')
+        for i in range(num_lvs):
+            pv = i % len(pvs)
+            start = (i / len(pvs)) * LV_EXTENTS
+            out.extend(['lv%05d {' % i,
+                        'id = "%s"' % _id(rand),
+                        'status = ["READ", "WRITE", "VISIBLE"]',
+                        'flags = []',
+                        'tags = %s' % _list([_q(t) for t in tags or []]),
+                        'creation_time = %d' % (1447779446 + i),
+                        'creation_host = "host.example.com"',
+                        'segment_count = 1',
+                        'segment1 {',
+                        'start_extent = 0',
+                        'extent_count = %d' % LV_EXTENTS,
+                        'type = "striped"',
+                        'stripe_count = 1',
+                        'stripes = [',
+                        '"pv%d", %d' % (pv, start),
+                        ']',
+                        '}',
+                        '}'])
+        out.append('}')
+    return out
+
+
+def dump(num_lvs=10000, num_vgs=10, pvs_per_vg=4, orphans=2, seed=0,
+         tags=None):
+    """
+    Generate an lvmetad dump response
+    :param num_lvs:     Total number of LVs, spread evenly over the VGs
+    :param num_vgs:     Number of VGs
+    :param pvs_per_vg:  Number of PVs in each VG
+    :param orphans:     Number of PVs which are not in a VG
+    :param seed:        Seed for the ids
+    :param tags:        Tags to put on every LV
+    :return: The response as a string
+    """
+    rand = random.Random(seed)
+    vgs = []
+    orphan_pvs = []
+    dev = 0
+
+    for v in range(num_vgs):
+        pvs = []
+        for p in range(pvs_per_vg):
+            pvs.append((_id(rand), '/dev/sd%s' % _dev_name(dev), 2048 + dev))
+            dev += 1
+        lvs = num_lvs / num_vgs + (1 if v < num_lvs % num_vgs else 0)
+        vgs.append(('vg%02d' % v, _id(rand), pvs, lvs))
+
+    for p in range(orphans):
+        orphan_pvs.append((_id(rand), '/dev/sd%s' % _dev_name(dev),
+                           2048 + dev))
+        dev += 1
+
+    out = ['response = "OK"', 'global_invalid = 0', 'vgid_to_metadata {']
+    for name, vg_id, pvs, lvs in vgs:
+        out.append('%s {' % vg_id)
+        out.extend(vg_metadata(rand, vg_id, pvs, lvs, tags=tags))
+        out.append('}')
+    out.append('}')
+
+    out.append('vgid_to_vgname {')
+    out.extend('%s = "%s"' % (vg_id, name) for name, vg_id, _, _ in vgs)
+    out.append('}')
+
+    out.append('vgname_to_vgid {')
+    out.extend('%s = "%s"' % (name, vg_id) for name, vg_id, _, _ in vgs)
+    out.append('}')
+
+    out.append('pvid_to_pvmeta {')
+    for vg_id, pvs in [(vg[1], vg[2]) for vg in vgs] + \
+            [(None, orphan_pvs)]:
+        for pv_id, device, dev_no in pvs:
+            out.extend(['%s {' % pv_id,
+                        'dev = %d' % dev_no,
+                        'format = "lvm2"',
+                        'label_sector = 1',
+                        'id = "%s"' % pv_id,
+                        'size = %d' % ((PV_EXTENTS + 1) * EXTENT_SIZE * 512),
+                        'mda0 {',
+                        'ignore = 0',
+                        'start = 4096',
+                        'size = 1044480',
+                        'free_sectors = 0',
+                        '}',
+                        'da0 {',
+                        'offset = 1048576',
+                        'size = 0',
+                        '}',
+                        '}'])
+    out.append('}')
+
+    out.append('pvid_to_vgid {')
+    for name, vg_id, pvs, lvs in vgs:
+        out.extend('%s = "%s"' % (pv_id, vg_id) for pv_id, _, _ in pvs)
+    out.append('}')
+
+    out.append('device_to_pvid {')
+    for pvs in [vg[2] for vg in vgs] + [orphan_pvs]:
+        out.extend('%d = "%s"' % (dev_no, pv_id)
+                   for pv_id, _, dev_no in pvs)
+    out.append('}')
+
+    return '\n'.join(out) + '\n##\n'
+
+
+def _dev_name(n):
+    # 0 -> a, 25 -> z, 26 -> aa, like the kernel names disks
+    name = ''
+    n += 1
+    while n:
+        n, r = divmod(n - 1, 26)
+        name = chr(ord('a') + r) + name
+    return name
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--lvs', type='int', default=10000)
+    parser.add_option('--vgs', type='int', default=10)
+    parser.add_option('--pvs-per-vg', type='int', default=4)
+    parser.add_option('--orphans', type='int', default=2)
+    parser.add_option('--seed', type='int', default=0)
+    options = parser.parse_args()[0]
+
+    sys.stdout.write(dump(options.lvs, options.vgs, options.pvs_per_vg,
+                          options.orphans, options.seed))
+
+if __name__ == '__main__':
+    main()
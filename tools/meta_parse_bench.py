@@ -0,0 +1,65 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Times parsing synthetic lvmetad dumps, see meta_corpus.py, or a dump saved
+# from a real system (eg. with LVM_DBUS_LVMETAD_DUMP set).
+#
+# Run it on two different trees to compare them, eg.
+#   $ ./tools/meta_parse_bench.py --lvs 10000
+#   $ ./tools/meta_parse_bench.py --lvs 10000 --tree /path/to/other/lvmdbus
+
+import os
+import sys
+import time
+import optparse
+
+import meta_corpus
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--lvs', type='int', default=10000,
+                      help='Number of LVs in the synthetic dump')
+    parser.add_option('--vgs', type='int', default=10,
+                      help='Number of VGs in the synthetic dump')
+    parser.add_option('--file', default=None,
+                      help='Parse this dump instead of a synthetic one')
+    parser.add_option('--runs', type='int', default=5)
+    parser.add_option('--tree', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'lvmdbus'),
+        help='Directory holding meta.py to benchmark')
+    options = parser.parse_args()[0]
+
+    sys.path.insert(0, options.tree)
+    from meta import Lvmetad
+
+    if options.file:
+        with open(options.file) as f:
+            data = f.read()
+    else:
+        data = meta_corpus.dump(options.lvs, options.vgs)
+
+    times = []
+    for i in range(options.runs):
+        start = time.time()
+        Lvmetad.parse(data)
+        times.append(time.time() - start)
+
+    print('size= %d KiB, runs= %d, best= %.3f s, MiB/s= %.1f' %
+          (len(data) / 1024, options.runs, min(times),
+           len(data) / min(times) / 1024 / 1024))
+
+if __name__ == '__main__':
+    main()
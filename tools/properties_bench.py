@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Microbenchmark of GetManagedObjects, which retrieves every property of
+# every object.  The objects are synthetic PVs which are not exported on the
+# bus, so this doesn't need lvm or a running dbus daemon, only dbus-python.
+#
+# Run it on two different trees to compare them, eg.
+#   $ ./tools/properties_bench.py --objects 5000
+#   $ ./tools/properties_bench.py --objects 5000 --tree /path/to/other/lvmdbus
+
+import os
+import sys
+import time
+import optparse
+
+
+def create_objects(num_objects):
+    import cfg
+    from objectmanager import ObjectManager
+    from pv import Pv, PvState
+
+    cfg.om = ObjectManager(cfg.BASE_OBJ_PATH, cfg.BASE_INTERFACE)
+
+    for i in range(num_objects):
+        name = '/dev/synth%05d' % i
+        state = PvState(name, 'uuid-%05d' % i, name, 'lvm2',
+                        1073741824, 536870912, 536870912, 1073741824,
+                        1044480, 520192, 0, 0, 1048576, 255, 128,
+                        'a--', '', '', '', [[0, 128], [128, 127]], [])
+        cfg.om.register_object(Pv('%s/%d' % (cfg.PV_OBJ_PATH, i), state))
+    return cfg.om
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--objects', type='int', default=5000,
+                      help='Number of objects to create')
+    parser.add_option('--calls', type='int', default=10,
+                      help='Number of GetManagedObjects calls to make')
+    parser.add_option('--tree', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'lvmdbus'),
+        help='Directory holding the lvmdbus sources to benchmark')
+    options = parser.parse_args()[0]
+
+    sys.path.insert(0, options.tree)
+    om = create_objects(options.objects)
+
+    start = time.time()
+    for i in range(options.calls):
+        rc = om.GetManagedObjects()
+    elapsed = time.time() - start
+
+    num_props = sum(len(props) for interfaces in rc.values()
+                    for props in interfaces.values())
+
+    print('objects= %d, calls= %d, time/call= %.2f ms, '
+          'properties/s= %.0f' %
+          (len(rc), options.calls, elapsed * 1000 / options.calls,
+           num_props * options.calls / elapsed))
+
+if __name__ == '__main__':
+    main()
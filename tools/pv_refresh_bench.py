@@ -0,0 +1,168 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark of refreshing all the PVs of a VG, one PV at a time as it used
+# to be done and with Vg.refresh_pvs.  lvm is replaced by a synthetic one
+# which answers the report commands from a generated VG and takes a fixed
+# time per command, like forking lvm does.  Nothing is exported on the bus,
+# so this doesn't need lvm or a running dbus daemon, only dbus-python.
+#
+#   $ ./tools/pv_refresh_bench.py --pvs 64 --lvs 512 --cmd-ms 30
+
+import os
+import sys
+import time
+import optparse
+
+VG_NAME = 'bench'
+PV_EXTENTS = 25599
+EXTENT_SIZE = 4194304
+
+
+class SyntheticLvm(object):
+    """
+    Answers pvs and lvs report commands for a VG with linear LVs spread over
+    its PVs, counting the commands
+    """
+
+    def __init__(self, num_pvs, num_lvs, cmd_seconds):
+        self.cmd_seconds = cmd_seconds
+        self.commands = 0
+        self.pvs = []
+        self.segments = []
+        used = {}
+
+        for i in range(num_lvs):
+            device = '/dev/bench%03d' % (i % num_pvs)
+            start = used.get(device, 0)
+            used[device] = start + 4
+            self.segments.append(dict(
+                lv_uuid='lv-uuid-%05d' % i, lv_name='lv%05d' % i,
+                lv_attr='-wi-a-----', vg_name=VG_NAME, vg_seqno=1,
+                lv_parent='',
+                seg_pe_ranges='%s:%d-%d' % (device, start, start + 3),
+                segtype='linear'))
+
+        for i in range(num_pvs):
+            device = '/dev/bench%03d' % i
+            alloc = used.get(device, 0)
+            self.pvs.append(dict(
+                pv_name=device, pv_uuid='pv-uuid-%03d' % i, pv_fmt='lvm2',
+                pv_size=PV_EXTENTS * EXTENT_SIZE,
+                pv_free=(PV_EXTENTS - alloc) * EXTENT_SIZE,
+                pv_used=alloc * EXTENT_SIZE,
+                dev_size=(PV_EXTENTS + 1) * EXTENT_SIZE,
+                pv_mda_size=1044480, pv_mda_free=520192, pv_ba_start=0,
+                pv_ba_size=0, pe_start=1048576, pv_pe_count=PV_EXTENTS,
+                pv_pe_alloc_count=alloc, pv_attr='a--', pv_tags='',
+                vg_name=VG_NAME, vg_uuid='vg-uuid'))
+
+    def call_lvm(self, command, debug=False):
+        import cmdhandler
+
+        self.commands += 1
+        time.sleep(self.cmd_seconds)
+
+        columns = command[command.index('-o') + 1].split(',')
+        names = set(a for a in command[command.index('-o') + 2:]
+                    if not a.startswith('-'))
+
+        if command[0] == 'pvs':
+            rows = [r for r in self.pvs
+                    if not names or r['pv_name'] in names]
+        else:
+            rows = [r for r in self.segments
+                    if not names or r['vg_name'] in names]
+
+        out = '\n'.join(cmdhandler.SEP.join(str(r[c]) for c in columns)
+                        for r in rows)
+        return 0, out + '\n', ''
+
+    def change(self, tag):
+        # Something for the refresh to find, like a change made outside
+        import cmdhandler
+
+        for r in self.pvs:
+            r['pv_tags'] = tag
+
+        # Trees from before the report cache don't have it
+        if hasattr(cmdhandler, 'invalidate_reports'):
+            cmdhandler.invalidate_reports()
+
+
+def setup(num_pvs, num_lvs, cmd_seconds):
+    import cfg
+    import cmdhandler
+    from objectmanager import ObjectManager
+    from pv import load_pvs
+    from vg import Vg, VgState
+
+    cfg.om = ObjectManager(cfg.BASE_OBJ_PATH, cfg.BASE_INTERFACE)
+    lvm = SyntheticLvm(num_pvs, num_lvs, cmd_seconds)
+    cmdhandler._t_call = lvm.call_lvm
+
+    paths = []
+    for p in load_pvs()[0]:
+        cfg.om.register_object(p)
+        paths.append(p.dbus_object_path())
+
+    state = VgState('vg-uuid', VG_NAME, 'lvm2', 0, 0, '', EXTENT_SIZE, 0, 0,
+                    '', 0, 0, num_pvs, num_lvs, 0, 1, num_pvs, 0, 0, num_pvs,
+                    'wz--n-', '', paths, [])
+    vg = Vg(cfg.om.get_object_path_by_lvm_id(
+        'vg-uuid', VG_NAME, lambda: cfg.VG_OBJ_PATH + '/0'), state)
+    cfg.om.register_object(vg)
+    return lvm, vg
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--pvs', type='int', default=64,
+                      help='Number of PVs in the VG')
+    parser.add_option('--lvs', type='int', default=512,
+                      help='Number of LVs in the VG')
+    parser.add_option('--cmd-ms', type='float', default=30.0,
+                      help='Time each lvm command takes')
+    parser.add_option('--rounds', type='int', default=3,
+                      help='Number of times to refresh the PVs')
+    parser.add_option('--tree', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'lvmdbus'),
+        help='Directory holding the lvmdbus sources to benchmark')
+    options = parser.parse_args()[0]
+
+    sys.path.insert(0, options.tree)
+    import cfg
+    lvm, vg = setup(options.pvs, options.lvs, options.cmd_ms / 1000.0)
+
+    def _one_at_a_time():
+        for p in vg.Pvs:
+            cfg.om.get_by_path(p).refresh()
+
+    for name, method in (('one at a time', _one_at_a_time),
+                         ('refresh_pvs', vg.refresh_pvs)):
+        lvm.commands = 0
+        start = time.time()
+        for i in range(options.rounds):
+            lvm.change('round%d' % i)
+            method()
+        elapsed = time.time() - start
+
+        print('%-14s pvs= %d, lvm commands/refresh= %d, time/refresh= '
+              '%.1f ms' % (name, options.pvs,
+                           lvm.commands / options.rounds,
+                           elapsed * 1000 / options.rounds))
+
+if __name__ == '__main__':
+    main()
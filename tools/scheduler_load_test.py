@@ -0,0 +1,158 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Load test for the request scheduler.  Issues a mix of operations across a
+# number of VGs, with the lvm command of each operation simulated by a sleep
+# of typical duration, and reports the throughput for different numbers of
+# worker threads.  Also checks that operations on the same VG never overlap
+# and complete in the order they were queued.
+#
+#   $ ./tools/scheduler_load_test.py --vgs 50 --ops 1000 --workers 1,4,16
+
+import os
+import sys
+import time
+import random
+import threading
+import optparse
+import Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lvmdbus'))
+from scheduler import RequestScheduler, EXCLUSIVE
+
+# Simulated duration of the lvm command for each operation, seconds
+OPERATIONS = [('Vg.LvCreateRaid', 0.200),
+              ('Vg.LvCreateLinear', 0.080),
+              ('Lv.Remove', 0.050),
+              ('Lv.TagsAdd', 0.020),
+              ('Pv.AllocationEnabled', 0.020)]
+
+
+class FakeRequest(object):
+    def __init__(self, seq, vg, name, duration, tracker):
+        self.seq = seq
+        self.vg = vg
+        self.name = name
+        self.duration = duration
+        self.tracker = tracker
+        self.arguments = ('uuid', vg)
+        self.lock_keys = None
+        if vg == EXCLUSIVE:
+            self.lock_keys = [EXCLUSIVE]
+
+    def run_cmd(self):
+        self.tracker.start(self)
+        time.sleep(self.duration)
+        self.tracker.end(self)
+
+
+class Tracker(object):
+    def __init__(self, total):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.last_seq = {}
+        self.remaining = total
+        self.errors = []
+        self.done = threading.Event()
+
+    def start(self, r):
+        with self.lock:
+            if self.active.get(r.vg, 0) or \
+                    (r.vg == EXCLUSIVE and sum(self.active.values())) or \
+                    self.active.get(EXCLUSIVE, 0):
+                self.errors.append('%s overlapped on %s' % (r.name, r.vg))
+            if self.last_seq.get(r.vg, -1) > r.seq:
+                self.errors.append('%s out of order on %s' % (r.name, r.vg))
+            self.last_seq[r.vg] = r.seq
+            self.active[r.vg] = self.active.get(r.vg, 0) + 1
+
+    def end(self, r):
+        with self.lock:
+            self.active[r.vg] -= 1
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+
+def worker(q, stop):
+    while not stop.is_set():
+        try:
+            req = q.get(True, 0.5)
+            try:
+                req.run_cmd()
+            finally:
+                q.task_done(req)
+        except Queue.Empty:
+            pass
+
+
+def run(num_workers, num_vgs, num_ops, refresh_every, seed):
+    rand = random.Random(seed)
+    requests = []
+    tracker = Tracker(num_ops)
+
+    for i in range(num_ops):
+        if refresh_every and i and i % refresh_every == 0:
+            requests.append(FakeRequest(i, EXCLUSIVE, 'Refresh', 0.100,
+                                        tracker))
+        else:
+            name, duration = rand.choice(OPERATIONS)
+            vg = 'vg%02d' % rand.randrange(num_vgs)
+            requests.append(FakeRequest(i, vg, name, duration, tracker))
+
+    q = RequestScheduler()
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker, args=(q, stop))
+               for _ in range(num_workers)]
+    for t in threads:
+        t.start()
+
+    start = time.time()
+    for r in requests:
+        q.put(r)
+    tracker.done.wait()
+    elapsed = time.time() - start
+
+    stop.set()
+    for t in threads:
+        t.join()
+
+    return elapsed, tracker.errors
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--vgs', type='int', default=50)
+    parser.add_option('--ops', type='int', default=1000)
+    parser.add_option('--workers', default='1,4,16',
+                      help='Comma separated worker counts to try')
+    parser.add_option('--refresh-every', type='int', default=0,
+                      help='Queue an exclusive refresh every N operations')
+    parser.add_option('--seed', type='int', default=0)
+    options = parser.parse_args()[0]
+
+    for w in [int(x) for x in options.workers.split(',')]:
+        elapsed, errors = run(w, options.vgs, options.ops,
+                              options.refresh_every, options.seed)
+        print('workers= %3d, vgs= %d, ops= %d, time= %.2f s, '
+              'throughput= %.1f ops/s, errors= %d' %
+              (w, options.vgs, options.ops, elapsed, options.ops / elapsed,
+               len(errors)))
+        for e in errors[:10]:
+            print('  ' + e)
+
+if __name__ == '__main__':
+    main()
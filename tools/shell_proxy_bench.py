@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Measures how much CPU the daemon burns while it waits on the lvm shell.
+#
+# By default a fake lvm shell is used which takes a while to answer and then
+# prints a report of N LVs, so this can be run anywhere.  Use --lvm to point
+# it at a real lvm binary instead (the report then comes from the system).
+#
+# Run it on two different trees to compare them, eg.
+#   $ ./tools/shell_proxy_bench.py --lvs 1000
+#   $ ./tools/shell_proxy_bench.py --lvs 1000 --tree /path/to/other/lvmdbus
+
+import os
+import sys
+import time
+import tempfile
+import optparse
+
+_FAKE_SHELL = '''#!%s
+import sys
+import time
+
+row = '  lv_%%05d{|}vg{|}-wi-a-----{|}1073741824\\n'
+report = ''.join(row %% i for i in range(%d))
+
+sys.stdout.write('lvm> ')
+sys.stdout.flush()
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    sys.stdout.write(line)
+    sys.stdout.flush()
+    time.sleep(%f)
+    sys.stdout.write(report)
+    sys.stdout.write('lvm> ')
+    sys.stdout.flush()
+'''
+
+
+def fake_shell(num_lvs, delay):
+    fd, path = tempfile.mkstemp(suffix='-fake-lvm')
+    os.write(fd, _FAKE_SHELL % (sys.executable, num_lvs, delay))
+    os.close(fd)
+    os.chmod(path, 0700)
+    return path
+
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--lvs', type='int', default=1000,
+                      help='Number of LVs the fake shell reports')
+    parser.add_option('--calls', type='int', default=20,
+                      help='Number of lvs calls to make')
+    parser.add_option('--delay', type='float', default=0.2,
+                      help='Seconds the fake shell takes to answer')
+    parser.add_option('--lvm', default=None,
+                      help='Use this lvm binary instead of the fake shell')
+    parser.add_option('--tree', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'lvmdbus'),
+        help='Directory holding lvm_shell_proxy.py to benchmark')
+    options = parser.parse_args()[0]
+
+    lvm = options.lvm
+    if not lvm:
+        lvm = fake_shell(options.lvs, options.delay)
+
+    os.environ['LVM_DBUSCMD'] = lvm
+    sys.path.insert(0, options.tree)
+    from lvm_shell_proxy import LVMShellProxy
+
+    try:
+        shell = LVMShellProxy()
+
+        cpu_start = cpu_time()
+        wall_start = time.time()
+        for i in range(options.calls):
+            shell.call_lvm(['lvs', '--noheading', '--separator', '{|}',
+                            '-o', 'lv_name,vg_name,lv_attr,lv_size'])
+        cpu = cpu_time() - cpu_start
+        wall = time.time() - wall_start
+
+        print('calls= %d, wall/call= %.2f ms, cpu/call= %.2f ms '
+              '(%.1f%% of a core)' %
+              (options.calls, wall * 1000 / options.calls,
+               cpu * 1000 / options.calls, cpu * 100 / wall))
+    finally:
+        if not options.lvm:
+            os.unlink(lvm)
+
+if __name__ == '__main__':
+    main()
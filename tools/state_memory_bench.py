@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Measures the memory used by and the time taken to construct the states of
+# a large number of synthetic LVs.  Nothing is exported on the bus, so this
+# doesn't need lvm or a running dbus daemon, only dbus-python.
+#
+# Run it on two different trees to compare them, eg.
+#   $ ./tools/state_memory_bench.py --lvs 50000
+#   $ ./tools/state_memory_bench.py --lvs 50000 --tree /path/to/other/lvmdbus
+
+import os
+import sys
+import time
+import optparse
+
+
+def rss_kib():
+    # Resident set size of this process
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--lvs', type='int', default=50000,
+                      help='Number of LV states to create')
+    parser.add_option('--tree', default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'lvmdbus'),
+        help='Directory holding the lvmdbus sources to benchmark')
+    options = parser.parse_args()[0]
+
+    sys.path.insert(0, options.tree)
+    import dbus
+    import cfg
+    from objectmanager import ObjectManager
+    from lv import LvState
+
+    cfg.om = ObjectManager(cfg.BASE_OBJ_PATH, cfg.BASE_INTERFACE)
+
+    # Create the VG path and the lists up front so we only count the states
+    cfg.om.get_object_path_by_lvm_id('vg-uuid', 'vg',
+                                     lambda: cfg.VG_OBJ_PATH + '/0')
+    devices = dbus.Array([], signature="(oa(tts))")
+    seg_types = dbus.Array(['linear'], signature='s')
+
+    rc = []
+    rss_start = rss_kib()
+    start = time.time()
+    for i in range(options.lvs):
+        rc.append(LvState('lv-uuid-%06d' % i, 'lv%06d' % i,
+                          '/dev/vg/lv%06d' % i, 1073741824L, 'vg',
+                          'vg-uuid', '', '', '', '', 0, 0, '-wi-a-----', '',
+                          devices, seg_types))
+    elapsed = time.time() - start
+    rss = rss_kib() - rss_start
+
+    print('lvs= %d, time= %.2f s, rss= %d KiB, bytes/lv= %d' %
+          (options.lvs, elapsed, rss, rss * 1024 / options.lvs))
+
+if __name__ == '__main__':
+    main()